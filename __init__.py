@@ -3,6 +3,7 @@ import bpy
 from bpy.props import IntVectorProperty
 
 
+from . import handlers
 from .preferences import RAPreferences
 from .properties import (
     RAMaterialProps, RAMaterialsDB, RAObjectProps, RASceneProps
@@ -10,11 +11,12 @@ from .properties import (
 from .lists import RA_UL_materialdb
 from .panels import (
     RA_PT_material, RA_PT_simulation, RA_PT_object, RA_PT_materialdb,
-    RA_PT_rendering
+    RA_PT_rendering, RA_PT_auralization
 )
 from .operators import (
-    RA_OT_run, RA_OT_debug, RA_OT_new_mat, RA_OT_del_mat, RA_OT_mv_mat,
-    RA_OT_save_mat, RA_OT_load_mat
+    RA_OT_run, RA_OT_cancel, RA_OT_debug, RA_OT_new_mat, RA_OT_del_mat,
+    RA_OT_mv_mat, RA_OT_save_mat, RA_OT_load_mat, RA_OT_make_proxy,
+    RA_OT_reevaluate, RA_OT_export_irs, RA_OT_auralize
 )
 
 bl_info = {
@@ -45,8 +47,10 @@ classes = (
 
     # operators
     RA_OT_run,
+    RA_OT_cancel,
     RA_OT_debug,
     RA_OT_new_mat, RA_OT_del_mat, RA_OT_mv_mat, RA_OT_save_mat, RA_OT_load_mat,
+    RA_OT_make_proxy, RA_OT_reevaluate, RA_OT_export_irs, RA_OT_auralize,
 
     # panels
     RA_PT_material,
@@ -54,7 +58,8 @@ classes = (
     RA_PT_object,
     RA_UL_materialdb,
     RA_PT_materialdb,
-    RA_PT_rendering
+    RA_PT_rendering,
+    RA_PT_auralization
 )
 
 
@@ -69,8 +74,10 @@ def register():
         bpy.utils.register_class(cls)
 
     setup_properties()
+    handlers.register()
 
 
 def unregister():
+    handlers.unregister()
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
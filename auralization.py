@@ -0,0 +1,338 @@
+import os
+import shutil
+import tempfile
+import threading
+import wave
+
+import numpy as np
+
+from . import parallel
+from .parallel import JobCancelled
+
+# frames of dry audio convolved at a time by the overlap-add
+BLOCK_SIZE = 1 << 16
+# frames of output convolved by each parallel task
+SEGMENT_SIZE = 1 << 22
+# the loudest sample of a set of files written, relative to full scale
+HEADROOM = 0.9
+
+
+def band_edges(freq):
+    """(n_bands, 2) edges of the octave bands centered at `freq` [Hz]
+
+    The first band extends down to 0 Hz and the last one up to any frequency,
+    so the bands cover the whole spectrum.
+    """
+    freq = np.asarray(freq, dtype=np.float64)
+    edges = np.stack((freq / np.sqrt(2.0), freq * np.sqrt(2.0)), axis=1)
+    edges[0, 0] = 0.0
+    edges[-1, 1] = np.inf
+    return edges
+
+
+def synthesize(histogram, freq, dt, fs, seed=0):
+    """Impulse response of a (n_bands, n_bins) energy `histogram`
+
+    Each band is white noise filtered to its octave band, scaled so its
+    energy in each bin of `dt` seconds is that of the histogram, the bands
+    summed. Returns the ir sampled at `fs` Hz, `seed` seeds the noise.
+    """
+    n_bins = histogram.shape[-1]
+    n = max(1, int(round(n_bins * dt * fs)))
+    spectrum = np.fft.rfft(np.random.RandomState(seed).standard_normal(n))
+    f = np.fft.rfftfreq(n, 1.0 / fs)
+    bins = np.minimum((np.arange(n) / (fs * dt)).astype(np.int64), n_bins - 1)
+    ir = np.zeros(n)
+    for band, (lo, hi) in enumerate(band_edges(freq)):
+        noise = np.fft.irfft(np.where((f >= lo) & (f < hi), spectrum, 0), n)
+        power = np.bincount(bins, weights=noise ** 2, minlength=n_bins)
+        gain = np.sqrt(histogram[band] / np.maximum(power, 1e-30))
+        ir += noise * gain[bins]
+    return ir
+
+
+def fft_size(n):
+    return 1 << max(0, int(np.ceil(np.log2(n))))
+
+
+def pcm_decode(data, width, channels):
+    """Samples in [-1, 1) of little endian PCM `data`, mixed down to mono"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if width == 1:
+        samples = (raw.astype(np.float64) - 128.0) / 128.0
+    elif width == 3:
+        padded = np.zeros((len(raw) // 3, 4), dtype=np.uint8)
+        padded[:, 1:] = raw.reshape((-1, 3))
+        samples = padded.view('<i4')[:, 0] / 2.0 ** 31
+    else:
+        samples = np.frombuffer(data, dtype=f'<i{width}') / 2.0 ** (
+            8 * width - 1
+        )
+    return samples.reshape((-1, channels)).mean(axis=1)
+
+
+def pcm24(samples):
+    """24 bit little endian PCM of samples in [-1, 1]"""
+    ints = np.round(np.clip(samples, -1.0, 1.0) * (2 ** 23 - 1))
+    return ints.astype('<i4').view(np.uint8).reshape((-1, 4))[:, :3].tobytes()
+
+
+def read_frames(wf, start, count):
+    """`count` frames of the open wave file `wf` from `start`, in mono
+
+    Zeros outside the file.
+    """
+    out = np.zeros(count)
+    a, b = max(start, 0), min(start + count, wf.getnframes())
+    if a < b:
+        wf.setpos(a)
+        out[a - start:b - start] = pcm_decode(
+            wf.readframes(b - a), wf.getsampwidth(), wf.getnchannels()
+        )
+    return out
+
+
+def write_wav(path, fs, samples, scale=1.0):
+    """Write `samples` times `scale` to a mono 24 bit WAV file
+
+    `samples` may be memory mapped, they are converted `BLOCK_SIZE` at a time.
+    """
+    with wave.open(str(path), 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(3)
+        wf.setframerate(int(fs))
+        for i in range(0, len(samples), BLOCK_SIZE):
+            wf.writeframes(pcm24(samples[i:i + BLOCK_SIZE] * scale))
+
+
+def synthesize_task(histograms, freq, dt, fs, seeds, out_path, index):
+    """Worker: the ir of the sum of `histograms`, to row `index` of `out_path`
+
+    Each histogram is synthesized with its seed from `seeds`. Returns the
+    peak of the ir.
+    """
+    ir = sum(
+        synthesize(h, freq, dt, fs, seed) for h, seed in zip(histograms, seeds)
+    )
+    out = np.load(out_path, mmap_mode='r+')
+    out[index] = ir
+    out.flush()
+    return float(np.abs(ir).max())
+
+
+def convolve_task(dry_path, ir_path, row, out_path, start, stop):
+    """Worker: frames [start, stop) of the dry audio convolved with an ir
+
+    The ir is row `row` of the .npy at `ir_path`. Block-wise FFT overlap-add,
+    `BLOCK_SIZE` frames at a time, from the dry frames whose tail reaches
+    `start` on, so segments are independent. Written to the same frames of the
+    .npy at `out_path`, returns their peak.
+    """
+    ir = np.load(ir_path, mmap_mode='r')[row]
+    size = fft_size(BLOCK_SIZE + len(ir) - 1)
+    response = np.fft.rfft(ir, size)
+    out = np.load(out_path, mmap_mode='r+')
+    # output from `pos` on, the frames before `pos + BLOCK_SIZE` are final
+    acc = np.zeros(size)
+    peak = 0.0
+    with wave.open(str(dry_path), 'rb') as wf:
+        pos = max(start - len(ir) + 1, 0)
+        while pos < stop:
+            if pos < wf.getnframes():
+                block = read_frames(wf, pos, BLOCK_SIZE)
+                acc += np.fft.irfft(np.fft.rfft(block, size) * response, size)
+            a, b = max(pos, start), min(pos + BLOCK_SIZE, stop)
+            if a < b:
+                out[a:b] = acc[a - pos:b - pos]
+                peak = max(peak, float(np.abs(acc[a - pos:b - pos]).max()))
+            acc[:-BLOCK_SIZE] = acc[BLOCK_SIZE:]
+            acc[-BLOCK_SIZE:] = 0.0
+            pos += BLOCK_SIZE
+    out.flush()
+    return peak
+
+
+def ir_seeds(n_srcs, n_recs):
+    """(n_srcs, n_recs) seeds of the noise of each source and receiver"""
+    return np.arange(n_srcs * n_recs).reshape((n_srcs, n_recs))
+
+
+def export_irs(
+    hist, freq, dt, fs, folder, src_names, rec_names, wav=True, npy=True,
+    pool=None, step=None
+):
+    """Write the impulse responses of (n_srcs, n_recs, n_bands, n_bins) `hist`
+
+    They are synthesized over the process `pool` if given, see `synthesize`,
+    straight into the memory mapped `irs.npy` (n_srcs, n_recs, n_samples) in
+    `folder`, a scratch file unless `npy`. With `wav`, they are then streamed
+    to `<source>-<receiver>.wav` files, all at the same scale so their levels
+    compare. Returns the paths of the files written. `step(stage, progress)`
+    is called as the work progresses.
+    """
+    def stage(name):
+        return None if step is None else (lambda p: step(name, p))
+
+    hist = np.asarray(hist)
+    n_srcs, n_recs, _, n_bins = hist.shape
+    n = max(1, int(round(n_bins * dt * fs)))
+    scratch = tempfile.mkdtemp(prefix='ra-ir-', dir=folder)
+    try:
+        path = os.path.join(folder if npy else scratch, "irs.npy")
+        np.lib.format.open_memmap(
+            path, mode='w+', dtype=np.float32, shape=(n_srcs, n_recs, n)
+        ).flush()
+        seeds = ir_seeds(n_srcs, n_recs)
+        peaks = parallel.run_tasks(pool, synthesize_task, [
+            (hist[si, ri][None], freq, dt, fs, [seeds[si, ri]], path,
+             (si, ri))
+            for si in range(n_srcs) for ri in range(n_recs)
+        ], stage("impulse responses"))
+        paths = [path] if npy else []
+        if wav:
+            irs = np.load(path, mmap_mode='r')
+            scale = HEADROOM / max(max(peaks, default=0.0), 1e-30)
+            for si, src in enumerate(src_names):
+                if step is not None:
+                    step("writing", si / n_srcs)
+                for ri, rec in enumerate(rec_names):
+                    paths.append(os.path.join(folder, f"{src}-{rec}.wav"))
+                    write_wav(paths[-1], fs, irs[si, ri], scale)
+        return paths
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def auralize(
+    hist, freq, dt, dry_path, folder, rec_names, pool=None, step=None
+):
+    """Convolve the dry audio of the WAV file `dry_path` with the receivers
+
+    Every source plays the dry audio (mixed down to mono), so the ir of a
+    receiver is that of the histograms of all the sources summed, with the
+    noise of `export_irs`. The convolution is split in segments of
+    `SEGMENT_SIZE` frames per receiver, over the process `pool` if given, see
+    `convolve_task`, so the memory used does not depend on the length of the
+    audio. Writes `<receiver>-<dry name>.wav` in `folder`, all at the same
+    scale, and returns their paths. `step(stage, progress)` is called as the
+    work progresses.
+    """
+    def stage(name):
+        return None if step is None else (lambda p: step(name, p))
+
+    hist = np.asarray(hist)
+    n_srcs, n_recs = hist.shape[:2]
+    with wave.open(str(dry_path), 'rb') as wf:
+        fs = wf.getframerate()
+        n_frames = wf.getnframes()
+    n = max(1, int(round(hist.shape[-1] * dt * fs)))
+    length = n_frames + n - 1
+    scratch = tempfile.mkdtemp(prefix='ra-auralization-', dir=folder)
+    try:
+        ir_path = os.path.join(scratch, "irs.npy")
+        np.lib.format.open_memmap(
+            ir_path, mode='w+', dtype=np.float64, shape=(n_recs, n)
+        ).flush()
+        seeds = ir_seeds(n_srcs, n_recs)
+        parallel.run_tasks(pool, synthesize_task, [
+            (hist[:, ri], freq, dt, fs, seeds[:, ri], ir_path, ri)
+            for ri in range(n_recs)
+        ], stage("impulse responses"))
+
+        tasks = []
+        for ri in range(n_recs):
+            out_path = os.path.join(scratch, f"out-{ri}.npy")
+            np.lib.format.open_memmap(
+                out_path, mode='w+', dtype=np.float32, shape=(length,)
+            ).flush()
+            tasks += [
+                (dry_path, ir_path, ri, out_path, start,
+                 min(start + SEGMENT_SIZE, length))
+                for start in range(0, length, SEGMENT_SIZE)
+            ]
+        peaks = parallel.run_tasks(
+            pool, convolve_task, tasks, stage("convolution")
+        )
+
+        scale = HEADROOM / max(max(peaks, default=0.0), 1e-30)
+        name = os.path.splitext(os.path.basename(dry_path))[0]
+        paths = []
+        for ri, rec in enumerate(rec_names):
+            if step is not None:
+                step("writing", ri / n_recs)
+            paths.append(os.path.join(folder, f"{rec}-{name}.wav"))
+            write_wav(
+                paths[-1], fs,
+                np.load(os.path.join(scratch, f"out-{ri}.npy"), mmap_mode='r'),
+                scale
+            )
+        return paths
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+class AuralizationJob:
+    """Runs `auralize` or `export_irs` in a background thread
+
+    See `jobs.SimulationJob`: `task(*args, pool=..., step=..., **kwargs)` is
+    run over a process pool of `workers`, created by `start` (so from the
+    main thread) when `workers` > 1. The main thread polls `progress`,
+    `stage` and `done`, and may `cancel`, honored as the tasks of the pool
+    complete. The files written are in `paths`.
+    """
+
+    def __init__(self, task, *args, workers=1, **kwargs):
+        self.task = task
+        self.args = args
+        self.kwargs = kwargs
+        self.workers = workers
+
+        self.progress = 0.0
+        self.stage = "queued"
+        self.paths = None
+        self.error = None
+
+        self.pool = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.workers > 1 and parallel.available():
+            self.pool = parallel.pool(self.workers)
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    def step(self, stage, progress):
+        if self.cancelled:
+            raise JobCancelled()
+        self.stage = stage
+        self.progress = progress
+
+    def run(self):
+        try:
+            self.paths = self.task(
+                *self.args, pool=self.pool, step=self.step, **self.kwargs
+            )
+        except JobCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.pool is not None:
+                # tasks cancelled while running are left to finish on their own
+                self.pool.shutdown(wait=False)
+                self.pool = None
+
+
+current_job = None
@@ -0,0 +1,327 @@
+"""Benchmarks of the add-on hot paths, over scalable synthetic rooms
+
+Runs headless, and needs no GPU:
+
+    blender --background --python benchmark.py -- \
+        --subdivide 0 9 31 --tiles 1 4 --rays 1000 10000 --sources 1 4
+
+Rooms are built from `sim_room.dae`, its faces subdivided `--subdivide` times
+and the room tiled over a `--tiles` x `--tiles` grid. For each room the
+geometry extraction (cold and warm geometry cache), material resolution,
+plane dicts building and cache keys are timed. Synthetic ray histories of
+every `--rays` x `--sources` combination, inside the first room, are then
+built to time the ray buffers used by the rendering and the handling of
+results (saving, loading).
+
+Every case is appended to the `--output` JSON lines file, in the same format
+as the `profile_log` of the runs, with the best and median times of
+`--repeat` repetitions. `--compare` prints the ratio to the latest matching
+case of the given file.
+"""
+import argparse
+import json
+import pathlib
+import sys
+
+if __name__ == '__main__' and not __package__:
+    # executed as a script by `blender --python`, see `script.run`
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+    import script
+    sys.exit(script.run(__file__, 'benchmark'))
+
+import datetime
+import platform
+import subprocess
+import tempfile
+import time
+
+import bmesh
+import bpy
+from mathutils import Vector
+import numpy as np
+
+from . import cache, geometry, materials, rendering, results, simulation
+from .cli import ensure_registered, load_scene
+from .profiling import Profile
+from .script import script_args
+
+ROOM = pathlib.Path(__file__).resolve().parent / 'sim_room.dae'
+
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = script_args()
+
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py", description="Benchmark the add-on hot paths"
+    )
+    parser.add_argument(
+        '--room', type=pathlib.Path, default=ROOM,
+        help="room the synthetic rooms are built from"
+    )
+    parser.add_argument(
+        '--subdivide', type=int, nargs='+', default=[0, 9, 31],
+        help="number of cuts of each edge of the room"
+    )
+    parser.add_argument(
+        '--tiles', type=int, nargs='+', default=[1, 4],
+        help="size of the grid of rooms"
+    )
+    parser.add_argument(
+        '--rays', type=int, nargs='+', default=[1000, 10000],
+        help="rays per source of the synthetic histories"
+    )
+    parser.add_argument(
+        '--sources', type=int, nargs='+', default=[1, 4],
+        help="number of sources of the synthetic histories"
+    )
+    parser.add_argument(
+        '--reflections', type=float, default=20.0,
+        help="mean number of reflections of the synthetic rays"
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help="repetitions of each case, the best one is kept"
+    )
+    parser.add_argument(
+        '-o', '--output', type=pathlib.Path,
+        default=pathlib.Path('benchmarks.jsonl'),
+        help="JSON lines file the results are appended to"
+    )
+    parser.add_argument(
+        '--compare', type=pathlib.Path, default=None,
+        help="JSON lines file of a previous run to compare with"
+    )
+    return parser.parse_args(argv)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOM.parent,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+            universal_newlines=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(fn, repeat):
+    """Best and median times of `repeat` calls of `fn`, and its last result"""
+    times = []
+    for _ in range(max(1, repeat)):
+        tic = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - tic)
+    return min(times), float(np.median(times)), result
+
+
+def build_room(path, cuts, tiles):
+    """Load the room at `path`, subdivide and tile it
+
+    Every mesh gets a default material, and the materials database a single
+    entry, so the room can be simulated as is.
+    """
+    scene = load_scene(path)
+    library = materials.MaterialLibrary([0], ["benchmark"], [[0.1] * 8])
+    library.to_mat_db(scene.ra.mat_db)
+    scene.ra.mat_db_max_index = 0
+    default_mat = bpy.data.materials.new("RA benchmark")
+
+    rooms = [obj for obj in scene.objects if obj.type == 'MESH']
+    for obj in rooms:
+        obj.ra.nature = 'GEOM'
+        if len(obj.material_slots) == 0:
+            obj.data.materials.append(default_mat)
+        if cuts > 0:
+            bm = bmesh.new()
+            bm.from_mesh(obj.data)
+            bmesh.ops.subdivide_edges(
+                bm, edges=bm.edges[:], cuts=cuts, use_grid_fill=True
+            )
+            bm.to_mesh(obj.data)
+            bm.free()
+
+    corners = np.array([
+        obj.matrix_world @ Vector(c) for obj in rooms for c in obj.bound_box
+    ])
+    size = corners.max(axis=0) - corners.min(axis=0)
+    for i in range(tiles):
+        for j in range(tiles):
+            if i == j == 0:
+                continue
+            for obj in rooms:
+                # the copies share the mesh of the original
+                tile = obj.copy()
+                tile.location.x += i * size[0]
+                tile.location.y += j * size[1]
+                scene.collection.objects.link(tile)
+    bpy.context.view_layer.update()
+    return scene
+
+
+def synthetic_sources(n_sources, n_rays, reflections, lo, hi, seed=0):
+    """Sources with random ray histories inside the box (`lo`, `hi`)"""
+    rng = np.random.RandomState(seed)
+    sources = []
+    for _ in range(n_sources):
+        lengths = rng.poisson(reflections, n_rays)
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        points = rng.uniform(lo, hi, (int(offsets[-1]), 3)).astype(np.float32)
+        sources.append(results.SourceResult(
+            tuple(rng.uniform(lo, hi)),
+            results.RayHistories(points, offsets)
+        ))
+    return sources
+
+
+def bench_room(scene, repeat):
+    """Extraction and material resolution cases, returns the planes too"""
+    cases = []
+    resolver = materials.material_resolver
+
+    def cold():
+        geometry.geometry_cache.clear()
+        resolver.invalidate()
+        return simulation.collect(scene)[0]
+
+    best, median, planes = measure(cold, repeat)
+    cases.append(('extract cold', best, median, len(planes)))
+    best, median, _ = measure(lambda: simulation.collect(scene), repeat)
+    cases.append(('extract warm', best, median, len(planes)))
+
+    objs = [
+        (obj, geometry.geometry_cache.get(obj)[3]) for obj in scene.objects
+        if obj.ra.enable and obj.ra.nature == 'GEOM' and obj.type == 'MESH'
+    ]
+
+    def resolve():
+        resolver.invalidate()
+        resolver.update(scene.ra.mat_db)
+        for obj, slot_index in objs:
+            resolver.resolve(obj, slot_index)
+
+    best, median, _ = measure(resolve, repeat)
+    cases.append(('resolve materials', best, median, len(planes)))
+    best, median, _ = measure(planes.to_dicts, repeat)
+    cases.append(('plane dicts', best, median, len(planes)))
+    best, median, _ = measure(
+        lambda: cache.result_key(planes, [], [], {}, {}), repeat
+    )
+    cases.append(('result key', best, median, len(planes)))
+    return cases, planes
+
+
+def bench_results(sources, repeat):
+    """Ray buffers and results handling cases"""
+    cases = []
+    segments = sum(int(s.histories.offsets[-1]) for s in sources)
+
+    def buffers():
+        for s in sources:
+            positions, indices, orders, travelled = rendering.ray_buffers(
+                s.coord, s.histories
+            )
+            vert_offsets, seg_offsets = rendering.ray_ranges(orders)
+            rendering.ray_bounds(positions, vert_offsets)
+        return seg_offsets
+
+    best, median, seg_offsets = measure(buffers, repeat)
+    cases.append(('ray buffers', best, median, segments))
+
+    priority = np.random.RandomState(0).permutation(len(seg_offsets) - 1)
+    best, median, _ = measure(
+        lambda: rendering.lod_segments(seg_offsets, priority, 200000), repeat
+    )
+    cases.append(('lod segments', best, median, min(segments, 200000)))
+
+    with tempfile.TemporaryDirectory(prefix='ra-bench-') as folder:
+        path = pathlib.Path(folder) / 'results.ra'
+        best, median, _ = measure(
+            lambda: results.save_mapped(path, sources, {}), repeat
+        )
+        cases.append(('save mapped', best, median, segments))
+
+        def load():
+            loaded, _, _ = results.load_mapped(path)
+            # page everything in, as drawing would
+            return sum(float(s.histories.points.sum()) for s in loaded)
+
+        best, median, _ = measure(load, repeat)
+        cases.append(('load mapped', best, median, segments))
+
+        path = pathlib.Path(folder) / 'results.npz'
+        best, median, _ = measure(
+            lambda: results.save_npz(path, sources, {}), repeat
+        )
+        cases.append(('save npz', best, median, segments))
+    return cases
+
+
+def latest(path):
+    """Latest record of each case of a JSON lines benchmark file"""
+    records = {}
+    with open(path) as f:
+        for line in f:
+            r = json.loads(line)
+            records[case_key(r)] = r
+    return records
+
+
+def case_key(record):
+    return tuple(
+        record.get(k)
+        for k in ('stage', 'subdivide', 'tiles', 'rays', 'sources')
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ensure_registered()
+    previous = latest(args.compare) if args.compare is not None else {}
+    profile = Profile(
+        log_path=args.output,
+        run=datetime.datetime.now().isoformat(timespec='seconds'),
+        revision=git_revision(),
+        blender=bpy.app.version_string,
+        python=platform.python_version(),
+        numpy=np.__version__,
+        machine=platform.machine(),
+    )
+
+    def record(cases, **params):
+        for stage, best, median, items in cases:
+            r = dict(
+                stage=stage, time=best, median=median, items=items,
+                throughput=items / best if best > 0 else None, **params
+            )
+            profile.add(r)
+            line = (
+                f"{stage:>18} {params}: {best * 1e3:9.2f} ms, "
+                f"{items} items"
+            )
+            old = previous.get(case_key(r))
+            if old is not None and best > 0:
+                line += f", x{old['time'] / best:.2f} vs previous"
+            print(line)
+
+    bounds = None
+    for cuts in args.subdivide:
+        for tiles in args.tiles:
+            scene = build_room(args.room.resolve(), cuts, tiles)
+            cases, planes = bench_room(scene, args.repeat)
+            record(cases, subdivide=cuts, tiles=tiles)
+            if bounds is None:
+                points = planes.vertices.reshape((-1, 3))
+                bounds = points.min(axis=0), points.max(axis=0)
+
+    for n_rays in args.rays:
+        for n_sources in args.sources:
+            sources = synthetic_sources(
+                n_sources, n_rays, args.reflections, *bounds
+            )
+            record(
+                bench_results(sources, args.repeat), rays=n_rays,
+                sources=n_sources
+            )
+    return 0
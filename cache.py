@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import pathlib
+
+import numpy as np
+
+from . import results
+from .parallel import TABLE_COLUMNS
+
+
+def result_key(planes, srcs, recs, alg_configs, air_properties, grid=None):
+    """Content hash of everything the ray tracing results depend on
+
+    `grid` are the (m, 3) points of the receiver grids, if any.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for column in TABLE_COLUMNS:
+        h.update(np.ascontiguousarray(getattr(planes, column)).tobytes())
+    if planes.offsets is not None:
+        h.update(planes.offsets.tobytes())
+    if grid is not None and len(grid):
+        h.update(np.ascontiguousarray(grid, dtype=np.float64).tobytes())
+    h.update(json.dumps(
+        [srcs, recs, alg_configs, air_properties], sort_keys=True, default=list
+    ).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """On disk cache of simulation results, keyed by `result_key`
+
+    Entries are memory mapped results files (see `results.save_mapped`), so a
+    hit reads nothing but their header. Every entry has the receiver
+    `histograms` of its run, which can not be recomputed from the ray
+    histories alone. Their modification time is refreshed
+    on every hit, the least recently used ones are evicted once the folder
+    grows beyond `max_bytes` (0 for no limit).
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = pathlib.Path(folder)
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return self.folder / f"{key}.ra"
+
+    def get(self, key):
+        """Cached `(sources, meta, arrays)` for `key`, or None"""
+        path = self.path(key)
+        try:
+            entry = results.load_mapped(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        if 'histograms' not in entry[2]:
+            # written before the histograms were cached
+            return None
+        os.utime(path)
+        return entry
+
+    def put(self, key, sources, meta, histograms, **arrays):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        # written aside and renamed, so readers never see partial entries
+        results.save_mapped(
+            self.path(key), sources, meta, histograms=histograms, **arrays
+        )
+        self.evict()
+
+    def evict(self):
+        if self.max_bytes <= 0:
+            return
+        entries = sorted(
+            (p.stat().st_mtime, p.stat().st_size, p)
+            for p in self.folder.glob('*.ra')
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                # still mapped, where that prevents removal
+                continue
+            total -= size
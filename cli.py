@@ -0,0 +1,240 @@
+"""Headless batch runs, without the blender UI
+
+Runs every scene with every simulation config in a single blender process:
+
+    blender --background --python cli.py -- \
+        room.blend sim_room.dae --config a.toml --config b.toml --output out
+
+Scenes are .blend files or COLLADA (.dae) files. The configs use the toml
+format read by the `sim_cfgs` scene property, plus the optional tables below,
+which are mostly useful for COLLADA scenes since those carry no acoustic
+properties:
+
+    [[materials]]         # replaces the materials database
+    id = 0
+    description = "concrete"
+    alpha = [0.01, 0.01, 0.02, 0.02, 0.03, 0.04, 0.05, 0.05]
+
+    [geometry]            # for mesh objects without a material
+    mat_id = 0
+    scattering = 0.1
+
+    [[sources]]           # added to the scene as SOURCE objects
+    coord = [10.0, 0.0, 1.5]
+    power_dB = [80.0, 80.0, 80.0, 80.0, 80.0, 80.0, 80.0, 80.0]
+    eq_dB = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    delay = 0.0
+
+    [[receivers]]         # added to the scene as RECEIVER objects
+    coord = [15.0, 2.0, 1.2]
+
+The results of each run are written to `<output>/<scene>[-<config>].npz`, see
+`results.save_npz`: the ray histories, the `histograms` of every source at
+every receiver (named in the meta), the statistical reverberation (the
+`sabine` and `eyring` reverberation times per band, and the room volume and
+area in the meta) and the receiver grid energies.
+"""
+import argparse
+import importlib
+import pathlib
+import sys
+
+if __name__ == '__main__' and not __package__:
+    # executed as a script by `blender --python`, see `script.run`
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+    import script
+    sys.exit(script.run(__file__, 'cli'))
+
+import time
+
+import bpy
+import toml
+
+from . import (
+    cache, grids, jobs, materials, results, reverberation, simulation
+)
+from .properties import update_sim_cfgs
+from .script import script_args
+
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = script_args()
+
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="Run room acoustics simulations headless"
+    )
+    parser.add_argument(
+        'scenes', nargs='+', type=pathlib.Path,
+        help=".blend or .dae files to simulate"
+    )
+    parser.add_argument(
+        '-c', '--config', action='append', type=pathlib.Path, default=[],
+        help="simulation config toml, may be repeated (default: the settings "
+            "saved in each scene)"
+    )
+    parser.add_argument(
+        '-o', '--output', type=pathlib.Path, default=pathlib.Path('.'),
+        help="folder the results are written to"
+    )
+    parser.add_argument(
+        '-j', '--workers', type=int, default=1,
+        help="number of worker processes tracing rays in parallel"
+    )
+    parser.add_argument(
+        '--rays-per-task', type=int, default=1000,
+        help="number of rays of a source traced by each parallel task"
+    )
+    parser.add_argument(
+        '--memory-budget', type=int, default=None,
+        help="memory a run may use, in MiB, 0 for no limit (default: the "
+            "budget saved in each scene)"
+    )
+    parser.add_argument(
+        '--cache', type=pathlib.Path, default=None,
+        help="folder of a results cache shared by the runs"
+    )
+    parser.add_argument(
+        '--cache-size', type=int, default=1024,
+        help="maximum size of the results cache, in MiB, 0 for no limit"
+    )
+    return parser.parse_args(argv)
+
+
+def ensure_registered():
+    if not hasattr(bpy.types.Scene, 'ra'):
+        importlib.import_module(__package__).register()
+
+
+def load_scene(path):
+    if path.suffix == '.blend':
+        bpy.ops.wm.open_mainfile(filepath=str(path))
+    elif path.suffix == '.dae':
+        bpy.ops.wm.read_homefile(use_empty=True)
+        bpy.ops.wm.collada_import(filepath=str(path))
+    else:
+        raise ValueError(f"Unsupported scene format: {path}")
+    return bpy.context.scene
+
+
+def add_empty(scene, name, nature, coord):
+    obj = bpy.data.objects.new(name, None)
+    scene.collection.objects.link(obj)
+    obj.location = coord
+    obj.ra.nature = nature
+    return obj
+
+
+def apply_config(scene, cfg):
+    update_sim_cfgs(cfg)
+
+    if 'materials' in cfg:
+        library = materials.MaterialLibrary(
+            [m['id'] for m in cfg['materials']],
+            [m.get('description', "--") for m in cfg['materials']],
+            [m['alpha'] for m in cfg['materials']]
+        )
+        library.to_mat_db(scene.ra.mat_db)
+        scene.ra.mat_db_max_index = int(library.ids.max(initial=-1))
+
+    if 'geometry' in cfg:
+        default_mat = bpy.data.materials.new("RA default")
+        default_mat.ra.mat_id = cfg['geometry'].get('mat_id', 0)
+        default_mat.ra.scattering = cfg['geometry'].get('scattering', 0.1)
+        for obj in scene.objects:
+            if obj.type == 'MESH' and len(obj.material_slots) == 0:
+                obj.data.materials.append(default_mat)
+
+    for i, src in enumerate(cfg.get('sources', [])):
+        obj = add_empty(scene, f"source.{i:03d}", 'SOURCE', src['coord'])
+        obj.ra.power_db = src.get('power_dB', obj.ra.power_db)
+        obj.ra.eq_db = src.get('eq_dB', obj.ra.eq_db)
+        obj.ra.delay = src.get('delay', obj.ra.delay)
+
+    for i, rec in enumerate(cfg.get('receivers', [])):
+        add_empty(scene, f"receiver.{i:03d}", 'RECEIVER', rec['coord'])
+
+
+def run(
+    scene, workers=1, chunk_size=1000, result_cache=None, memory_budget=None
+):
+    planes, srcs, recs = simulation.collect(scene)
+    cells, _ = grids.sample(simulation.receiver_grids(scene))
+    if memory_budget is None:
+        memory_budget = scene.ra.memory_budget
+    job = jobs.SimulationJob(
+        planes, srcs, recs,
+        simulation.alg_configs(scene), simulation.air_properties(scene),
+        workers=workers, chunk_size=chunk_size, cache=result_cache,
+        grid=cells.mean(axis=1), memory_budget=memory_budget * 2**20
+    )
+    job.run()
+    if job.error is not None:
+        if job.store_dir is not None:
+            results.discard_dir(job.store_dir)
+        raise job.error
+    return job
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ensure_registered()
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    configs = [(p.stem, toml.loads(p.read_text())) for p in args.config]
+    result_cache = None
+    if args.cache is not None:
+        result_cache = cache.ResultCache(args.cache, args.cache_size * 2**20)
+    failed = 0
+    for scene_path in args.scenes:
+        for cfg_name, cfg in configs or [(None, None)]:
+            name = scene_path.stem if cfg_name is None else (
+                f"{scene_path.stem}-{cfg_name}"
+            )
+            try:
+                # reloaded for every config, which may add objects to it
+                scene = load_scene(scene_path.resolve())
+                if cfg is not None:
+                    apply_config(scene, cfg)
+
+                tic = time.perf_counter()
+                job = run(
+                    scene, args.workers, args.rays_per_task, result_cache,
+                    args.memory_budget
+                )
+                elapsed = time.perf_counter() - tic
+            except Exception as e:
+                failed += 1
+                print(f"{name}: failed, {e}", file=sys.stderr)
+                continue
+
+            volume, area, sabine, eyring = reverberation.statistical(
+                job.planes, job.air_properties, job.alg_configs['freq']
+            )
+            results.save_npz(args.output / f"{name}.npz", job.sources, {
+                'scene': str(scene_path),
+                'title': scene.ra.title,
+                'alg_configs': job.alg_configs,
+                'air_properties': job.air_properties,
+                'n_triangles': job.planes.n_triangles,
+                'n_planes': len(job.planes),
+                'n_rays': job.rays_traced,
+                # the rows of the histograms
+                'sources': [o.name for o in simulation.sources(scene)],
+                'receivers': [o.name for o in simulation.receivers(scene)],
+                'volume': volume,
+                'area': area,
+                'elapsed': elapsed,
+            }, histograms=job.histograms, sabine=sabine, eyring=eyring,
+                grid_energy=job.grid_energy,
+                grid_cells=grids.sample(simulation.receiver_grids(scene))[0])
+            print(
+                f"{name}: done in {elapsed:.1f}s"
+                + (" (cached)" if job.cached else "")
+            )
+            if job.store_dir is not None:
+                # the histories spilled by a chunked run, mapped until the
+                # job is released
+                store_dir, job = job.store_dir, None
+                results.discard_dir(store_dir)
+    return 1 if failed else 0
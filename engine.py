@@ -0,0 +1,81 @@
+"""What the add-on relies on of the `ra` engine, besides its `Simulation` calls
+
+- `set_raydir` draws the initial directions of the `n_rays` rays of the
+  configs into `sims.rays.vinit`, a (n_rays, 3) array, and `run_raytracing`
+  traces the rays of those directions, so they can be overwritten in between.
+- after `run_raytracing`, every source of `sims.sources` has its `rays`, the
+  `refpts_hist` of each being its reflection points, and its `reced`, one per
+  receiver, the `reflectogram` of each being the (n_bands, n_bins) energy
+  histogram at the receiver, divided by the number of rays traced.
+
+This module imports neither `bpy` nor the add-on modules that do, so the
+worker processes of `parallel` can use it.
+"""
+import numpy as np
+from ra import simulation_api
+
+from .results import SourceResult
+
+
+def simulation(planes, recs, alg_configs, air_properties):
+    """A `Simulation` of `planes` and the receiver dicts `recs`
+
+    Set up in the order of the engine: configs, air, geometry, ray directions,
+    receivers and memory. Only its sources are left to set.
+    """
+    sims = simulation_api.Simulation()
+    sims.set_configs(alg_configs)
+    sims.set_air(air_properties)
+    sims.set_geometry(planes.to_dicts())
+    sims.set_raydir()
+    sims.set_receivers(recs)
+    sims.set_memory_init()
+    return sims
+
+
+def ray_directions(sims):
+    """A copy of the (n_rays, 3) initial ray directions of `sims`"""
+    return np.array(sims.rays.vinit, dtype=np.float64).reshape((-1, 3))
+
+
+def n_bins(alg_configs):
+    return max(1, int(round(alg_configs['ht_length'] / alg_configs['dt'])))
+
+
+def receiver_histograms(source, alg_configs):
+    """(n_recs, n_bands, n_bins) energy histograms of an engine source
+
+    Per ray traced, trimmed or padded to the `n_bins` of `alg_configs`.
+    """
+    out = np.zeros(
+        (len(source.reced), len(alg_configs['freq']), n_bins(alg_configs))
+    )
+    for hist, rec in zip(out, source.reced):
+        reflectogram = np.asarray(rec.reflectogram, dtype=np.float64)
+        reflectogram = reflectogram[:, :out.shape[2]]
+        hist[:, :reflectogram.shape[1]] = reflectogram
+    return out
+
+
+def trace(sims, src, directions, alg_configs, recs, path=None):
+    """Trace the rays of the (n, 3) `directions` from the source dict `src`
+
+    `sims` is a `simulation` of `alg_configs` and `recs`, resized to `n` rays
+    if needed. Returns the `SourceResult` of the source, with its histories
+    stored in the `.npy` file `path` if given, and its (n_recs, n_bands,
+    n_bins) histograms at `recs`, per ray.
+    """
+    if len(sims.rays.vinit) != len(directions):
+        # the engine memory is sized for its number of rays
+        sims.set_configs(dict(alg_configs, n_rays=len(directions)))
+        sims.set_raydir()
+        sims.set_receivers(recs)
+    sims.rays.vinit[:] = directions
+    sims.set_memory_init()
+    sims.set_sources([src])
+    sims.run_raytracing()
+    source = sims.sources[0]
+    return (
+        SourceResult.from_engine(source, path),
+        receiver_histograms(source, alg_configs)
+    )
@@ -0,0 +1,104 @@
+import numpy as np
+
+from .reverberation import room_volume
+
+# bytes of a reflection point of a source in the ray histories, float32
+POINT_BYTES = 12
+# bytes of a reflection point evaluated from the ray paths: its float64
+# segment of `histograms.ray_segments` (start, direction, length, order and
+# travelled), with about as much in temporaries
+SEGMENT_BYTES = 2 * 72
+# bytes of a reflection point in the engine, which holds the rays of one
+# source at a time, as float64
+ENGINE_POINT_BYTES = 24
+# bytes of a ray besides its points: its history offset, and its bookkeeping
+# in the engine
+RAY_BYTES = 8 + 512
+# float64 values the engine keeps per ray and receiver, besides one per band:
+# the arrival time and length of the ray at the receiver
+RECEIVER_RAY_VALUES = 2
+
+
+class MemoryBudgetError(Exception):
+    """The results of a run alone do not fit in its memory budget"""
+
+
+def mib(n_bytes):
+    return f"{n_bytes / 2**20:.1f} MiB"
+
+
+def mean_reflections(planes, ht_length, c0):
+    """Mean number of reflections of a ray over `ht_length` seconds
+
+    The path travelled over the mean free path 4V/S of the room, or of the
+    bounding box of `planes` when they enclose no volume.
+    """
+    area = float(np.sum(planes.areas))
+    if area <= 0.0:
+        return 0.0
+    volume = room_volume(planes)
+    if volume <= 1e-9:
+        stacked, _ = planes.polygons()
+        volume = float(np.prod(np.maximum(np.ptp(stacked, axis=0), 1e-3)))
+    return c0 * ht_length * area / (4.0 * volume)
+
+
+class Footprint:
+    """Estimated memory of a run, in bytes
+
+    `tracing` is the peak of tracing and evaluating all the rays at once,
+    proportional to the number of rays, `per_ray` of every source. Rays are
+    only evaluated from their paths for the `n_grid` grid points.
+    `receivers` are the histograms of the receivers in the engine, of each of
+    the `workers` tracing at once. `results` is what the run keeps however it
+    is chunked: the receiver histograms and grid energies (summed over the
+    chunks, plus those of the last chunk), and the surface hits with
+    `record_hits`.
+    """
+
+    def __init__(
+        self, planes, n_srcs, n_recs, n_grid, alg_configs, c0,
+        record_hits=False, workers=1
+    ):
+        n_bands = len(alg_configs['freq'])
+        n_bins = max(
+            1, int(round(alg_configs['ht_length'] / alg_configs['dt']))
+        )
+        self.n_rays = alg_configs['n_rays']
+        self.reflections = mean_reflections(
+            planes, alg_configs['ht_length'], c0
+        )
+        point = POINT_BYTES
+        if n_grid:
+            # the gains of the segments are (n_bands,) float64
+            point += SEGMENT_BYTES + 8 * n_bands
+        self.per_ray = RAY_BYTES + self.reflections * (
+            ENGINE_POINT_BYTES + n_srcs * point
+        ) + 8 * n_recs * (RECEIVER_RAY_VALUES + n_bands)
+        self.tracing = self.n_rays * self.per_ray
+        self.histories = n_srcs * self.n_rays * (8 + 12 * self.reflections)
+        self.receivers = max(1, workers) * 8 * n_recs * n_bands * n_bins
+        self.results = 2 * 8 * n_srcs * n_bands * (n_recs * n_bins + n_grid)
+        if record_hits:
+            self.results += 4 * n_srcs * self.n_rays * self.reflections
+
+    @property
+    def total(self):
+        return self.tracing + self.receivers + self.results
+
+    def chunk_rays(self, budget):
+        """Rays per source to trace at a time to stay within `budget` bytes
+
+        None when the whole run fits (or `budget` is 0, no limit). Raises
+        `MemoryBudgetError` when the histograms alone do not fit.
+        """
+        if budget <= 0 or self.total <= budget:
+            return None
+        fixed = self.receivers + self.results
+        if fixed >= budget:
+            raise MemoryBudgetError(
+                f"The histograms need {mib(fixed)}, over the memory budget of "
+                f"{mib(budget)}: use fewer receivers, a shorter ht_length or "
+                f"a larger dt"
+            )
+        return max(1, int((budget - fixed) // self.per_ray))
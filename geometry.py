@@ -0,0 +1,472 @@
+import numpy as np
+
+
+class PlaneTable:
+    """Struct-of-arrays table with the triangles handed over to the engine.
+
+    Row `i` of every array describes the same triangle, so the whole table can
+    be built, transformed and concatenated without creating Python objects per
+    triangle. Per plane dicts are only created by `to_dicts`, at the engine
+    boundary.
+
+    Planes may also be polygons (see `merge_coplanar`): then `vertices` holds
+    the vertices of all of them, stacked, and those of plane `i` are
+    `vertices[offsets[i]:offsets[i + 1]]`. `n_triangles` is the number of
+    triangles the planes were built from.
+    """
+
+    def __init__(
+        self, vertices, normals, areas, mat_ids, alpha, scattering, names=(),
+        offsets=None, n_triangles=None
+    ):
+        # (n, 3, 3) float64, global coordinates, or (m, 3) with `offsets`
+        self.vertices = vertices
+        self.offsets = offsets  # (n + 1,) int64, None for triangles
+        self.normals = normals  # (n, 3) float32, unit length
+        self.areas = areas  # (n,) float64
+        self.mat_ids = mat_ids  # (n,) int64, `RAMaterialsDB.index`
+        self.alpha = alpha  # (n, 8) float32
+        self.scattering = scattering  # (n,) float64
+        # (object name, number of planes) pairs, used to name the planes
+        self.names = list(names)
+        self.n_triangles = len(areas) if n_triangles is None else n_triangles
+
+    def __len__(self):
+        return len(self.areas)
+
+    def polygons(self):
+        """The stacked (m, 3) vertices of the planes and their offsets"""
+        if self.offsets is not None:
+            return self.vertices, self.offsets
+        n = len(self.vertices)
+        return (
+            self.vertices.reshape((-1, 3)),
+            np.arange(0, 3 * n + 1, 3, dtype=np.int64)
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            vertices=np.zeros((0, 3, 3), dtype=np.float64),
+            normals=np.zeros((0, 3), dtype=np.float32),
+            areas=np.zeros((0,), dtype=np.float64),
+            mat_ids=np.zeros((0,), dtype=np.int64),
+            alpha=np.zeros((0, 8), dtype=np.float32),
+            scattering=np.zeros((0,), dtype=np.float64),
+        )
+
+    @classmethod
+    def concatenate(cls, tables):
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls.empty()
+        offsets = None
+        if all(t.offsets is None for t in tables):
+            vertices = np.concatenate([t.vertices for t in tables])
+        else:
+            polygons = [t.polygons() for t in tables]
+            vertices = np.concatenate([v for v, _ in polygons])
+            starts = np.cumsum([0] + [len(v) for v, _ in polygons[:-1]])
+            offsets = np.concatenate([np.zeros(1, dtype=np.int64)] + [
+                o[1:] + start for (_, o), start in zip(polygons, starts)
+            ])
+        return cls(
+            vertices=vertices,
+            offsets=offsets,
+            n_triangles=sum(t.n_triangles for t in tables),
+            normals=np.concatenate([t.normals for t in tables]),
+            areas=np.concatenate([t.areas for t in tables]),
+            mat_ids=np.concatenate([t.mat_ids for t in tables]),
+            alpha=np.concatenate([t.alpha for t in tables]),
+            scattering=np.concatenate([t.scattering for t in tables]),
+            names=[n for t in tables for n in t.names],
+        )
+
+    def plane_names(self):
+        return [f"{name}.{i}" for name, n in self.names for i in range(n)]
+
+    def to_dicts(self):
+        """Per plane dicts, as expected by `Simulation.set_geometry`"""
+        polygons = self.vertices
+        if self.offsets is not None:
+            polygons = np.split(polygons, self.offsets[1:-1])
+        return [
+            {
+                'name': name,
+                'bbox': False,
+                'vertices': vertices,
+                'normal': normal,
+                'alpha': alpha,
+                's': float(s),
+                'area': float(area),
+            }
+            for name, vertices, normal, alpha, s, area in zip(
+                self.plane_names(), polygons, self.normals, self.alpha,
+                self.scattering, self.areas
+            )
+        ]
+
+
+def transform_points(matrix, points):
+    """Apply a 4x4 affine `matrix` to an (n, 3) array of points"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def transform_normals(matrix, normals):
+    """Apply a 4x4 affine `matrix` to an (n, 3) array of normals
+
+    Normals are directions, so they are transformed by the inverse transpose of
+    the linear part of the matrix (translation is ignored) and renormalized.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    normals = normals @ np.linalg.inv(matrix[:3, :3])
+    norm = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(
+        normals, norm, out=np.zeros_like(normals), where=norm > 0
+    ).astype(np.float32)
+
+
+def triangle_areas(vertices):
+    """Areas of an (n, 3, 3) array of triangles"""
+    a, b, c = vertices[:, 0], vertices[:, 1], vertices[:, 2]
+    return np.linalg.norm(np.cross(b - a, c - a), axis=1) * 0.5
+
+
+def read_mesh(mesh):
+    """Bulk read of the mesh loop triangles, in local coordinates
+
+    Returns the (n, 3, 3) triangle vertices, the (n, 3) triangle normals and
+    the (n,) material slot index of each triangle.
+    """
+    mesh.calc_loop_triangles()
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', co)
+    ntris = len(mesh.loop_triangles)
+    tris = np.empty(ntris * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('vertices', tris)
+    normals = np.empty(ntris * 3, dtype=np.float32)
+    mesh.loop_triangles.foreach_get('normal', normals)
+    slot_index = np.empty(ntris, dtype=np.int32)
+    mesh.loop_triangles.foreach_get('material_index', slot_index)
+
+    co = co.reshape((-1, 3)).astype(np.float64)
+    return co[tris.reshape((-1, 3))], normals.reshape((-1, 3)), slot_index
+
+
+def mesh_geometry(obj):
+    """Triangles of a mesh object in global coordinates
+
+    Returns the (n, 3, 3) vertices, (n, 3) normals, (n,) areas and (n,)
+    material slot index of each triangle.
+    """
+    vertices, normals, slot_index = read_mesh(obj.data)
+    ntris = len(vertices)
+    matrix = np.array(obj.matrix_world, dtype=np.float64)
+    vertices = transform_points(matrix, vertices.reshape((-1, 3)))
+    vertices = vertices.reshape((ntris, 3, 3))
+    return (
+        vertices, transform_normals(matrix, normals), triangle_areas(vertices),
+        slot_index
+    )
+
+
+# polygons stop growing at this many vertices, collinear ones included
+MAX_POLYGON_VERTICES = 32
+
+
+def merge_coplanar(vertices, normals, areas, slot_index, tolerance):
+    """Merge adjacent coplanar triangles of the same slot into convex polygons
+
+    Triangles are grouped by slot and by plane, their normals and plane
+    offsets rounded to `tolerance` (and their vertices welded at that
+    distance), with numpy. Each group is then grown greedily, one triangle
+    across a shared edge at a time, as long as the polygon stays convex and
+    under `MAX_POLYGON_VERTICES` vertices. Returns the stacked (m, 3) polygon
+    vertices, the offsets of each polygon in them, and the normals, areas and
+    slot index of each polygon.
+    """
+    ntris = len(vertices)
+    if ntris == 0:
+        return (
+            np.zeros((0, 3)), np.zeros(1, dtype=np.int64), normals, areas,
+            slot_index
+        )
+    tolerance = max(tolerance, 1e-9)
+
+    # weld the vertices, triangles then share vertex ids along their edges
+    points = vertices.reshape((-1, 3))
+    _, first, weld = np.unique(
+        np.round(points / tolerance).astype(np.int64), axis=0,
+        return_index=True, return_inverse=True
+    )
+    welded = points[first]
+    tris = weld.reshape((-1, 3))
+
+    plane = np.column_stack((
+        slot_index,
+        np.round(normals / tolerance),
+        np.round(np.einsum('ij,ij->i', normals, vertices[:, 0]) / tolerance),
+    )).astype(np.int64)
+    _, group = np.unique(plane, axis=0, return_inverse=True)
+
+    # directed edge (a, b) -> triangle, per group
+    edges = {}
+    tri_list = tris.tolist()
+    for t, (g, (a, b, c)) in enumerate(zip(group.tolist(), tri_list)):
+        edges[g, a, b] = edges[g, b, c] = edges[g, c, a] = t
+
+    def turn(normal, p, q, r):
+        # (q - p) x (r - q) . normal, on python floats: the triangles are
+        # visited one at a time and numpy is slow on tiny arrays
+        ax, ay, az = q[0] - p[0], q[1] - p[1], q[2] - p[2]
+        bx, by, bz = r[0] - q[0], r[1] - q[1], r[2] - q[2]
+        return (
+            (ay * bz - az * by) * normal[0] + (az * bx - ax * bz) * normal[1]
+            + (ax * by - ay * bx) * normal[2]
+        )
+
+    points = welded.tolist()
+    normals_list = normals.tolist()
+
+    eps = tolerance ** 2
+    used = np.zeros(ntris, dtype=bool)
+    polygons, poly_tris = [], []
+    for seed in range(ntris):
+        if used[seed]:
+            continue
+        used[seed] = True
+        g = int(group[seed])
+        normal = normals_list[seed]
+        a, b, c = tri_list[seed]
+        # the polygon as a linked loop of vertex ids
+        nxt = {a: b, b: c, c: a}
+        prv = {b: a, c: b, a: c}
+        members = [seed]
+        todo = [a, b, c]  # the edges (u, nxt[u]) to grow across
+        while todo and len(nxt) < MAX_POLYGON_VERTICES:
+            u = todo.pop()
+            v = nxt[u]
+            t = edges.get((g, v, u))
+            if t is None or used[t]:
+                continue
+            # the vertex of `t` opposite to the shared edge
+            w = sum(tri_list[t]) - u - v
+            if w in nxt or turn(
+                normal, points[prv[u]], points[u], points[w]
+            ) < -eps or turn(
+                normal, points[w], points[v], points[nxt[v]]
+            ) < -eps:
+                continue
+            nxt[u], nxt[w], prv[w], prv[v] = w, v, u, w
+            used[t] = True
+            members.append(t)
+            todo += [u, w]
+
+        # collinear vertices only mattered to find the neighbours
+        poly = [a]
+        while nxt[poly[-1]] != a:
+            poly.append(nxt[poly[-1]])
+        corners = [
+            k for k in poly
+            if abs(turn(normal, points[prv[k]], points[k], points[nxt[k]]))
+            > eps
+        ]
+        # degenerate (all collinear) polygons are kept as they were
+        polygons.append(corners if len(corners) >= 3 else poly)
+        poly_tris.append(members)
+
+    offsets = np.concatenate(
+        ([0], np.cumsum([len(p) for p in polygons]))
+    ).astype(np.int64)
+    seeds = np.array([m[0] for m in poly_tris])
+    merged_areas = np.array([areas[m].sum() for m in poly_tris])
+    return (
+        welded[np.concatenate(polygons)], offsets, normals[seeds],
+        merged_areas, slot_index[seeds]
+    )
+
+
+# point-plane distances, and point-edge tests, computed at a time by
+# `locate_hits`
+LOCATE_CHUNK = 1 << 22
+# distance of a reflection point to its plane in `locate_hits`, the points
+# of the ray histories being float32
+HIT_TOLERANCE = 1e-3
+
+
+def locate_hits(points, planes, tolerance=HIT_TOLERANCE):
+    """Index of the plane each of the (n, 3) `points` lies on, -1 if none
+
+    The planes are grouped by plane equation, so each point is compared with
+    every distinct plane once, `LOCATE_CHUNK` comparisons at a time. Points
+    within `tolerance` of a group are then tested against the (convex)
+    polygons of its planes, and given the first one containing them, or the
+    first of the group if none does (a point on an edge, within rounding).
+    Those tests are also done `LOCATE_CHUNK` polygon edges at a time, however
+    many coplanar planes the groups have.
+    """
+    hits = np.full(len(points), -1, dtype=np.int64)
+    if len(points) == 0 or len(planes) == 0:
+        return hits
+    stacked, offsets = planes.polygons()
+    stacked = np.asarray(stacked, dtype=np.float64)
+    normals = np.asarray(planes.normals, dtype=np.float64)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+    dists = np.einsum('ij,ij->i', normals, stacked[offsets[:-1]])
+
+    keys = np.round(np.column_stack((normals, dists)) / tolerance)
+    _, first, group = np.unique(
+        keys.astype(np.int64), axis=0, return_index=True, return_inverse=True
+    )
+    group = group.ravel()
+    by_group = np.argsort(group, kind='stable')
+    counts = np.bincount(group)
+    starts = np.cumsum(counts) - counts
+    # edges of the polygons of each group
+    edges = np.bincount(group, weights=np.diff(offsets)).astype(np.int64)
+
+    def contain(point, nearest):
+        """Test the `point`s against the polygons of their `nearest` group"""
+        n = counts[nearest]
+        point = np.repeat(point, n)
+        plane = by_group[
+            np.repeat(starts[nearest], n)
+            + np.arange(int(n.sum())) - np.repeat(np.cumsum(n) - n, n)
+        ]
+        # inside a convex polygon means left of all its edges
+        nv = offsets[plane + 1] - offsets[plane]
+        pair = np.repeat(np.arange(len(plane)), nv)
+        k = np.arange(int(nv.sum())) - np.repeat(np.cumsum(nv) - nv, nv)
+        base = offsets[plane[pair]]
+        a = stacked[base + k]
+        b = stacked[base + (k + 1) % nv[pair]]
+        side = np.einsum(
+            'ij,ij->i', np.cross(b - a, points[point[pair]] - a),
+            normals[plane[pair]]
+        )
+        outside = np.bincount(
+            pair, weights=side < -tolerance * np.linalg.norm(b - a, axis=1),
+            minlength=len(plane)
+        )
+        inside = outside == 0
+        found, index = np.unique(point[inside], return_index=True)
+        hits[found] = plane[inside][index]
+
+    step = max(1, LOCATE_CHUNK // len(first))
+    for s in range(0, len(points), step):
+        x = np.asarray(points[s:s + step], dtype=np.float64)
+        distance = np.abs(x @ normals[first].T - dists[first])
+        nearest = distance.argmin(axis=1)
+        close = distance[np.arange(len(x)), nearest] <= tolerance
+        point = s + np.flatnonzero(close)
+        nearest = nearest[close]
+        hits[point] = by_group[starts[nearest]]
+
+        # the points near groups with several planes, by their edges
+        several = counts[nearest] > 1
+        point, nearest = point[several], nearest[several]
+        ends = np.cumsum(edges[nearest])
+        bounds = np.searchsorted(
+            ends,
+            np.arange(LOCATE_CHUNK, ends[-1] if len(ends) else 0, LOCATE_CHUNK)
+        )
+        for p, g in zip(np.split(point, bounds), np.split(nearest, bounds)):
+            if len(p):
+                contain(p, g)
+    return hits
+
+
+class GeometryCache:
+    """Per object triangles in global coordinates, reused across runs
+
+    Entries are keyed by the object name and validated against its mesh data
+    and `matrix_world`. Edits that keep both (e.g. editing the mesh vertices)
+    are caught by the `depsgraph_update_post` handler, which discards the
+    entries of the updated objects.
+    """
+
+    def __init__(self):
+        # object name -> (key, mesh_geometry(obj), {tolerance: merged})
+        self.entries = {}
+
+    @staticmethod
+    def key(obj):
+        return (
+            obj.data.name, len(obj.data.vertices), len(obj.data.polygons),
+            np.array(obj.matrix_world, dtype=np.float64).tobytes()
+        )
+
+    def get(self, obj, tolerance=None):
+        """`mesh_geometry(obj)`, or its `merge_coplanar` with `tolerance`"""
+        key = self.key(obj)
+        entry = self.entries.get(obj.name)
+        if entry is None or entry[0] != key:
+            entry = (key, mesh_geometry(obj), {})
+            self.entries[obj.name] = entry
+        if tolerance is None:
+            return entry[1]
+        merged = entry[2].get(tolerance)
+        if merged is None:
+            merged = entry[2][tolerance] = merge_coplanar(
+                *entry[1], tolerance
+            )
+        return merged
+
+    def discard(self, name):
+        self.entries.pop(name, None)
+
+    def discard_mesh(self, mesh_name):
+        for name, entry in list(self.entries.items()):
+            if entry[0][0] == mesh_name:
+                del self.entries[name]
+
+    def prune(self, names):
+        """Drop the entries of objects not in `names`"""
+        names = set(names)
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+
+    def clear(self):
+        self.entries.clear()
+
+
+def extract_mesh(obj, resolver, cache=None, tolerance=None):
+    """Build the plane table of a GEOM mesh object, in global coordinates
+
+    Materials are resolved per triangle from its material slot, through
+    `resolver` (a `materials.MaterialResolver`). When a `GeometryCache` is
+    given, the triangles are only re-extracted if the object changed. With a
+    `tolerance`, coplanar triangles are merged, see `merge_coplanar`.
+    """
+    if cache is not None:
+        triangles = cache.get(obj)
+    else:
+        triangles = mesh_geometry(obj)
+    offsets = None
+    if tolerance is None:
+        vertices, normals, areas, slot_index = triangles
+    elif cache is not None:
+        vertices, offsets, normals, areas, slot_index = cache.get(
+            obj, tolerance
+        )
+    else:
+        vertices, offsets, normals, areas, slot_index = merge_coplanar(
+            *triangles, tolerance
+        )
+    mat_ids, alpha, scattering = resolver.resolve(obj, slot_index)
+    return PlaneTable(
+        vertices=vertices,
+        offsets=offsets,
+        normals=normals,
+        areas=areas,
+        mat_ids=mat_ids,
+        alpha=alpha,
+        scattering=scattering,
+        names=[(obj.name, len(areas))],
+        n_triangles=len(triangles[2]),
+    )
+
+
+geometry_cache = GeometryCache()
@@ -0,0 +1,169 @@
+import bpy
+import colorcet as cc
+import gpu
+from gpu_extras.batch import batch_for_shader
+import numpy as np
+
+from . import geometry, histograms
+from .rendering import colormap, tag_redraw_view3d
+
+# colormap of the levels of the heatmap
+LEVELS_COLORMAP = cc.rainbow
+# color of the cells no ray reached
+SILENT_COLOR = (0.2, 0.2, 0.2, 1.0)
+
+
+def triangle_lattice(n):
+    """Barycentric coordinates of the corners of a triangle split in n * n
+
+    Each edge is split in `n`, the (n * n, 3, 3) corners of the resulting
+    sub-triangles are returned.
+    """
+    i, j = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    up = i + j < n
+    down = i + j < n - 1
+    corners = np.concatenate((
+        np.stack([
+            np.stack((i[up], j[up]), axis=-1),
+            np.stack((i[up] + 1, j[up]), axis=-1),
+            np.stack((i[up], j[up] + 1), axis=-1),
+        ], axis=1),
+        np.stack([
+            np.stack((i[down] + 1, j[down]), axis=-1),
+            np.stack((i[down] + 1, j[down] + 1), axis=-1),
+            np.stack((i[down], j[down] + 1), axis=-1),
+        ], axis=1),
+    )) / n
+    return np.concatenate(
+        (1.0 - corners.sum(axis=-1, keepdims=True), corners), axis=-1
+    )
+
+
+def grid_cells(vertices, normals, spacing, height):
+    """Cells of a receiver grid over (n, 3, 3) triangles
+
+    Each triangle is split in sub-triangles with edges of at most `spacing`,
+    raised `height` along its (n, 3) normals. Returns their (m, 3, 3) corners,
+    the receivers are at their centers.
+    """
+    if len(vertices) == 0:
+        return np.zeros((0, 3, 3), dtype=np.float32)
+    edges = np.linalg.norm(
+        vertices - np.roll(vertices, 1, axis=1), axis=2
+    ).max(axis=1)
+    splits = np.maximum(1, np.ceil(edges / spacing)).astype(np.int64)
+    cells = []
+    for n in np.unique(splits):
+        tris = splits == n
+        corners = np.einsum(
+            'scv,tvd->tscd', triangle_lattice(n), vertices[tris]
+        )
+        corners += height * normals[tris][:, None, None, :]
+        cells.append(corners.reshape((-1, 3, 3)))
+    return np.concatenate(cells).astype(np.float32)
+
+
+def sample(objs):
+    """Cells of the receiver grids of the mesh objects `objs`
+
+    Returns their stacked (m, 3, 3) corners, see `grid_cells`, and the number
+    of cells of each object.
+    """
+    cells = [
+        grid_cells(
+            *geometry.mesh_geometry(obj)[:2], obj.ra.grid_spacing,
+            obj.ra.grid_height
+        )
+        for obj in objs
+    ]
+    if not cells:
+        return np.zeros((0, 3, 3), dtype=np.float32), []
+    return np.concatenate(cells), [len(c) for c in cells]
+
+
+class HeatmapManager:
+    """Draws the levels at the receiver grids of the last run
+
+    Each cell of the grids is colored by the level at its receiver, mapped
+    through `LEVELS_COLORMAP` over the range of the levels shown, and all of
+    them are drawn as a single batch, built once per results or band.
+    """
+
+    def __init__(self):
+        self.gldraw_handler = None
+        self.cells = None
+        self.energy = None  # (m, n_bands), the sources summed
+        self.band = 'ALL'
+        self.range = None  # (lo, hi) of the levels shown, in dB
+        self.shader = None
+        self.batch = None
+
+    def set_grid(self, cells, energy):
+        """Set the (m, 3, 3) `cells` and their (n_srcs, m, n_bands) `energy`"""
+        self.cells = np.asarray(cells, dtype=np.float32)
+        self.energy = np.asarray(energy).sum(axis=0)
+        self.batch = None
+        tag_redraw_view3d()
+
+    def set_band(self, band):
+        """Show the levels of a band (its index, as a string) or 'ALL'"""
+        self.band = band
+        self.batch = None
+        tag_redraw_view3d()
+
+    def clear(self):
+        self.dereg_draw_callback()
+        self.cells = None
+        self.energy = None
+        self.range = None
+        self.batch = None
+
+    def levels(self):
+        if self.band == 'ALL':
+            return histograms.level(self.energy.sum(axis=-1))
+        return histograms.level(self.energy[:, int(self.band)])
+
+    def build(self):
+        if self.shader is None:
+            self.shader = gpu.shader.from_builtin('3D_SMOOTH_COLOR')
+        levels = self.levels()
+        heard = np.isfinite(levels)
+        self.range = None
+        colors = np.tile(
+            np.array(SILENT_COLOR, dtype=np.float32), (len(levels), 1)
+        )
+        if heard.any():
+            self.range = float(levels[heard].min()), float(levels[heard].max())
+            colors[heard] = colormap(
+                levels[heard], *self.range, LEVELS_COLORMAP
+            )
+        self.batch = batch_for_shader(self.shader, 'TRIS', {
+            'pos': self.cells.reshape((-1, 3)),
+            'color': np.repeat(colors, 3, axis=0),
+        })
+
+    def dereg_draw_callback(self):
+        if self.gldraw_handler is not None:
+            bpy.types.SpaceView3D.draw_handler_remove(
+                self.gldraw_handler, 'WINDOW'
+            )
+            self.gldraw_handler = None
+
+    def reg_draw_callback(self, render=True):
+        """Show (or hide) the heatmap"""
+        if self.cells is None or len(self.cells) == 0 or not render:
+            self.dereg_draw_callback()
+        elif self.gldraw_handler is None:
+            self.gldraw_handler = bpy.types.SpaceView3D.draw_handler_add(
+                self.draw, (), 'WINDOW', 'POST_VIEW'
+            )
+        tag_redraw_view3d()
+
+    def draw(self):
+        if self.batch is None:
+            self.build()
+        self.shader.bind()
+        self.batch.draw(self.shader)
+
+
+heatmap_man = HeatmapManager()
@@ -0,0 +1,173 @@
+import sys
+
+import bpy
+from bpy.app.handlers import persistent
+
+from . import histograms, results
+from .grids import heatmap_man
+from .geometry import geometry_cache
+from .materials import material_resolver
+from .receivers import live_receivers
+from .rendering import rendering_man
+from .reverberation import reverb_preview
+
+
+@persistent
+def invalidate_caches(*args):
+    """Drop everything derived from the previous state of the blend data"""
+    material_resolver.invalidate()
+    geometry_cache.clear()
+    reverb_preview.request()
+
+
+@persistent
+def reset_running(*args):
+    """A file saved while a simulation was running should not stay locked"""
+    for scene in bpy.data.scenes:
+        scene.ra.rtngn_running = False
+
+
+def report_error(message):
+    """Show `message` in a popup, from handlers, which can not `report`"""
+    wm = bpy.context.window_manager
+    if bpy.app.background or wm is None:
+        print(message, file=sys.stderr)
+        return
+
+    def draw(menu, context):
+        menu.layout.label(text=message)
+
+    wm.popup_menu(draw, title="RA", icon='ERROR')
+
+
+def save_results():
+    """Write the current results next to the .blend, if not already there
+
+    Returns the error message if they could not be written, None otherwise.
+    """
+    if not bpy.data.filepath or results.current_results is None:
+        return None
+    path = results.sidecar_path(bpy.path.abspath(bpy.data.filepath))
+    if results.current_results.path == path:
+        return None
+    try:
+        results.current_results.save(path)
+    except OSError as e:
+        return f"Could not save the simulation results to {path}: {e}"
+    return None
+
+
+@persistent
+def save_post(*args):
+    error = save_results()
+    if error is not None:
+        report_error(error)
+
+
+@persistent
+def load_results(*args):
+    """Show the results saved next to the loaded .blend, if any
+
+    They are memory mapped, nothing but their header is read until they are
+    drawn.
+    """
+    rendering_man.clear()
+    heatmap_man.clear()
+    live_receivers.clear()
+    results.current_results = None
+    # the histories of the released results are no longer mapped
+    results.discard_dir()
+    if not bpy.data.filepath:
+        return
+    path = results.sidecar_path(bpy.path.abspath(bpy.data.filepath))
+    if not path.is_file():
+        return
+    try:
+        results.current_results = results.SimulationResults.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        report_error(f"Could not load the simulation results from {path}: {e}")
+        return
+
+    if bpy.app.background:
+        return
+    scene_ra = bpy.context.scene.ra
+    meta = results.current_results.meta
+    attenuation = None
+    if 'alg_configs' in meta and 'air_properties' in meta:
+        air = meta['air_properties']
+        attenuation = histograms.air_attenuation(
+            meta['alg_configs']['freq'], air['Temperature'], air['hr'],
+            air['p_atm']
+        )
+    rendering_man.set_lod(
+        scene_ra.render_budget, cull=scene_ra.render_cull,
+        coarse=scene_ra.render_coarse
+    )
+    rendering_man.set_colors(scene_ra.render_colors)
+    rendering_man.set_sources(
+        results.current_results.sources, c0=meta.get('c0', 343.0),
+        alpha=meta.get('mean_alpha'), attenuation=attenuation
+    )
+    rendering_man.reg_draw_callback(
+        order=scene_ra.render_order, render=scene_ra.render
+    )
+    arrays = results.current_results.arrays
+    if 'grid_energy' in arrays and 'grid_cells' in arrays:
+        heatmap_man.set_grid(arrays['grid_cells'], arrays['grid_energy'])
+        heatmap_man.set_band(scene_ra.heatmap_band)
+        heatmap_man.reg_draw_callback(render=scene_ra.render_heatmap)
+
+
+@persistent
+def depsgraph_update(scene, depsgraph=None):
+    # blender < 2.81 does not pass the depsgraph to the handlers
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+
+    live = scene.ra.live_receivers and results.current_results is not None
+    for update in depsgraph.updates:
+        id_orig = update.id.original
+        if scene.ra.reverb_preview and (
+            isinstance(id_orig, bpy.types.Material)
+            or isinstance(id_orig, bpy.types.Object)
+            and id_orig.ra.nature == 'GEOM' and (
+                update.is_updated_geometry or update.is_updated_transform
+            )
+        ):
+            # material assignments update the object geometry
+            reverb_preview.request()
+        if (
+            live and update.is_updated_transform
+            and isinstance(id_orig, bpy.types.Object)
+            and id_orig.ra.nature == 'RECEIVER'
+        ):
+            live_receivers.moved(id_orig.name)
+        if not update.is_updated_geometry:
+            continue
+        if isinstance(id_orig, bpy.types.Object):
+            geometry_cache.discard(id_orig.name)
+        elif isinstance(id_orig, bpy.types.Mesh):
+            geometry_cache.discard_mesh(id_orig.name)
+
+
+handlers = (
+    (bpy.app.handlers.depsgraph_update_post, depsgraph_update),
+    (bpy.app.handlers.load_post, invalidate_caches),
+    (bpy.app.handlers.load_post, reset_running),
+    (bpy.app.handlers.load_post, load_results),
+    (bpy.app.handlers.save_post, save_post),
+    (bpy.app.handlers.undo_post, invalidate_caches),
+    (bpy.app.handlers.redo_post, invalidate_caches),
+)
+
+
+def register():
+    for handler_list, handler in handlers:
+        if handler not in handler_list:
+            handler_list.append(handler)
+
+
+def unregister():
+    for handler_list, handler in handlers:
+        if handler in handler_list:
+            handler_list.remove(handler)
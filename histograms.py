@@ -0,0 +1,416 @@
+import itertools
+
+import numpy as np
+
+# range of the decay curves compared for convergence, in dB below the total
+DECAY_RANGE = 30.0
+# the reference sound power of `power_dB`, in W
+REFERENCE_POWER = 1e-12
+# the reference sound intensity of the levels, in W/m2
+REFERENCE_INTENSITY = 1e-12
+# offsets of a cell and its neighbours in a uniform grid
+NEIGHBOURS = np.array(list(itertools.product((-1, 0, 1), repeat=3)))
+# ray samples tested against the receiver grid at a time
+GRID_CHUNK = 1 << 20
+
+
+def air_attenuation(freq, temperature, hr, p_atm):
+    """Energy attenuation coefficient of air [1/m], ISO 9613-1
+
+    `temperature` in C, `hr` the relative humidity in % and `p_atm` the
+    atmospheric pressure in Pa.
+    """
+    freq = np.asarray(freq, dtype=np.float64)
+    t = temperature + 273.15
+    t0, t01, p0 = 293.15, 273.16, 101325.0
+    pr = p_atm / p0
+    psat = 10 ** (-6.8346 * (t01 / t) ** 1.261 + 4.6151)
+    h = hr * psat / pr
+    fro = pr * (24.0 + 4.04e4 * h * (0.02 + h) / (0.391 + h))
+    frn = pr * (t / t0) ** -0.5 * (
+        9.0 + 280.0 * h * np.exp(-4.17 * ((t / t0) ** (-1 / 3) - 1.0))
+    )
+    # in dB/m
+    alpha = 8.686 * freq ** 2 * (
+        1.84e-11 / pr * (t / t0) ** 0.5
+        + (t / t0) ** -2.5 * (
+            0.01275 * np.exp(-2239.1 / t) / (fro + freq ** 2 / fro)
+            + 0.1068 * np.exp(-3352.0 / t) / (frn + freq ** 2 / frn)
+        )
+    )
+    return alpha / (10.0 * np.log10(np.e))
+
+
+def mean_alpha(planes):
+    """Area weighted mean absorption of `planes`, per band"""
+    if len(planes) == 0 or planes.areas.sum() == 0:
+        return np.zeros(planes.alpha.shape[1], dtype=np.float64)
+    return np.average(planes.alpha, axis=0, weights=planes.areas)
+
+
+def material_alpha(planes):
+    """Absorption of each material of `planes`
+
+    Returns the sorted material ids, their (k, n_bands) alpha and (k,) total
+    areas.
+    """
+    ids, first, rows = np.unique(
+        planes.mat_ids, return_index=True, return_inverse=True
+    )
+    areas = np.bincount(rows.ravel(), weights=planes.areas, minlength=len(ids))
+    return ids, np.asarray(planes.alpha[first], dtype=np.float64), areas
+
+
+def material_rows(ids, hits):
+    """Rows of the sorted material `ids` of the material ids `hits`
+
+    Ids not in `ids` (-1 for points on no plane) get the row `len(ids)`.
+    """
+    if len(ids) == 0:
+        return np.zeros(len(hits), dtype=np.int64)
+    rows = np.minimum(np.searchsorted(ids, hits), len(ids) - 1)
+    return np.where(ids[rows] == hits, rows, len(ids))
+
+
+def receiver_radius(travelled, alg_configs, c0):
+    """Receiver radius seen by rays that travelled `travelled` meters
+
+    With `allow_growth`, the radius grows linearly from `rec_radius_init` to
+    `rec_radius_final` over the length of the histogram.
+    """
+    r0 = alg_configs['rec_radius_init']
+    if not alg_configs['allow_growth']:
+        return np.full(np.shape(travelled), r0)
+    length = c0 * alg_configs['ht_length']
+    growth = np.clip(np.asarray(travelled) / max(length, 1e-12), 0.0, 1.0)
+    return r0 + (alg_configs['rec_radius_final'] - r0) * growth
+
+
+def source_power(src):
+    """Sound power of a source dict, per band [W]"""
+    level = np.asarray(src['power_dB']) + np.asarray(src['eq_dB'])
+    return REFERENCE_POWER * 10 ** (level / 10.0)
+
+
+def ray_segments(coord, histories):
+    """Segments of the ray paths of a source
+
+    Returns the (m, 3) segment starts, unit directions and (m,) lengths, the
+    (m,) reflection order of the segments (0 from the source) and the (m,)
+    path length travelled up to their start.
+    """
+    lengths = histories.lengths
+    nverts = lengths + 1
+    starts = np.cumsum(nverts) - nverts
+    positions = np.empty((int(nverts.sum()), 3), dtype=np.float64)
+    first = np.zeros(len(positions), dtype=bool)
+    first[starts] = True
+    positions[first] = coord
+    positions[~first] = histories.points
+
+    order = np.arange(len(positions)) - np.repeat(starts, nverts)
+    seg = order < np.repeat(lengths, nverts)
+    a = positions[:-1][seg[:-1]]
+    b = positions[1:][seg[:-1]]
+    d = b - a
+    step = np.linalg.norm(d, axis=1)
+    u = d / np.maximum(step, 1e-12)[:, None]
+    # travelled up to the start of each segment, restarting at every ray
+    seg_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    travelled = np.cumsum(step) - step
+    traced = lengths > 0
+    travelled -= np.repeat(
+        travelled[seg_offsets[:-1][traced]], lengths[traced]
+    )
+    return a, u, step, order[seg], travelled
+
+
+def reflection_gains(order, alpha):
+    """(m, n_bands) log energy gains of segments after `order` reflections
+
+    Every reflection absorbs `alpha` (per band), the mean absorption.
+    """
+    reflection = np.log1p(-np.minimum(alpha, 1.0 - 1e-12))
+    return (order[:, None] * reflection[None, :]).astype(np.float32)
+
+
+def hit_gains(histories, rows, alpha):
+    """(m, n_bands) log energy gains of the segments of `histories`
+
+    `rows` are the rows of the (k, n_bands) `alpha` table absorbing at each
+    reflection point of the histories. The gain of a segment is the sum of
+    the log gains of the reflections before it along its ray, a cumulative
+    sum over all the points at once.
+    """
+    point_gains = np.log1p(-np.minimum(alpha, 1.0 - 1e-12))[rows]
+    total = np.cumsum(point_gains, axis=0)
+    lengths = histories.lengths
+    starts = histories.offsets[:-1]
+    # the cumulative gain before the first point of each ray
+    before = np.zeros((len(lengths), point_gains.shape[1]))
+    later = starts > 0
+    before[later] = total[starts[later] - 1]
+
+    ray = np.repeat(np.arange(len(lengths)), lengths)
+    firsts = np.cumsum(lengths) - lengths
+    order = np.arange(len(ray)) - np.repeat(firsts, lengths)
+    gains = np.zeros(point_gains.shape, dtype=np.float32)
+    reflected = order > 0
+    gains[reflected] = (
+        total[starts[ray[reflected]] + order[reflected] - 1]
+        - before[ray[reflected]]
+    )
+    return gains
+
+
+def sphere_hits(a, u, length, travelled, center, radius):
+    """Segments passing within their receiver radius of `center`
+
+    `radius(distance)` gives the radius seen at a travelled distance. Returns
+    the indices of the segments hitting the receiver and the path length
+    travelled up to their point closest to it.
+    """
+    t = np.clip(np.einsum('ij,ij->i', center - a, u), 0.0, length)
+    closest = a + u * t[:, None]
+    dist = np.linalg.norm(center - closest, axis=1)
+    at = travelled + t
+    hits = np.flatnonzero(dist <= radius(at))
+    return hits, at[hits]
+
+
+def receiver_histograms(
+    segments, src, recs, gains, attenuation, alg_configs, c0
+):
+    """Energy histograms at each receiver of the rays of a source
+
+    `segments` are the `ray_segments` of the source. Each ray carries the
+    source power per band, reduced by the log `gains` of each segment (the
+    reflections before it, see `reflection_gains`) and by the air
+    `attenuation` along its path. Each hit of a receiver adds
+    that to the bin of its arrival time, over the receiver cross section, so
+    the (n_recs, n_bands, n_bins) histograms are sums to be divided by the
+    number of rays traced.
+    """
+    a, u, length, order, travelled = segments
+    n_bins = max(1, int(round(alg_configs['ht_length'] / alg_configs['dt'])))
+    power = source_power(src)
+
+    def radius(distance):
+        return receiver_radius(distance, alg_configs, c0)
+
+    out = np.zeros((len(recs), len(power), n_bins), dtype=np.float64)
+    for ri, rec in enumerate(recs):
+        hits, at = sphere_hits(
+            a, u, length, travelled, np.asarray(rec['coord']), radius
+        )
+        bins = (at / c0 / alg_configs['dt']).astype(np.int64)
+        keep = bins < n_bins
+        hits, at, bins = hits[keep], at[keep], bins[keep]
+        energy = power[None, :] * np.exp(
+            gains[hits] - attenuation[None, :] * at[:, None]
+        ) / (np.pi * radius(at) ** 2)[:, None]
+        for band in range(len(power)):
+            out[ri, band] = np.bincount(
+                bins, weights=energy[:, band], minlength=n_bins
+            )
+    return out
+
+
+def cell_keys(cells):
+    """int64 keys of (..., 3) integer cell coordinates, within +-2**20"""
+    cells = cells + (1 << 20)
+    return (cells[..., 0] << 42) | (cells[..., 1] << 21) | cells[..., 2]
+
+
+def grid_energy(segments, src, points, gains, attenuation, alg_configs, c0):
+    """Energy at many receivers of the rays of a source, summed over time
+
+    The (m, n_bands) sums over their bins of the `receiver_histograms` of
+    receivers at the (m, 3) `points`. Rather than testing every segment
+    against every receiver, the receivers are hashed into the cells of a
+    uniform grid twice as large as the largest receiver radius. The segments
+    are sampled a cell apart, and only tested against the receivers in the
+    cells around their samples: a receiver hit by a segment is always in a
+    cell next to one of them. The samples are processed `GRID_CHUNK` at a
+    time, to bound memory.
+    """
+    a, u, length, order, travelled = segments
+    power = source_power(src)
+    points = np.asarray(points, dtype=np.float64)
+    out = np.zeros((len(points), len(power)), dtype=np.float64)
+    if len(points) == 0 or len(a) == 0:
+        return out
+    n_bins = max(1, int(round(alg_configs['ht_length'] / alg_configs['dt'])))
+    horizon = n_bins * alg_configs['dt'] * c0
+    size = max(2.0 * float(np.max(
+        receiver_radius(np.array([0.0, horizon]), alg_configs, c0)
+    )), 1e-3)
+
+    cells = np.floor(points / size).astype(np.int64)
+    keys = cell_keys(cells)
+    by_cell = np.argsort(keys, kind='stable')
+    occupied, starts, counts = np.unique(
+        keys[by_cell], return_index=True, return_counts=True
+    )
+    near = np.unique(cell_keys(cells[:, None, :] + NEIGHBOURS))
+
+    live = np.flatnonzero(travelled < horizon)
+    n_samples = (length[live] // size).astype(np.int64) + 2
+    ends = np.cumsum(n_samples)
+    bounds = np.searchsorted(
+        ends, np.arange(GRID_CHUNK, ends[-1] if len(ends) else 0, GRID_CHUNK)
+    )
+    for seg, ns in zip(
+        np.split(live, bounds), np.split(n_samples, bounds)
+    ):
+        if len(seg) == 0:
+            continue
+        # samples every `size` along the segments, ends included
+        seg = np.repeat(seg, ns)
+        k = np.arange(len(seg)) - np.repeat(np.cumsum(ns) - ns, ns)
+        t = np.minimum(k * size, length[seg])
+        sample = np.floor(
+            (a[seg] + u[seg] * t[:, None]) / size
+        ).astype(np.int64)
+        keep = np.isin(cell_keys(sample), near)
+        seg, sample = seg[keep], sample[keep]
+
+        # (segment, occupied cell) pairs, each once
+        around = cell_keys(sample[:, None, :] + NEIGHBOURS).ravel()
+        seg = np.repeat(seg, len(NEIGHBOURS))
+        cell = np.minimum(np.searchsorted(occupied, around), len(occupied) - 1)
+        found = occupied[cell] == around
+        pairs = np.unique(seg[found] * len(occupied) + cell[found])
+        seg, cell = pairs // len(occupied), pairs % len(occupied)
+
+        # and the receivers of those cells
+        n = counts[cell]
+        seg = np.repeat(seg, n)
+        rec = by_cell[
+            np.repeat(starts[cell], n)
+            + np.arange(int(n.sum())) - np.repeat(np.cumsum(n) - n, n)
+        ]
+        d = points[rec] - a[seg]
+        tc = np.clip(np.einsum('ij,ij->i', d, u[seg]), 0.0, length[seg])
+        dist = np.linalg.norm(d - u[seg] * tc[:, None], axis=1)
+        at = travelled[seg] + tc
+        radius = receiver_radius(at, alg_configs, c0)
+        hit = (dist <= radius) & (
+            (at / c0 / alg_configs['dt']).astype(np.int64) < n_bins
+        )
+        seg, rec, at, radius = seg[hit], rec[hit], at[hit], radius[hit]
+        energy = power[None, :] * np.exp(
+            gains[seg] - attenuation[None, :] * at[:, None]
+        ) / (np.pi * radius ** 2)[:, None]
+        for band in range(len(power)):
+            out[:, band] += np.bincount(
+                rec, weights=energy[:, band], minlength=len(points)
+            )
+    return out
+
+
+class ReceiverEvaluator:
+    """Receiver histograms of traced ray paths, for any receiver positions
+
+    The ray paths do not depend on the receivers: their segments are built
+    once, then evaluating receivers only takes a vectorized segment-sphere
+    test per receiver and source. `sources` are `results.SourceResult`,
+    `srcs` the source dicts they were traced from, and the histograms are
+    divided by `n_rays`. The histograms of a run are those of the engine,
+    which this only approximates, so the receivers of a run are re-evaluated
+    all at once, see `receivers.reevaluate`. It also evaluates the receiver
+    grids.
+
+    Every reflection absorbs `alpha`, the mean absorption per band. With
+    `hits`, the rows of the (k, n_bands) `alpha` table absorbing at each
+    reflection point of each source, see `hit_gains`.
+    """
+
+    def __init__(
+        self, sources, srcs, alpha, alg_configs, air_properties, c0,
+        n_rays=1, hits=None
+    ):
+        self.segments = [ray_segments(s.coord, s.histories) for s in sources]
+        self.srcs = srcs
+        alpha = np.asarray(alpha, dtype=np.float64)
+        if hits is None:
+            self.gains = [
+                reflection_gains(segments[3], alpha)
+                for segments in self.segments
+            ]
+        else:
+            self.gains = [
+                hit_gains(s.histories, rows, alpha)
+                for s, rows in zip(sources, hits)
+            ]
+        self.attenuation = air_attenuation(
+            alg_configs['freq'], air_properties['Temperature'],
+            air_properties['hr'], air_properties['p_atm']
+        )
+        self.alg_configs = alg_configs
+        self.c0 = c0
+        self.n_rays = max(1, n_rays)
+
+    def evaluate(self, recs):
+        """(n_srcs, n_recs, n_bands, n_bins) histograms of `recs`"""
+        return np.array([
+            receiver_histograms(
+                segments, src, recs, gains, self.attenuation,
+                self.alg_configs, self.c0
+            )
+            for segments, gains, src in zip(
+                self.segments, self.gains, self.srcs
+            )
+        ]) / self.n_rays
+
+    def grid(self, points):
+        """(n_srcs, m, n_bands) energies at the (m, 3) receiver `points`"""
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 3))
+        out = np.zeros(
+            (len(self.srcs), len(points), len(self.alg_configs['freq']))
+        )
+        for si, (segments, gains, src) in enumerate(
+            zip(self.segments, self.gains, self.srcs)
+        ):
+            out[si] = grid_energy(
+                segments, src, points, gains, self.attenuation,
+                self.alg_configs, self.c0
+            )
+        return out / self.n_rays
+
+
+def level(energy):
+    """Level in dB of the `energy`, an intensity"""
+    with np.errstate(divide='ignore'):
+        return 10.0 * np.log10(energy / REFERENCE_INTENSITY)
+
+
+def spl(histograms):
+    """Sound pressure level in dB of (..., n_bins) `histograms`"""
+    return level(histograms.sum(axis=-1))
+
+
+def decay_curves(histograms):
+    """Schroeder decay curves in dB of the (..., n_bins) `histograms`"""
+    tail = np.cumsum(histograms[..., ::-1], axis=-1)[..., ::-1]
+    total = tail[..., :1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 10.0 * np.log10(tail / total)
+
+
+def decay_change(previous, current):
+    """Largest change in dB between the decay curves of two histograms
+
+    Only the first `DECAY_RANGE` dB of the decays are compared. Infinite if a
+    curve is empty in one histogram but not the other, or if all are.
+    """
+    prev = decay_curves(previous)
+    cur = decay_curves(current)
+    both = (prev >= -DECAY_RANGE) & (cur >= -DECAY_RANGE)
+    either = (prev >= -DECAY_RANGE) | (cur >= -DECAY_RANGE)
+    if (either & ~both)[..., 0].any():
+        return np.inf
+    if not both.any():
+        # nothing reached the receivers yet
+        return np.inf
+    return float(np.abs(prev[both] - cur[both]).max())
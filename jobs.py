@@ -0,0 +1,451 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+from ra import simulation_api
+
+from . import (
+    engine, footprint, geometry, histograms, parallel, profiling, simulation
+)
+from .cache import result_key
+from .parallel import JobCancelled
+from .results import RayHistories, SourceResult
+
+
+class SimulationJob:
+    """Runs the engine in a background thread
+
+    The inputs are plain python/numpy data gathered on the main thread, since
+    blender data must not be touched from the worker. The main thread polls
+    `progress`, `stage` and `done`, and may request cancellation with
+    `cancel`, which is honored between stages and between sources (or ray
+    chunks, when tracing in parallel).
+
+    With `workers` > 1 the ray tracing is split over a process pool, see
+    `parallel.trace`, started along with the job (so from the main thread).
+    When a `cache.ResultCache` is given, results of identical inputs are
+    loaded from it instead of being traced again. When `store_dir` is given,
+    the ray histories are stored in memory mapped files there instead of in
+    memory. The stages are timed in `profile`, a `profiling.Profile`.
+
+    The energy histograms of each source at each receiver are those of the
+    engine, see `engine.receiver_histograms`. With `progressive`, the rays
+    are traced `increment` at a time, up to `n_rays`, and tracing stops once
+    the decay curves of the histograms change by less than `tolerance` dB
+    from an increment to the next. The ray directions are
+    drawn once for `n_rays`, each increment traces every n-th of them. The
+    histograms are updated after each increment, and the histories traced so
+    far are published for `partial_sources`, `revision` counts them.
+
+    `grid` are the (m, 3) points of receiver grids. They are not receivers of
+    the engine, only their energy per band is computed from the ray paths,
+    see `histograms.grid_energy`.
+
+    With `record_hits`, the material id of the surface hit at each reflection
+    point is recorded in `hits` (-1 for the points found on no surface within
+    `hit_tolerance`), so the energies can be computed again for other
+    absorption coefficients without tracing, see `histograms.hit_gains`. The
+    results of the run do not depend on it.
+
+    `memory_budget` bounds the memory of the run, in bytes (0 for no limit).
+    `plan` estimates it before the run, see `footprint.Footprint`. Runs over
+    the budget are traced `chunk_rays` rays at a time, like the increments of
+    a progressive run, and the histories of each chunk are spilled to memory
+    mapped files in `store_dir` (a temporary folder if not given) as soon as
+    they are evaluated.
+    """
+
+    def __init__(
+        self, planes, srcs, recs, alg_configs, air_properties, workers=1,
+        chunk_size=1000, cache=None, store_dir=None, profile=None,
+        progressive=False, increment=1000, tolerance=0.5, grid=None,
+        record_hits=False, memory_budget=0,
+        hit_tolerance=geometry.HIT_TOLERANCE
+    ):
+        self.planes = planes
+        self.srcs = srcs
+        self.recs = recs
+        self.alg_configs = alg_configs
+        self.air_properties = air_properties
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.store_dir = store_dir
+        self.profile = profile if profile is not None else profiling.Profile()
+        self.progressive = progressive
+        self.increment = increment
+        self.tolerance = tolerance
+        self.grid = np.zeros((0, 3)) if grid is None else np.asarray(grid)
+        self.record_hits = record_hits
+        self.hit_tolerance = hit_tolerance
+        self.memory_budget = memory_budget
+
+        self.progress = 0.0
+        self.stage = "queued"
+        self.sources = None
+        self.histograms = None  # (n_srcs, n_recs, n_bands, n_bins)
+        self.grid_energy = None  # (n_srcs, m, n_bands)
+        self.hits = None  # material id of each reflection point
+        self.footprint = None
+        self.chunk_rays = None  # rays per chunk, when over the budget
+        self.rays_traced = 0
+        self.convergence = None  # last change of the decay curves, in dB
+        self.revision = 0
+        self.partial = None  # histories parts, see `partial_sources`
+        self.cached = False
+        self.error = None
+
+        self.pool = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.open_pool()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def open_pool(self):
+        if self.workers > 1 and self.pool is None and parallel.available():
+            self.pool = parallel.pool(self.workers)
+
+    def close_pool(self):
+        if self.pool is not None:
+            # tasks cancelled while running are left to finish on their own
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        return self._thread is not None and not self._thread.is_alive()
+
+    def step(self, stage, progress):
+        if self.cancelled:
+            raise JobCancelled()
+        self.stage = stage
+        self.progress = progress
+
+    @property
+    def incremental(self):
+        return self.progressive or self.chunk_rays is not None
+
+    def plan(self):
+        """Estimate the memory of the run and chunk it to fit the budget
+
+        Raises `footprint.MemoryBudgetError` when it can not fit.
+        """
+        with self.profile.stage("memory estimate") as record:
+            self.footprint = footprint.Footprint(
+                self.planes, len(self.srcs), len(self.recs), len(self.grid),
+                self.alg_configs,
+                simulation.sound_speed(self.air_properties['Temperature']),
+                self.record_hits, self.workers
+            )
+            record['estimate_mb'] = round(self.footprint.total / 2**20)
+            self.chunk_rays = self.footprint.chunk_rays(self.memory_budget)
+            if self.chunk_rays is None:
+                return
+            record['chunk_rays'] = self.chunk_rays
+        self.increment = (
+            min(self.increment, self.chunk_rays) if self.progressive
+            else self.chunk_rays
+        )
+        if self.store_dir is None:
+            self.store_dir = tempfile.mkdtemp(prefix='ra-hist-')
+
+    def run(self):
+        profile = self.profile
+        try:
+            self.open_pool()
+            if self.footprint is None:
+                self.step("memory estimate", 0.0)
+                self.plan()
+            key = None
+            if self.cache is not None:
+                self.step("cache lookup", 0.0)
+                alg_configs = self.alg_configs
+                if self.incremental:
+                    # early stops and chunks give different results
+                    alg_configs = dict(alg_configs, progressive=[
+                        self.increment,
+                        self.tolerance if self.progressive else None
+                    ])
+                with profile.stage("cache lookup") as record:
+                    key = result_key(
+                        self.planes, self.srcs, self.recs, alg_configs,
+                        self.air_properties, self.grid
+                    )
+                    entry = self.cache.get(key)
+                    record['hit'] = entry is not None
+                if entry is not None:
+                    sources, meta, arrays = entry
+                    self.rays_traced = meta.get(
+                        'n_rays', self.alg_configs['n_rays']
+                    )
+                    self.histograms = arrays['histograms']
+                    self.hits = arrays.get('hits')
+                    if self.hits is None and self.record_hits:
+                        self.hits = np.concatenate(self.locate_hits(sources))
+                    self.grid_energy = arrays.get('grid_energy')
+                    if self.grid_energy is None:
+                        self.grid_energy = self.evaluator(sources).grid(
+                            self.grid
+                        ) / self.rays_traced
+                    self.sources = sources
+                    self.cached = True
+                    self.step("done", 1.0)
+                    return
+
+            self.step("geometry", 0.0)
+            sims = simulation_api.Simulation()
+            n_rays = self.alg_configs['n_rays']
+            sims.set_configs(self.alg_configs)
+            sims.set_air(self.air_properties)
+            with profile.stage("set_geometry", planes=len(self.planes)):
+                sims.set_geometry(self.planes.to_dicts())
+            self.step("ray directions", 0.05)
+            with profile.stage("set_raydir", rays=n_rays):
+                sims.set_raydir()
+                directions = engine.ray_directions(sims)
+                if self.chunk_rays is not None:
+                    # the engine allocates the rays of a chunk at a time
+                    sims.set_configs(
+                        dict(self.alg_configs, n_rays=self.increment)
+                    )
+                    sims.set_raydir()
+            with profile.stage("memory init", receivers=len(self.recs)):
+                sims.set_receivers(self.recs)
+                sims.set_memory_init()
+            sims.set_sources(self.srcs)
+            self.step("statistical reverberation", 0.1)
+            with profile.stage("statistical reverberation"):
+                sims.run_statistical_reverberation()
+
+            if self.incremental:
+                sources = self.trace_progressive(sims, directions)
+            else:
+                with profile.stage(
+                    "run_raytracing", sources=len(self.srcs),
+                    rays=self.alg_configs['n_rays'] * len(self.srcs)
+                ) as record:
+                    sources, hist = self.trace_increment(
+                        sims, directions, 0.15, 0.85, self.store_dir
+                    )
+                    record['reflections'] = sum(
+                        int(s.histories.offsets[-1]) for s in sources
+                    )
+                self.step("evaluation", 1.0)
+                grid, hits = self.evaluate(sources)
+                self.histograms = hist
+                self.grid_energy = grid / max(1, n_rays)
+                if hits is not None:
+                    self.hits = np.concatenate(hits)
+                self.rays_traced = n_rays
+
+            arrays = {'grid_energy': self.grid_energy}
+            if self.hits is not None:
+                arrays['hits'] = self.hits
+
+            if self.cache is not None:
+                self.step("caching results", 1.0)
+                with profile.stage("cache store"):
+                    self.cache.put(key, sources, {
+                        'alg_configs': self.alg_configs,
+                        'air_properties': self.air_properties,
+                        'n_rays': self.rays_traced,
+                    }, self.histograms, **arrays)
+
+            self.step("done", 1.0)
+            self.sources = sources
+        except JobCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self.close_pool()
+
+    def trace_increment(self, sims, directions, start, span, folder=None):
+        """Trace the rays of the (n, 3) `directions` from every source
+
+        Progress goes from `start` to `start + span`. The histories of source
+        `si` are stored in `folder`/hist-`si`.npy, if given. Returns the
+        `SourceResult` of every source and their (n_srcs, n_recs, n_bands,
+        n_bins) histograms at the receivers, per ray.
+        """
+        stage = "ray tracing"
+        if self.incremental:
+            stage += f" {self.rays_traced}/{self.alg_configs['n_rays']} rays"
+            if self.convergence is not None:
+                stage += f", {self.convergence:.2f} dB"
+
+        def step(p):
+            self.step(stage, start + span * p)
+
+        if self.pool is not None:
+            step(0.0)
+            sources, hist = parallel.trace(
+                self.pool, self.planes, self.srcs, self.recs,
+                self.alg_configs, self.air_properties, directions,
+                self.chunk_size, step=step, store_dir=folder
+            )
+        else:
+            sources, hist = self.trace(sims, directions, step, folder)
+        return sources, hist
+
+    def trace(self, sims, directions, step, folder=None):
+        # sources are traced one at a time so progress can be reported and
+        # cancellation honored in between, each with fresh engine memory
+        recs = self.recs
+        sources = []
+        hist = []
+        for si, src in enumerate(self.srcs):
+            step(si / len(self.srcs))
+            source, h = engine.trace(
+                sims, src, directions, self.alg_configs, recs,
+                os.path.join(folder, f"hist-{si}.npy")
+                if folder is not None else None
+            )
+            sources.append(source)
+            hist.append(h)
+        return sources, np.reshape(hist, (
+            len(self.srcs), len(recs), len(self.alg_configs['freq']),
+            engine.n_bins(self.alg_configs)
+        ))
+
+    def trace_progressive(self, sims, directions):
+        total = len(directions)
+        # every n-th direction, so each increment covers them all evenly
+        n_parts = -(-total // max(1, min(self.increment, total)))
+        parts = [[] for _ in self.srcs]
+        hit_parts = [[] for _ in self.srcs]
+        # summed over the rays traced
+        energy = grid = 0.0
+        previous = None
+        k = 0
+        while self.rays_traced < total:
+            part = directions[k::n_parts]
+            n_rays = len(part)
+            folder = None
+            if self.chunk_rays is not None:
+                # spilled, so only the chunk being evaluated is in memory
+                folder = os.path.join(self.store_dir, f"chunk-{k}")
+                os.makedirs(folder, exist_ok=True)
+            with self.profile.stage(
+                "run_raytracing", sources=len(self.srcs), increment=k,
+                rays=n_rays * len(self.srcs)
+            ):
+                sources, hist = self.trace_increment(
+                    sims, part, 0.15 + 0.85 * self.rays_traced / total,
+                    0.85 * n_rays / total, folder
+                )
+            g, hits = self.evaluate(sources)
+            energy = energy + hist * n_rays
+            grid = grid + g
+            if hits is not None:
+                for p, h in zip(hit_parts, hits):
+                    p.append(h)
+            self.rays_traced += n_rays
+            current = energy / self.rays_traced
+
+            for p, s in zip(parts, sources):
+                p.append(s.histories)
+            last = self.rays_traced >= total
+            if self.progressive and previous is not None:
+                self.convergence = histograms.decay_change(previous, current)
+                last = last or self.convergence <= self.tolerance
+            self.histograms = current
+            self.grid_energy = grid / self.rays_traced
+            if last:
+                break
+            if self.chunk_rays is None:
+                # the histories of a chunked run are not gathered in memory
+                self.partial = [list(p) for p in parts]
+                self.revision += 1
+            previous = current
+            k += 1
+        if self.record_hits:
+            self.hits = np.concatenate(
+                [np.zeros(0, dtype=np.int32)] + sum(hit_parts, [])
+            )
+        # the final histories go to `store_dir`, if any
+        return [
+            SourceResult(tuple(src['coord']), RayHistories.concatenate(
+                p, self.history_path(si)
+            ))
+            for si, (src, p) in enumerate(zip(self.srcs, parts))
+        ]
+
+    def partial_sources(self):
+        """The `SourceResult`s of the increments published so far, or None
+
+        Their histories are only concatenated here, on request of the
+        viewport, see `RA_OT_run`.
+        """
+        partial = self.partial
+        if partial is None:
+            return None
+        return [
+            SourceResult(tuple(src['coord']), RayHistories.concatenate(p))
+            for src, p in zip(self.srcs, partial)
+        ]
+
+    def locate_hits(self, sources):
+        """Material id of the surface of every reflection point of `sources`
+
+        One array per source, -1 for the points found on no surface.
+        """
+        with self.profile.stage(
+            "surface hits", points=sum(
+                int(s.histories.offsets[-1]) for s in sources
+            )
+        ):
+            mat_ids = np.append(self.planes.mat_ids, -1).astype(np.int32)
+            return [
+                mat_ids[geometry.locate_hits(
+                    s.histories.points, self.planes, self.hit_tolerance
+                )]
+                for s in sources
+            ]
+
+    def evaluator(self, sources):
+        """`histograms.ReceiverEvaluator` of `sources`, of the mean absorption
+
+        The surface hits are not used, so the results of a run do not depend
+        on `record_hits`.
+        """
+        return histograms.ReceiverEvaluator(
+            sources, self.srcs, histograms.mean_alpha(self.planes),
+            self.alg_configs, self.air_properties,
+            simulation.sound_speed(self.air_properties['Temperature'])
+        )
+
+    def evaluate(self, sources):
+        """Grid energies of `sources`, and their surface hits
+
+        Returns the (n_srcs, m, n_bands) energies at the `grid` points, summed
+        over the rays, and the `locate_hits` of the sources (None without
+        `record_hits`).
+        """
+        hits = self.locate_hits(sources) if self.record_hits else None
+        grid = np.zeros(
+            (len(self.srcs), len(self.grid), len(self.alg_configs['freq']))
+        )
+        if len(self.grid):
+            with self.profile.stage("path evaluation", grid=len(self.grid)):
+                grid = self.evaluator(sources).grid(self.grid)
+        return grid, hits
+
+    def history_path(self, si):
+        if self.store_dir is None:
+            return None
+        return os.path.join(self.store_dir, f"hist-{si}.npy")
+
+
+current_job = None
@@ -0,0 +1,198 @@
+import csv
+import pathlib
+
+import numpy as np
+
+
+class RAMaterialError(Exception):
+    """An object references a material that is not in the materials database"""
+
+
+class MaterialResolver:
+    """Lookup table from material ids to absorption coefficients
+
+    The table is built from `scene.ra.mat_db` once and reused across runs until
+    `invalidate` is called (the materials database properties and operators do
+    so whenever it changes), so resolving the materials of a run is
+    O(triangles) regardless of the library size.
+    """
+
+    def __init__(self):
+        self.rows = np.zeros((0,), dtype=np.int64)  # mat_id -> row, -1 if none
+        self.alpha = np.zeros((0, 8), dtype=np.float32)
+        self.owner = None  # pointer to the scene owning the table
+        self.dirty = True
+
+    def invalidate(self):
+        self.dirty = True
+
+    def update(self, mat_db):
+        """Rebuild the lookup table from `mat_db`, if it changed"""
+        owner = mat_db.id_data.as_pointer()
+        if not self.dirty and owner == self.owner:
+            return
+
+        n = len(mat_db)
+        ids = np.empty(n, dtype=np.int32)
+        mat_db.foreach_get('index', ids)
+        alpha = np.empty(n * 8, dtype=np.float32)
+        mat_db.foreach_get('alpha', alpha)
+
+        # as in a linear scan of `mat_db`, the last entry with an id wins
+        rows = np.full(ids.max() + 1 if n else 0, -1, dtype=np.int64)
+        rows[ids] = np.arange(n)
+        self.rows = rows
+        self.alpha = alpha.reshape((-1, 8))
+        self.owner = owner
+        self.dirty = False
+
+    def lookup(self, mat_ids):
+        """Rows of `self.alpha` for each of `mat_ids`, -1 for unknown ids"""
+        mat_ids = np.asarray(mat_ids, dtype=np.int64)
+        if len(self.rows) == 0:
+            return np.full(mat_ids.shape, -1, dtype=np.int64)
+        valid = (mat_ids >= 0) & (mat_ids < len(self.rows))
+        return np.where(valid, self.rows[np.where(valid, mat_ids, 0)], -1)
+
+    def resolve(self, obj, slot_index):
+        """Per triangle material ids, absorption and scattering of `obj`
+
+        `slot_index` holds the material slot of each triangle, as given by the
+        loop triangles `material_index`.
+        """
+        slots = obj.material_slots
+        if len(slots) == 0:
+            raise RAMaterialError(f"Object {obj.name} has no valid material")
+
+        slot_ids = np.array([
+            s.material.ra.mat_id if s.material is not None else -1
+            for s in slots
+        ], dtype=np.int64)
+        slot_scattering = np.array([
+            s.material.ra.scattering if s.material is not None else 0.0
+            for s in slots
+        ], dtype=np.float64)
+        slot_rows = self.lookup(slot_ids)
+
+        # like blender, out of range indices fall back to the last slot
+        slot_index = np.clip(slot_index, 0, len(slots) - 1)
+        used = np.unique(slot_index)
+        invalid = used[slot_rows[used] < 0]
+        if len(invalid):
+            slot = slots[int(invalid[0])]
+            raise RAMaterialError(
+                f"Object {obj.name} has no valid material in slot "
+                f"{slot.name or int(invalid[0])}"
+            )
+
+        rows = slot_rows[slot_index]
+        return slot_ids[slot_index], self.alpha[rows], slot_scattering[slot_index]
+
+
+material_resolver = MaterialResolver()
+
+
+class MaterialLibrary:
+    """Materials database entries as arrays: ids, descriptions and alphas
+
+    Libraries are stored as .csv files (one row per material, with the alpha
+    vector as a bracketed list) or as compact .npz files. Both are read and
+    written in bulk, and so is `scene.ra.mat_db`.
+    """
+
+    CSV_FIELDS = ('id', 'Description', 'alpha')
+
+    def __init__(self, ids, descriptions, alpha):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.descriptions = list(descriptions)
+        self.alpha = np.asarray(alpha, dtype=np.float32).reshape((-1, 8))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_mat_db(cls, mat_db):
+        n = len(mat_db)
+        ids = np.empty(n, dtype=np.int32)
+        mat_db.foreach_get('index', ids)
+        alpha = np.empty(n * 8, dtype=np.float32)
+        mat_db.foreach_get('alpha', alpha)
+        return cls(ids, [m.description for m in mat_db], alpha)
+
+    def to_mat_db(self, mat_db, merge=False):
+        """Fill `mat_db` with the library
+
+        The collection is replaced, or with `merge` the entries with an id
+        already in `mat_db` are updated in place and the others are appended.
+        """
+        if merge:
+            current = MaterialLibrary.from_mat_db(mat_db)
+            # as in `MaterialResolver`, the last entry with an id wins
+            rows = dict(zip(current.ids.tolist(), range(len(current))))
+            target = np.array(
+                [rows.get(i, -1) for i in self.ids.tolist()], dtype=np.int64
+            )
+            new = target < 0
+            target[new] = len(current) + np.arange(new.sum())
+            ids = np.concatenate((current.ids, self.ids[new]))
+            alpha = np.concatenate((current.alpha, self.alpha[new]))
+            alpha[target] = self.alpha
+            descriptions = current.descriptions + [None] * int(new.sum())
+            for row, description in zip(target.tolist(), self.descriptions):
+                descriptions[row] = description
+        else:
+            mat_db.clear()
+            ids, alpha, descriptions = self.ids, self.alpha, self.descriptions
+
+        for _ in range(len(ids) - len(mat_db)):
+            mat_db.add()
+        mat_db.foreach_set('index', ids.astype(np.int32))
+        mat_db.foreach_set('alpha', alpha.ravel())
+        for m, description in zip(mat_db, descriptions):
+            if m.description != description:
+                m.description = description
+        material_resolver.invalidate()
+
+    @classmethod
+    def read(cls, path):
+        """Read a .npz or a .csv library file"""
+        path = pathlib.Path(path)
+        if path.suffix == '.npz':
+            with np.load(path) as data:
+                return cls(
+                    data['ids'], data['descriptions'].tolist(), data['alpha']
+                )
+
+        with path.open(newline='') as f:
+            rows = list(csv.DictReader(f, quotechar='"', delimiter=','))
+        # all the alpha lists are parsed at once
+        alpha = np.array(
+            " ".join(r['alpha'] for r in rows).replace('[', ' ')
+            .replace(']', ' ').split(),
+            dtype=np.float32
+        )
+        if alpha.size != 8 * len(rows):
+            raise ValueError(f"Expected 8 alpha values per material: {path}")
+        return cls(
+            [int(r['id']) for r in rows],
+            [r['Description'] for r in rows], alpha
+        )
+
+    def write(self, path):
+        """Write to a .npz file, or a .csv file for any other extension"""
+        path = pathlib.Path(path)
+        if path.suffix == '.npz':
+            np.savez(
+                path, ids=self.ids, alpha=self.alpha,
+                descriptions=np.array(self.descriptions, dtype=str)
+            )
+            return
+
+        alpha = [
+            "[" + " ".join(row) + "]"
+            for row in self.alpha.astype(str).tolist()
+        ]
+        with path.open(mode='w', newline='') as f:
+            writer = csv.writer(f, quotechar='"', delimiter=',')
+            writer.writerow(self.CSV_FIELDS)
+            writer.writerows(zip(self.ids.tolist(), self.descriptions, alpha))
@@ -1,7 +1,10 @@
 
-import csv
+import datetime
 import json
 import pathlib
+import shutil
+import tempfile
+import time
 
 import bmesh
 import bpy
@@ -13,9 +16,14 @@ import gpu
 from gpu_extras.batch import batch_for_shader
 from mathutils import Vector
 import numpy as np
-from ra import simulation_api
 
-from .rendering import rendering_man
+from . import (
+    auralization, cache, footprint, geometry, grids, histograms, jobs,
+    materials, profiling, proxy, results, simulation
+)
+from .grids import heatmap_man
+from .receivers import live_receivers, reevaluate, results_evaluator
+from .rendering import rendering_man, tag_redraw_view3d
 
 gldraw_handler = None
 
@@ -26,117 +34,228 @@ class RA_OT_run(bpy.types.Operator):
     bl_label = 'Run'
     bl_options = {'REGISTER', 'UNDO'}
 
+    _timer = None
+    _revision = 0
+    _grids = ()
+    _cells = None
+
+    @classmethod
+    def poll(cls, context):
+        return not context.scene.ra.rtngn_running
+
     def execute(self, context):
-        global gldraw_handler
-
-        context.scene.ra.rtngn_running = not context.scene.ra.rtngn_running
-
-        alg_configs = {
-            'freq': [63.0, 125.0, 250.0, 500.0, 1000.0, 2000.0, 4000.0, 8000.0],
-            'n_rays': context.scene.ra.nrays,
-            'ht_length': context.scene.ra.ht_length,
-            'dt': context.scene.ra.dt,
-            'allow_scattering': int(context.scene.ra.allow_scattering),
-            'transition_order': context.scene.ra.transition_order,
-            'rec_radius_init': context.scene.ra.rec_radius_init,
-            'allow_growth': int(context.scene.ra.allow_growth),
-            'rec_radius_final': context.scene.ra.rec_radius_final
-        }
-        air_properties = {
-            'Temperature': context.scene.ra.temperature,
-            'hr': context.scene.ra.hr,
-            'p_atm': context.scene.ra.p_atm
-        }
-
-        planes = []
-        recs = []
-        srcs = []
-        for obj in bpy.context.scene.objects:
-            if obj.ra.enable:
-                if obj.ra.nature == 'GEOM' and obj.type == 'MESH':
-                    obj.data.calc_loop_triangles()
-                    for i, tri in enumerate(obj.data.loop_triangles):
-                        # convert from local to global coordinates
-                        vertices = np.array(
-                            [obj.matrix_world @ obj.data.vertices[i].co
-                            for i in tri.vertices]
-                        )
-                        normal = np.array(
-                            obj.matrix_world @ tri.normal,
-                            dtype=np.float32
-                        )
-                        # compute triangle area using global coords vertices
-                        a, b, c = vertices
-                        area = np.linalg.norm(np.cross((b - a), (c-a))) * 0.5
-
-                        alpha = None
-                        # FIXME: raise exceptions instead of checking with `if`
-                        if obj.active_material is None:
-                            self.report(
-                                {'ERROR'},
-                                f"Object {obj.name} has no valid material"
-                            )
-                            return {'FINISHED'}
-
-                        mat_idx = obj.active_material.ra.mat_id
-                        scattering = obj.active_material.ra.scattering
-                        for m in bpy.context.scene.ra.mat_db:
-                            if m.index == mat_idx:
-                                alpha = np.array(
-                                    m.alpha,
-                                    dtype=np.float32
-                                )
-                        if alpha is None:
-                            self.report(
-                                {'ERROR'},
-                                f"Object {obj.name} has no valid material"
-                            )
-                            return {'FINISHED'}
-
-                        planes.append({
-                            'name': f"{obj.name}.{i}",
-                            'bbox': False,
-                            'vertices': vertices,
-                            'normal': normal,
-                            # 'alpha': np.array([0.14]*8, dtype=np.float32),
-                            'alpha': alpha,
-                            's': scattering,
-                            # 'area': tri.area  # FIXME: should be computed by the engine
-                            'area': area
-                        })
-                elif obj.ra.nature == 'SOURCE':
-                    srcs.append({
-                        'coord': tuple(obj.location),
-                        'orientation': [0.0, 1.0, 0.0],
-                        'power_dB': list(obj.ra.power_db),
-                        'eq_dB': list(obj.ra.eq_db),
-                        'delay': obj.ra.delay,
-                    })
-                elif obj.ra.nature == 'RECEIVER':
-                    recs.append({
-                        'coord': tuple(obj.location),
-                        'orientation': [0.0, 1.0, 0.0]
-                    })
-
-        sims = simulation_api.Simulation()
-        sims.set_configs(alg_configs)
-        sims.set_air(air_properties)
-        sims.set_geometry(planes)
-        sims.set_raydir()
-        sims.set_receivers(recs)
-        sims.set_memory_init()
-        sims.set_sources(srcs)
-        sims.run_statistical_reverberation()
-        sims.run_raytracing()
-
-        rendering_man.set_sources(sims.sources)
+        scene_ra = context.scene.ra
+        profile = profiling.Profile(
+            memory=scene_ra.profile_memory,
+            log_path=bpy.path.abspath(scene_ra.profile_log) or None,
+            run=datetime.datetime.now().isoformat(timespec='seconds'),
+            file=bpy.data.filepath,
+            title=scene_ra.title,
+            blender=bpy.app.version_string,
+        )
+        try:
+            with profile.stage("geometry extraction") as record:
+                planes, srcs, recs = simulation.collect(context.scene)
+                grid_objs = simulation.receiver_grids(context.scene)
+                self._cells, counts = grids.sample(grid_objs)
+                self._grids = [
+                    [obj.name, n] for obj, n in zip(grid_objs, counts)
+                ]
+                record['triangles'] = planes.n_triangles
+                record['planes'] = len(planes)
+                record['grid'] = len(self._cells)
+        except materials.RAMaterialError as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        if len(planes) < planes.n_triangles:
+            self.report({'INFO'}, (
+                f"Merged {planes.n_triangles} triangles into {len(planes)} "
+                f"planes ({planes.n_triangles / len(planes):.1f}x fewer)"
+            ))
+
+        # the engine runs in a worker thread, `modal` polls it on a timer
+        job = jobs.SimulationJob(
+            planes, srcs, recs,
+            simulation.alg_configs(context.scene),
+            simulation.air_properties(context.scene),
+            workers=scene_ra.workers if scene_ra.parallel else 1,
+            chunk_size=scene_ra.rays_per_task,
+            cache=cache.ResultCache(
+                bpy.path.abspath(scene_ra.cache_dir),
+                scene_ra.cache_size * 2**20
+            ) if scene_ra.use_cache else None,
+            store_dir=tempfile.mkdtemp(prefix='ra-hist-')
+            if scene_ra.mmap_histories else None,
+            profile=profile,
+            progressive=scene_ra.progressive,
+            increment=scene_ra.rays_increment,
+            tolerance=scene_ra.convergence_tol,
+            grid=self._cells.mean(axis=1),
+            record_hits=scene_ra.record_hits,
+            memory_budget=scene_ra.memory_budget * 2**20,
+            # merged planes may be off their triangles by the merge tolerance
+            hit_tolerance=geometry.HIT_TOLERANCE + (
+                scene_ra.merge_tolerance if scene_ra.merge_coplanar else 0.0
+            )
+        )
+        try:
+            job.plan()
+        except footprint.MemoryBudgetError as e:
+            if job.store_dir is not None:
+                shutil.rmtree(job.store_dir, ignore_errors=True)
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        if job.chunk_rays is not None:
+            self.report({'INFO'}, (
+                f"Estimated {footprint.mib(job.footprint.total)}, over the "
+                f"memory budget: tracing {job.chunk_rays} rays per source at "
+                f"a time, {footprint.mib(job.footprint.histories)} of ray "
+                f"histories spilled to disk"
+            ))
+        self._revision = 0
+        jobs.current_job = job
+        job.start()
+        context.scene.ra.rtngn_running = True
+
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        job = jobs.current_job
+        if event.type == 'ESC':
+            job.cancel()
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        context.window_manager.progress_update(job.progress * 100)
+        tag_redraw_view3d()
+        if not job.done:
+            if job.revision != self._revision:
+                # show the rays traced so far
+                self._revision = job.revision
+                self.show(context, job.partial_sources())
+            return {'PASS_THROUGH'}
+
+        self.finish(context)
+        if job.error is not None:
+            self.report({'ERROR'}, f"Simulation failed: {job.error}")
+            return {'CANCELLED'}
+        if job.cancelled:
+            self.report({'WARNING'}, "Simulation cancelled")
+            return {'CANCELLED'}
+
+        scene_ra = context.scene.ra
+        c0 = simulation.sound_speed(scene_ra.temperature)
+        results.current_results = results.SimulationResults(job.sources, {
+            'title': scene_ra.title,
+            'alg_configs': job.alg_configs,
+            'air_properties': job.air_properties,
+            'n_rays': job.rays_traced,
+            'c0': c0,
+            # to re-evaluate moved receivers, see `receivers.LiveReceivers`
+            'sources': job.srcs,
+            'source_names': [
+                obj.name for obj in simulation.sources(context.scene)
+            ],
+            'receivers': [
+                obj.name for obj in simulation.receivers(context.scene)
+            ],
+            'recs': [list(rec['coord']) for rec in job.recs],
+            'mean_alpha': histograms.mean_alpha(job.planes).tolist(),
+            # [name, number of cells] of each receiver grid
+            'grids': self._grids,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        }, {
+            'histograms': job.histograms,
+            'grid_energy': job.grid_energy,
+            'grid_cells': self._cells,
+        })
+        if job.hits is not None:
+            # to re-evaluate other absorptions, see `RA_OT_reevaluate`
+            ids, alpha, areas = histograms.material_alpha(job.planes)
+            results.current_results.meta['materials'] = {
+                'ids': ids.tolist(),
+                'alpha': alpha.tolist(),
+                'areas': areas.tolist(),
+            }
+            results.current_results.arrays['hits'] = job.hits
+            unresolved = int(np.count_nonzero(job.hits < 0))
+            if unresolved:
+                self.report({'WARNING'}, (
+                    f"{unresolved} of {len(job.hits)} reflection points were "
+                    f"found on no surface, re-evaluations give them the mean "
+                    f"absorption"
+                ))
+        # written next to the .blend when it is saved, see
+        # `handlers.save_post`, not to stall the UI here
+        live_receivers.clear()
+
+        self.show(context, job.sources)
+        # the histories of the previous results are no longer mapped
+        results.discard_dir()
+        # the buffers are built on first draw, and timed along the run
+        rendering_man.profile = job.profile
+
+        if job.cached:
+            self.report({'INFO'}, "Simulation results loaded from cache")
+        else:
+            self.report({'INFO'}, "Simulation finished!")
+        return {'FINISHED'}
+
+    def show(self, context, sources):
+        scene_ra = context.scene.ra
+        job = jobs.current_job
+        rendering_man.set_lod(
+            scene_ra.render_budget, cull=scene_ra.render_cull,
+            coarse=scene_ra.render_coarse
+        )
+        rendering_man.set_colors(scene_ra.render_colors)
+        rendering_man.set_sources(
+            sources, c0=simulation.sound_speed(scene_ra.temperature),
+            alpha=histograms.mean_alpha(job.planes),
+            attenuation=histograms.air_attenuation(
+                job.alg_configs['freq'],
+                job.air_properties['Temperature'], job.air_properties['hr'],
+                job.air_properties['p_atm']
+            )
+        )
         rendering_man.reg_draw_callback(
-            order=context.scene.ra.render_order, render=context.scene.ra.render
+            order=scene_ra.render_order, render=scene_ra.render
         )
+        if job.grid_energy is not None:
+            heatmap_man.set_grid(self._cells, job.grid_energy)
+            heatmap_man.set_band(scene_ra.heatmap_band)
+            heatmap_man.reg_draw_callback(render=scene_ra.render_heatmap)
+
+    def cancel(self, context):
+        jobs.current_job.cancel()
+        self.finish(context)
+
+    def finish(self, context):
+        if jobs.current_job.store_dir is not None:
+            # the histories stay mapped, only their directory entries go, or
+            # the whole folder once released, see `results.discard_dir`
+            results.discard_dir(jobs.current_job.store_dir)
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.scene.ra.rtngn_running = False
+
+
+class RA_OT_cancel(bpy.types.Operator):
+    """Cancels the running simulation"""
+    bl_idname = 'ra.cancel'
+    bl_label = 'Cancel'
 
-        context.area.tag_redraw()
+    @classmethod
+    def poll(cls, context):
+        return context.scene.ra.rtngn_running and jobs.current_job is not None
 
-        self.report({'INFO'}, "Simulation finished!")
+    def execute(self, context):
+        jobs.current_job.cancel()
         return {'FINISHED'}
 
 class RA_OT_debug(bpy.types.Operator):
@@ -158,6 +277,7 @@ class RA_OT_new_mat(bpy.types.Operator):
         new_mat = context.scene.ra.mat_db.add()
         new_mat.index = context.scene.ra.mat_db_max_index + 1
         context.scene.ra.mat_db_max_index += 1
+        materials.material_resolver.invalidate()
         bpy.context.scene.ra.mat_db_index = len(context.scene.ra.mat_db) - 1
         return{'FINISHED'}
 
@@ -175,6 +295,7 @@ class RA_OT_del_mat(bpy.types.Operator):
         mat_db = context.scene.ra.mat_db
         index = context.scene.ra.mat_db_index
         mat_db.remove(index)
+        materials.material_resolver.invalidate()
         context.scene.ra.mat_db_index = min(max(0, index - 1), len(mat_db) - 1)
         return{'FINISHED'}
 
@@ -205,75 +326,321 @@ class RA_OT_mv_mat(bpy.types.Operator):
         index = context.scene.ra.mat_db_index
         neighbor = index + (-1 if self.direction == 'UP' else 1)
         mat_db.move(neighbor, index)
+        materials.material_resolver.invalidate()
         self.move_index()
         return{'FINISHED'}
 
 
 class RA_OT_save_mat(bpy.types.Operator, ExportHelper):
-    """Save the materials list to the file system"""
+    """Save the materials list to the file system, as .csv or .npz"""
 
     bl_idname = 'ra.save_mat'
     bl_label = 'save'
     filename_ext = ".csv"
+    # the format follows the extension given, .csv by default
+    check_extension = False
 
-    filter_glob: StringProperty(default="*.csv", options={'HIDDEN'}, maxlen=255)
+    filter_glob: StringProperty(
+        default="*.csv;*.npz", options={'HIDDEN'}, maxlen=255
+    )
 
     @classmethod
     def poll(cls, context):
         return context.scene.ra.mat_db
 
     def execute(self, context):
+        p = pathlib.Path(self.filepath)
+        if p.suffix not in ('.csv', '.npz'):
+            p = p.with_name(p.name + self.filename_ext)
         mat_db = context.scene.ra.mat_db
+        materials.MaterialLibrary.from_mat_db(mat_db).write(p)
 
-        p = pathlib.Path(self.filepath)
-        fieldnames = ['id', 'Description', 'alpha']
-        with p.open(mode='w') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, quotechar='"', delimiter=',')
-            writer.writeheader()
-            for m in mat_db:
-                row = (
-                    str(m.index),
-                    m.description,
-                    "[" + " ".join([str(a) for a in m.alpha]) + "]"
-                )
-                writer.writerow(dict(zip(fieldnames, row)))
-
-        self.report({'INFO'}, f"Materials file saved to: {self.filepath}")
+        self.report({'INFO'}, f"Materials file saved to: {p}")
         return {'FINISHED'}
 
 
 class RA_OT_load_mat(bpy.types.Operator, ImportHelper):
-    """Load the materials list from the file system"""
+    """Load the materials list from the file system, .csv or .npz"""
 
     bl_idname = 'ra.load_mat'
     bl_label = 'Load'
     filename_ext = ".csv"
 
-    filter_glob: StringProperty(default="*.csv", options={'HIDDEN'}, maxlen=255)
+    filter_glob: StringProperty(
+        default="*.csv;*.npz", options={'HIDDEN'}, maxlen=255
+    )
+    merge: bpy.props.BoolProperty(
+        name="Merge",
+        description="Update the materials with the same id and add the "
+            "others, instead of replacing the whole list",
+        default=False
+    )
 
     def execute(self, context):
-        p = pathlib.Path(self.filepath)
-        with p.open() as f:
-            reader = csv.DictReader(f, quotechar='"', delimiter=',')
-            data = list(reader)
+        try:
+            library = materials.MaterialLibrary.read(self.filepath)
+        except (OSError, ValueError, KeyError) as e:
+            self.report({'ERROR'}, f"Could not load {self.filepath}: {e}")
+            return {'CANCELLED'}
+
+        scene_ra = context.scene.ra
+        library.to_mat_db(scene_ra.mat_db, merge=self.merge)
+        max_index = int(library.ids.max(initial=-1))
+        if self.merge:
+            max_index = max(max_index, scene_ra.mat_db_max_index)
+        scene_ra.mat_db_max_index = max_index
+        scene_ra.mat_db_index = 0
 
-        # FIXME: should do this in a more efficient way
-        # wipe entire list of materials
-        for _ in range(len(context.scene.ra.mat_db)):
-            context.scene.ra.mat_db.remove(0)
-        context.scene.ra.mat_db_max_index = -1
+        self.report({'INFO'}, f"Materials list loaded from {self.filepath}")
+        return{'FINISHED'}
 
-        max_index = -1
-        for row in data:
-            max_index = max(max_index, int(row['id']))
-            new_mat = context.scene.ra.mat_db.add()
-            new_mat.index = int(row['id'])
-            new_mat.description = row['Description']
-            new_mat.alpha = [float(a) for a in row['alpha'].strip('[]').split()]
 
-            context.scene.ra.mat_db_max_index = max_index
-            context.scene.ra.mat_db_index = 0
+class RA_OT_make_proxy(bpy.types.Operator):
+    """Create or update the acoustic proxies of the selected geometry"""
 
+    bl_idname = 'ra.make_proxy'
+    bl_label = 'Make proxy'
+    bl_options = {'REGISTER', 'UNDO'}
 
-        self.report({'INFO'}, f"Materials list loaded from {self.filepath}")
-        return{'FINISHED'}
+    feature_size: bpy.props.FloatProperty(
+        name="Feature size",
+        description="Connected parts smaller than this are removed [m]",
+        default=0.3, min=0.0, unit='LENGTH'
+    )
+    min_edge: bpy.props.FloatProperty(
+        name="Min edge",
+        description="Edges shorter than this are collapsed [m]",
+        default=0.05, min=0.0, unit='LENGTH'
+    )
+    angle_limit: bpy.props.FloatProperty(
+        name="Angle limit",
+        description="Faces this close to coplanar are merged [deg]",
+        default=5.0, min=0.0, max=90.0
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return any(
+            obj.type == 'MESH' and obj.ra.nature == 'GEOM'
+            for obj in context.selected_objects
+        )
+
+    def execute(self, context):
+        objs = [
+            obj for obj in context.selected_objects
+            if obj.type == 'MESH' and obj.ra.nature == 'GEOM'
+            # not the proxies themselves
+            and obj.get('ra_compensation') is None
+        ]
+        before = after = 0
+        for obj in objs:
+            proxy_obj = proxy.make_proxy(
+                obj, self.feature_size, self.min_edge, self.angle_limit
+            )
+            obj.data.calc_loop_triangles()
+            proxy_obj.data.calc_loop_triangles()
+            before += len(obj.data.loop_triangles)
+            after += len(proxy_obj.data.loop_triangles)
+        self.report({'INFO'}, (
+            f"{len(objs)} proxies, {before} -> {after} triangles"
+        ))
+        return {'FINISHED'}
+
+
+class RA_OT_reevaluate(bpy.types.Operator):
+    """Recompute the levels with the current absorption, without tracing"""
+
+    bl_idname = 'ra.reevaluate'
+    bl_label = 'Re-evaluate materials'
+
+    @classmethod
+    def poll(cls, context):
+        res = results.current_results
+        return (
+            not context.scene.ra.rtngn_running and res is not None
+            and 'hits' in res.arrays and 'materials' in res.meta
+        )
+
+    def execute(self, context):
+        tic = time.perf_counter()
+        res = results.current_results
+        table = res.meta['materials']
+        resolver = materials.material_resolver
+        resolver.update(context.scene.ra.mat_db)
+        rows = resolver.lookup(table['ids'])
+        alpha = np.array(table['alpha'], dtype=np.float64)
+        known = rows >= 0
+        alpha[known] = resolver.alpha[rows[known]]
+        table['alpha'] = alpha.tolist()
+        if sum(table['areas']) > 0:
+            res.meta['mean_alpha'] = np.average(
+                alpha, axis=0, weights=table['areas']
+            ).tolist()
+
+        evaluator = results_evaluator(res)
+        n_recs = 0
+        if 'recs' in res.meta:
+            n_recs = len(reevaluate(res, evaluator))
+        else:
+            self.report({'WARNING'}, (
+                "The results do not have the positions of their receivers, "
+                "only the grids are re-evaluated"
+            ))
+        n_grid = 0
+        if 'grid_cells' in res.arrays:
+            n_grid = len(res.arrays['grid_cells'])
+            res.arrays['grid_energy'] = evaluator.grid(
+                np.asarray(res.arrays['grid_cells']).mean(axis=1)
+            )
+            heatmap_man.set_grid(
+                res.arrays['grid_cells'], res.arrays['grid_energy']
+            )
+        # the sidecar file is out of date
+        res.path = None
+        live_receivers.clear()
+        for area in context.screen.areas:
+            if area.type == 'PROPERTIES':
+                area.tag_redraw()
+
+        self.report({'INFO'}, (
+            f"Re-evaluated {n_recs + n_grid} "
+            f"receivers in {time.perf_counter() - tic:.2f}s"
+        ))
+        return {'FINISHED'}
+
+
+def ir_names(res):
+    """File names of the sources and receivers of `res`, for its responses"""
+    n_srcs, n_recs = np.shape(res.arrays['histograms'])[:2]
+    src_names = res.meta.get('source_names') or [
+        f"source{i}" for i in range(n_srcs)
+    ]
+    rec_names = res.meta.get('receivers') or [
+        f"receiver{i}" for i in range(n_recs)
+    ]
+    return (
+        [bpy.path.clean_name(name) for name in src_names],
+        [bpy.path.clean_name(name) for name in rec_names],
+    )
+
+
+class AuralizationModal:
+    """Starts an `auralization.AuralizationJob` and polls it until it is done
+
+    Esc cancels the job. `summary(job)` describes the files it wrote.
+    """
+
+    _timer = None
+
+    @classmethod
+    def poll(cls, context):
+        res = results.current_results
+        job = auralization.current_job
+        return (
+            res is not None and 'histograms' in res.arrays
+            and (job is None or job.done)
+        )
+
+    def start(self, context, job):
+        # the work runs in a worker thread, `modal` polls it
+        auralization.current_job = job
+        job.start()
+
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        job = auralization.current_job
+        if event.type == 'ESC':
+            job.cancel()
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        context.window_manager.progress_update(job.progress * 100)
+        for area in context.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+        if not job.done:
+            return {'PASS_THROUGH'}
+
+        self.finish(context)
+        if job.error is not None:
+            self.report({'ERROR'}, f"{self.bl_label} failed: {job.error}")
+            return {'CANCELLED'}
+        if job.cancelled:
+            self.report({'WARNING'}, f"{self.bl_label} cancelled")
+            return {'CANCELLED'}
+        self.report({'INFO'}, self.summary(job))
+        return {'FINISHED'}
+
+    def cancel(self, context):
+        auralization.current_job.cancel()
+        self.finish(context)
+
+    def finish(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+
+
+class RA_OT_export_irs(AuralizationModal, bpy.types.Operator):
+    """Export the impulse responses of the last run at its receivers"""
+
+    bl_idname = 'ra.export_irs'
+    bl_label = 'Export impulse responses'
+
+    def execute(self, context):
+        scene_ra = context.scene.ra
+        res = results.current_results
+        self.folder = pathlib.Path(bpy.path.abspath(scene_ra.ir_dir))
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            self.report({'ERROR'}, f"Could not export to {self.folder}: {e}")
+            return {'CANCELLED'}
+
+        self.tic = time.perf_counter()
+        return self.start(context, auralization.AuralizationJob(
+            auralization.export_irs, res.arrays['histograms'],
+            res.meta['alg_configs']['freq'], res.meta['alg_configs']['dt'],
+            scene_ra.ir_rate, str(self.folder), *ir_names(res),
+            wav=scene_ra.ir_format != 'NPY', npy=scene_ra.ir_format != 'WAV',
+            workers=scene_ra.workers if scene_ra.parallel else 1
+        ))
+
+    def summary(self, job):
+        return (
+            f"Exported {len(job.paths)} files to {self.folder} in "
+            f"{time.perf_counter() - self.tic:.2f}s"
+        )
+
+
+class RA_OT_auralize(AuralizationModal, bpy.types.Operator, ImportHelper):
+    """Convolve a dry recording with the impulse responses of the receivers"""
+
+    bl_idname = 'ra.auralize'
+    bl_label = 'Auralize'
+    filename_ext = ".wav"
+
+    filter_glob: StringProperty(
+        default="*.wav", options={'HIDDEN'}, maxlen=255
+    )
+
+    def execute(self, context):
+        scene_ra = context.scene.ra
+        res = results.current_results
+        self.folder = pathlib.Path(bpy.path.abspath(scene_ra.ir_dir))
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        return self.start(context, auralization.AuralizationJob(
+            auralization.auralize, res.arrays['histograms'],
+            res.meta['alg_configs']['freq'], res.meta['alg_configs']['dt'],
+            self.filepath, str(self.folder), ir_names(res)[1],
+            workers=scene_ra.workers if scene_ra.parallel else 1
+        ))
+
+    def summary(self, job):
+        return f"Auralized {len(job.paths)} receivers to {self.folder}"
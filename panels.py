@@ -1,6 +1,10 @@
 
 import bpy
 
+from . import auralization, histograms, jobs, profiling, results
+from .grids import heatmap_man
+from .reverberation import reverb_preview
+from .simulation import FREQ
 
 class RASidebar():
     bl_space_type = 'VIEW_3D'
@@ -18,7 +22,16 @@ class RA_PT_simulation(RASidebar, bpy.types.Panel):
 
         layout.prop(scene_ra, 'sim_cfgs', text="config toml")
         layout.prop(scene_ra, 'title', text="title")
-        layout.prop(scene_ra, 'nrays', text="nrays")
+        layout.prop(scene_ra, 'merge_coplanar', text="merge coplanar")
+        if scene_ra.merge_coplanar:
+            layout.prop(scene_ra, 'merge_tolerance', text="tolerance")
+        layout.prop(scene_ra, 'progressive', text="progressive")
+        if scene_ra.progressive:
+            layout.prop(scene_ra, 'nrays', text="max nrays")
+            layout.prop(scene_ra, 'rays_increment', text="increment")
+            layout.prop(scene_ra, 'convergence_tol', text="tolerance")
+        else:
+            layout.prop(scene_ra, 'nrays', text="nrays")
         layout.prop(scene_ra, 'ht_length', text="htlen")
         layout.prop(scene_ra, 'dt', text="dt")
         layout.prop(scene_ra, 'allow_scattering', text="scattering")
@@ -29,8 +42,63 @@ class RA_PT_simulation(RASidebar, bpy.types.Panel):
         layout.prop(scene_ra, 'temperature', text="temp")
         layout.prop(scene_ra, 'hr', text="rel humidity")
         layout.prop(scene_ra, 'p_atm', text="atm press")
+        layout.prop(scene_ra, 'parallel', text="parallel")
+        if scene_ra.parallel:
+            layout.prop(scene_ra, 'workers', text="workers")
+            layout.prop(scene_ra, 'rays_per_task', text="rays per task")
+        layout.prop(scene_ra, 'mmap_histories', text="mmap histories")
+        layout.prop(scene_ra, 'memory_budget', text="memory budget")
+        layout.prop(scene_ra, 'use_cache', text="cache results")
+        if scene_ra.use_cache:
+            layout.prop(scene_ra, 'cache_dir', text="cache dir")
+            layout.prop(scene_ra, 'cache_size', text="cache size")
+        layout.prop(scene_ra, 'live_receivers', text="live receivers")
+        layout.prop(scene_ra, 'record_hits', text="record hits")
+        layout.prop(scene_ra, 'reverb_preview', text="reverb preview")
+        if scene_ra.reverb_preview:
+            self.draw_preview(layout)
+        layout.prop(scene_ra, 'profile_memory', text="profile memory")
+        layout.prop(scene_ra, 'profile_log', text="profile log")
 
-        layout.operator('ra.run', text="Run", icon='RADIOBUT_OFF')
+        job = jobs.current_job
+        if scene_ra.rtngn_running and job is not None:
+            col = layout.column()
+            col.label(text=f"{job.stage}: {job.progress:.0%}")
+            col.operator('ra.cancel', text="Cancel", icon='CANCEL')
+        else:
+            layout.operator('ra.run', text="Run", icon='RADIOBUT_OFF')
+
+        if job is not None and job.profile.stages:
+            box = layout.box()
+            box.label(text=f"Last run: {job.profile.total_time:.2f}s")
+            if job.progressive and job.done:
+                text = f"{job.rays_traced} rays per source"
+                if job.convergence is not None:
+                    text += f", converged to {job.convergence:.2f} dB"
+                box.label(text=text)
+            for record in list(job.profile.stages):
+                box.label(text=profiling.describe(record))
+
+
+    def draw_preview(self, layout):
+        box = layout.box()
+        if reverb_preview.error is not None:
+            box.label(text=reverb_preview.error, icon='ERROR')
+            return
+        if reverb_preview.sabine is None:
+            if not bpy.app.timers.is_registered(reverb_preview.update):
+                reverb_preview.request()
+            box.label(text="Computing the reverberation time...")
+            return
+        box.label(text=(
+            f"V = {reverb_preview.volume:.1f} m3, "
+            f"S = {reverb_preview.area:.1f} m2"
+        ))
+        box.label(text="T60 [s]: Sabine / Eyring")
+        for freq, t_sab, t_eyr in zip(
+            FREQ, reverb_preview.sabine, reverb_preview.eyring
+        ):
+            box.label(text=f"{freq:.0f} Hz: {t_sab:.2f} / {t_eyr:.2f}")
 
 
 class RA_PT_materialdb(RASidebar, bpy.types.Panel):
@@ -68,6 +136,8 @@ class RA_PT_materialdb(RASidebar, bpy.types.Panel):
             col.prop(item, 'alpha')
             col.prop(item, 'description')
 
+        layout.operator('ra.reevaluate', icon='FILE_REFRESH')
+
 
 class RA_PT_rendering(RASidebar, bpy.types.Panel):
     bl_label = 'Rendering'
@@ -80,6 +150,39 @@ class RA_PT_rendering(RASidebar, bpy.types.Panel):
         col = layout.column()
         col.prop(scene_ra, 'render')
         col.prop(scene_ra, 'render_order')
+        col.prop(scene_ra, 'render_wavefront')
+        if scene_ra.render_wavefront:
+            col.prop(scene_ra, 'render_time')
+        col.prop(scene_ra, 'render_colors')
+        col.prop(scene_ra, 'render_budget')
+        col.prop(scene_ra, 'render_cull')
+        col.prop(scene_ra, 'render_coarse')
+        col.prop(scene_ra, 'render_heatmap')
+        if scene_ra.render_heatmap:
+            col.prop(scene_ra, 'heatmap_band')
+            if heatmap_man.range is not None:
+                lo, hi = heatmap_man.range
+                col.label(text=f"Levels: {lo:.1f} to {hi:.1f} dB")
+
+
+class RA_PT_auralization(RASidebar, bpy.types.Panel):
+    bl_label = 'Auralization'
+
+    def draw(self, context):
+        scene_ra = context.scene.ra
+        layout = self.layout
+        layout.use_property_split = True
+
+        layout.prop(scene_ra, 'ir_dir', text="folder")
+        layout.prop(scene_ra, 'ir_format', text="format")
+        layout.prop(scene_ra, 'ir_rate', text="sample rate")
+        layout.operator('ra.export_irs', text="Export IRs", icon='EXPORT')
+
+        job = auralization.current_job
+        if job is not None and not job.done:
+            layout.label(text=f"{job.stage}: {job.progress:.0%} (Esc cancels)")
+        else:
+            layout.operator('ra.auralize', text="Auralize", icon='PLAY_SOUND')
 
 
 class RA_PT_object(bpy.types.Panel):
@@ -115,6 +218,39 @@ class RA_PT_object(bpy.types.Panel):
             col.prop(ra_obj_props, 'power_db', text="Power [dB]")
             col.prop(ra_obj_props, 'eq_db', text="Eq [dB]")
             col.prop(ra_obj_props, 'delay', text="delay")
+        elif ra_obj_props.nature == 'RECEIVER':
+            self.draw_levels(context.object)
+        elif ra_obj_props.nature == 'RECEIVER_GRID':
+            col.prop(ra_obj_props, 'grid_spacing', text="Spacing")
+            col.prop(ra_obj_props, 'grid_height', text="Height")
+        elif ra_obj_props.nature == 'GEOM' and context.object.type == 'MESH':
+            col.prop(ra_obj_props, 'proxy', text="Proxy")
+            if ra_obj_props.proxy is not None:
+                col.prop(ra_obj_props, 'use_proxy', text="Use proxy")
+                col.prop(
+                    ra_obj_props, 'proxy_scattering', text="Scattering"
+                )
+            col.operator('ra.make_proxy')
+
+    def draw_levels(self, obj):
+        """Levels at the receiver `obj` in the last run, if it was in it"""
+        res = results.current_results
+        if res is None or 'histograms' not in res.arrays:
+            return
+        names = res.meta.get('receivers', [])
+        if obj.name not in names:
+            return
+        # the sources add up
+        levels = histograms.spl(
+            res.arrays['histograms'][:, names.index(obj.name)].sum(axis=0)
+        )
+        box = self.layout.box()
+        if res.meta.get('reevaluated'):
+            box.label(text="SPL [dB], re-evaluated from the ray paths")
+        else:
+            box.label(text="SPL [dB]")
+        for freq, level in zip(FREQ, levels):
+            box.label(text=f"{freq:.0f} Hz: {level:.1f}")
 
 
 class RA_PT_material(bpy.types.Panel):
@@ -0,0 +1,228 @@
+import concurrent.futures
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from . import engine
+from .geometry import PlaneTable
+from .results import RayHistories, SourceResult
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# run by every worker before its first task: registers the add-on package
+# without executing its `__init__`, which needs blender, so the modules of the
+# tasks can be imported from it
+BOOTSTRAP = """
+import importlib.util
+import sys
+spec = importlib.util.spec_from_file_location(
+    package, init, submodule_search_locations=[folder]
+)
+sys.modules[package] = importlib.util.module_from_spec(spec)
+"""
+
+# Columns of the plane table shared with the workers
+TABLE_COLUMNS = (
+    'vertices', 'normals', 'areas', 'mat_ids', 'alpha', 'scattering'
+)
+
+
+class JobCancelled(Exception):
+    """Raised inside the worker when the job was cancelled"""
+
+
+def python_executable():
+    """The python interpreter of blender, which runs the workers
+
+    Up to blender 2.90 `sys.executable` is blender itself.
+    """
+    import bpy
+    return getattr(bpy.app, 'binary_path_python', '') or sys.executable
+
+
+def available():
+    """Whether parallel tracing can be used"""
+    return os.path.isfile(python_executable())
+
+
+def context():
+    """Multiprocessing context of the worker pools
+
+    Workers are never forked from blender, whose other threads may hold locks
+    a forked child would inherit locked. They are forked from a fork server,
+    itself a fresh interpreter, where supported, or spawned.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        # the fork server must not import the main module, see `cli`
+        ctx.set_forkserver_preload([])
+    else:
+        ctx = multiprocessing.get_context('spawn')
+    ctx.set_executable(python_executable())
+    return ctx
+
+
+def pool(workers):
+    """Process pool of `workers`, to be created on the main thread
+
+    Its workers import the add-on package without executing its
+    `__init__`, see `BOOTSTRAP`, so the tasks run on it must be functions of
+    modules that do not import `bpy`.
+    """
+    ctx = context()
+    if ctx.get_start_method() == 'forkserver':
+        multiprocessing.forkserver.ensure_running()
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, mp_context=ctx, initializer=exec,
+        initargs=(BOOTSTRAP, {
+            'package': __package__,
+            'init': os.path.join(PACKAGE_DIR, '__init__.py'),
+            'folder': PACKAGE_DIR,
+        })
+    )
+
+
+def run_tasks(pool, fn, tasks, step=None):
+    """Results of `fn(*args)` for each args of `tasks`, over `pool`
+
+    In this process, in order, when `pool` is None. `step(progress)` is
+    called as tasks complete and may raise to cancel the remaining ones.
+    """
+    out = [None] * len(tasks)
+    if pool is None:
+        for k, args in enumerate(tasks):
+            out[k] = fn(*args)
+            if step is not None:
+                step((k + 1) / len(tasks))
+        return out
+    futures = {pool.submit(fn, *args): k for k, args in enumerate(tasks)}
+    try:
+        for k, future in enumerate(concurrent.futures.as_completed(futures)):
+            out[futures[future]] = future.result()
+            if step is not None:
+                step((k + 1) / len(futures))
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return out
+
+
+def shared_dir():
+    """Scratch folder for the data shared with the workers
+
+    On linux /dev/shm is a tmpfs, so the memory mapped arrays written there are
+    plain shared memory and never touch the disk.
+    """
+    return tempfile.mkdtemp(
+        prefix='ra-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None
+    )
+
+
+def save_table(planes, folder):
+    for column in TABLE_COLUMNS:
+        np.save(os.path.join(folder, f"{column}.npy"), getattr(planes, column))
+    if planes.offsets is not None:
+        np.save(os.path.join(folder, "offsets.npy"), planes.offsets)
+
+
+def load_table(folder, names):
+    columns = {
+        column: np.load(os.path.join(folder, f"{column}.npy"), mmap_mode='r')
+        for column in TABLE_COLUMNS
+    }
+    offsets = os.path.join(folder, "offsets.npy")
+    if os.path.exists(offsets):
+        columns['offsets'] = np.load(offsets)
+    return PlaneTable(names=names, **columns)
+
+
+def split_rays(n_rays, chunk_size):
+    """Number of chunks `n_rays` rays are split into"""
+    return max(1, -(-n_rays // max(1, chunk_size)))
+
+
+def trace_chunk(
+    folder, names, src, recs, alg_configs, air_properties, part, n_parts,
+    out_path
+):
+    """Worker: trace one chunk of rays of one source
+
+    The chunk traces every `n_parts`-th of the ray directions stored in
+    `folder`, from the `part`-th. The reflection points of all the rays are
+    written, stacked, to the `.npy` file at `out_path`, and only their
+    `RayHistories` offsets are sent back, with the receiver histograms.
+    """
+    planes = load_table(folder, names)
+    directions = np.load(
+        os.path.join(folder, "directions.npy"), mmap_mode='r'
+    )[part::n_parts]
+    sims = engine.simulation(
+        planes, recs, dict(alg_configs, n_rays=len(directions)),
+        air_properties
+    )
+    result, hist = engine.trace(
+        sims, src, directions, alg_configs, recs, out_path
+    )
+    result.histories.points.flush()
+    return result.histories.offsets, hist
+
+
+def trace(
+    pool, planes, srcs, recs, alg_configs, air_properties, directions,
+    chunk_size, step=None, store_dir=None
+):
+    """Trace all sources over a process `pool`, split by source and chunks
+
+    Every source traces the rays of the (n_rays, 3) `directions`, split in
+    chunks of about `chunk_size` by taking every n-th direction, so each chunk
+    covers all directions evenly. `step(progress)` is called as chunks
+    complete and may raise to cancel the remaining chunks.
+
+    Returns one `SourceResult` per source, the ray histories of its chunks
+    are gathered in memory, or in memory mapped files in `store_dir` if
+    given, and the (n_srcs, n_recs, n_bands, n_bins) receiver histograms per
+    ray, the mean of the chunks weighted by their rays.
+    """
+    folder = shared_dir()
+    try:
+        save_table(planes, folder)
+        np.save(os.path.join(folder, "directions.npy"), directions)
+        n_chunks = max(
+            1, min(split_rays(len(directions), chunk_size), len(directions))
+        )
+        tasks = [
+            (
+                folder, planes.names, src, recs, alg_configs, air_properties,
+                ci, n_chunks, os.path.join(folder, f"hist-{si}-{ci}.npy")
+            )
+            for si, src in enumerate(srcs) for ci in range(n_chunks)
+        ]
+        out = run_tasks(pool, trace_chunk, tasks, step)
+
+        sources = []
+        hist = np.zeros((
+            len(srcs), len(recs), len(alg_configs['freq']),
+            engine.n_bins(alg_configs)
+        ))
+        for si, src in enumerate(srcs):
+            parts = []
+            for ci in range(n_chunks):
+                offsets, h = out[si * n_chunks + ci]
+                parts.append(RayHistories(np.load(
+                    os.path.join(folder, f"hist-{si}-{ci}.npy"), mmap_mode='r'
+                ), offsets))
+                hist[si] += h * (len(offsets) - 1)
+            path = None
+            if store_dir is not None:
+                path = os.path.join(store_dir, f"hist-{si}.npy")
+            sources.append(SourceResult(
+                tuple(src['coord']), RayHistories.concatenate(parts, path)
+            ))
+        return sources, hist / max(1, len(directions))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,105 @@
+import contextlib
+import json
+import threading
+import time
+import tracemalloc
+
+# tracemalloc is process wide: the records of the stages it traces, open in any
+# thread and for any profile, and whether tracing was started for them
+_traced = []
+_traced_lock = threading.Lock()
+_started = False
+
+
+def _open_traced(record):
+    """Start tracing the memory of a stage, see `Profile.stage`"""
+    global _started
+    with _traced_lock:
+        if _traced:
+            # overlapping stages would reset each other's peaks
+            for r in _traced:
+                r['_overlapped'] = True
+            record['_overlapped'] = True
+        else:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started = True
+            # also resets the peak
+            tracemalloc.clear_traces()
+        _traced.append(record)
+
+
+def _close_traced(record):
+    global _started
+    with _traced_lock:
+        _traced.remove(record)
+        if not record.pop('_overlapped', False):
+            record['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        if not _traced and _started:
+            tracemalloc.stop()
+            _started = False
+
+
+class Profile:
+    """Wall time, peak memory and item counts of the stages of a run
+
+    Each stage is recorded by a `stage` block, which yields the record of the
+    stage so counts only known at its end can be added to it. Records are
+    appended to `stages` and, if `log_path` is given, to that JSON lines file
+    along with the `context` of the run (scene, blender version...).
+
+    With `memory`, the peak memory allocated during each stage is traced with
+    tracemalloc. That slows allocations down, and does not see the memory of
+    the parallel workers. Since tracemalloc is process wide, the peak of a
+    stage is only recorded when no other traced stage (of any thread) was
+    open during it.
+    """
+
+    def __init__(self, memory=False, log_path=None, **context):
+        self.memory = memory
+        self.log_path = log_path
+        self.context = context
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        record = {'stage': name}
+        record.update(counts)
+        if self.memory:
+            _open_traced(record)
+        tic = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['time'] = time.perf_counter() - tic
+            if self.memory:
+                _close_traced(record)
+            self.add(record)
+
+    def add(self, record):
+        with self._lock:
+            self.stages.append(record)
+            if self.log_path:
+                line = dict(self.context)
+                line.update(record)
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(line, default=str) + "\n")
+
+    @property
+    def total_time(self):
+        return sum(r['time'] for r in self.stages)
+
+
+def describe(record):
+    """One line summary of a stage record, for the UI"""
+    text = f"{record['stage']}: {record['time']:.2f}s"
+    if 'peak_mb' in record:
+        text += f", {record['peak_mb']:.1f} MiB"
+    counts = [
+        f"{k} {v}" for k, v in record.items()
+        if k not in ('stage', 'time', 'peak_mb')
+    ]
+    if counts:
+        text += " (" + ", ".join(counts) + ")"
+    return text
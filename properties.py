@@ -1,10 +1,15 @@
 
+import os
 import pathlib
 
 import bpy
 import toml
 
-from .rendering import rendering_man
+from .grids import heatmap_man
+from .materials import material_resolver
+from .rendering import rendering_man, tag_redraw_view3d
+from .reverberation import reverb_preview
+from .simulation import FREQ
 
 
 #    ___ _     _           _
@@ -32,6 +37,9 @@ class RAObjectProps(bpy.types.PropertyGroup):
             ('GEOM', "geometry", "Reflective geometry"),
             ('SOURCE', "source", "an acoustic source"),
             ('RECEIVER', "receiver", "an acoustic receiver"),
+            ('RECEIVER_GRID', "receiver grid", (
+                "receivers spread over the faces of a mesh"
+            )),
         },
         default='GEOM'
     )
@@ -52,6 +60,39 @@ class RAObjectProps(bpy.types.PropertyGroup):
         default=0.0,
     )
 
+    grid_spacing: bpy.props.FloatProperty(
+        name="grid_spacing",
+        description="Largest distance between the receivers of a grid",
+        default=1.0, min=0.01, unit='LENGTH'
+    )
+
+    grid_height: bpy.props.FloatProperty(
+        name="grid_height",
+        description="Height of the receivers of a grid above its faces",
+        default=1.2, unit='LENGTH'
+    )
+
+    proxy: bpy.props.PointerProperty(
+        name="proxy",
+        description="Simplified copy simulated in place of the object",
+        type=bpy.types.Object
+    )
+
+    use_proxy: bpy.props.BoolProperty(
+        name="use_proxy",
+        description="Simulate the acoustic proxy instead of the object",
+        default=True
+    )
+
+    proxy_scattering: bpy.props.BoolProperty(
+        name="proxy_scattering",
+        description=(
+            "Add the area fraction each material lost in the proxy to its "
+            "scattering"
+        ),
+        default=False
+    )
+
 
 #               _            _       _
 #   /\/\   __ _| |_ ___ _ __(_) __ _| |
@@ -60,14 +101,25 @@ class RAObjectProps(bpy.types.PropertyGroup):
 # \/    \/\__,_|\__\___|_|  |_|\__,_|_|
 #
 
+def update_mat_db_callback(self, context):
+    material_resolver.invalidate()
+    reverb_preview.request()
+
+
+def update_material_callback(self, context):
+    reverb_preview.request()
+
+
 class RAMaterialsDB(bpy.types.PropertyGroup):
     """Group of properties representing an item in the list."""
     index: bpy.props.IntProperty(
-        name="Id", description="Material reference index", default=0, min=0
+        name="Id", description="Material reference index", default=0, min=0,
+        update=update_mat_db_callback
     )
     alpha: bpy.props.FloatVectorProperty(
         name="Alpha", description="The material absorption coefficient",
-        step=1, min=0.0, max=1.0, size=8, default=(0.0,)*8
+        step=1, min=0.0, max=1.0, size=8, default=(0.0,)*8,
+        update=update_mat_db_callback
     )
     description: bpy.props.StringProperty(
         name="Description", description="Longer material description",
@@ -78,7 +130,8 @@ class RAMaterialsDB(bpy.types.PropertyGroup):
 class RAMaterialProps(bpy.types.PropertyGroup):
 
     mat_id: bpy.props.IntProperty(
-        name="MaterialId", description="The material Id", default=0, min=0
+        name="MaterialId", description="The material Id", default=0, min=0,
+        update=update_material_callback
     )
 
     scattering: bpy.props.FloatProperty(
@@ -120,9 +173,31 @@ def update_sim_cfgs_callback(self, context):
     update_sim_cfgs(cfg)
 
 
+def update_preview_callback(self, context):
+    reverb_preview.request()
+
+
 def update_render_callback(self, context):
     rendering_man.reg_draw_callback(order=self.render_order, render=self.render)
-    # context.area.tag_redraw()
+
+
+def update_render_time_callback(self, context):
+    tag_redraw_view3d()
+
+
+def update_render_colors_callback(self, context):
+    rendering_man.set_colors(self.render_colors)
+
+
+def update_heatmap_callback(self, context):
+    heatmap_man.set_band(self.heatmap_band)
+    heatmap_man.reg_draw_callback(render=self.render_heatmap)
+
+
+def update_render_lod_callback(self, context):
+    rendering_man.set_lod(
+        self.render_budget, cull=self.render_cull, coarse=self.render_coarse
+    )
 
 
 class RASceneProps(bpy.types.PropertyGroup):
@@ -137,6 +212,74 @@ class RASceneProps(bpy.types.PropertyGroup):
         default=True,
         update=update_render_callback
     )
+    render_wavefront: bpy.props.BoolProperty(
+        name="Wavefront",
+        description="Only render the rays up to their position at `time`",
+        default=False,
+        update=update_render_time_callback
+    )
+    render_time: bpy.props.FloatProperty(
+        name="Time",
+        description="Time since emission of the rendered wavefront, in seconds",
+        default=0.0,
+        min=0.0,
+        precision=3,
+        step=0.1,
+        update=update_render_time_callback
+    )
+    render_colors: bpy.props.EnumProperty(
+        name="Colors",
+        description="What the color of the rays shows",
+        items=(
+            ('SOURCE', "Source", "The source of each ray"),
+            ('ENERGY', "Energy", (
+                "The energy left in the rays, over the first 60 dB of decay"
+            )),
+        ),
+        default='SOURCE',
+        update=update_render_colors_callback
+    )
+    render_budget: bpy.props.IntProperty(
+        name="Segment budget",
+        description=(
+            "Maximum number of ray segments drawn, rays beyond it are skipped "
+            "(0 draws every ray)"
+        ),
+        default=200000,
+        min=0,
+        update=update_render_lod_callback
+    )
+    render_cull: bpy.props.BoolProperty(
+        name="Frustum culling",
+        description="Spend the segment budget on the rays in view only",
+        default=False,
+        update=update_render_lod_callback
+    )
+    render_coarse: bpy.props.BoolProperty(
+        name="Coarse navigation",
+        description=(
+            "Draw fewer rays while the view moves, refining once it stops"
+        ),
+        default=True,
+        update=update_render_lod_callback
+    )
+
+    render_heatmap: bpy.props.BoolProperty(
+        name="Heatmap",
+        description="Show the levels at the receiver grids",
+        default=True,
+        update=update_heatmap_callback
+    )
+    heatmap_band: bpy.props.EnumProperty(
+        name="Band",
+        description="Band of the levels shown at the receiver grids",
+        items=[('ALL', "All", "All the bands")] + [
+            (str(i), f"{freq:.0f} Hz", f"The {freq:.0f} Hz band")
+            for i, freq in enumerate(FREQ)
+        ],
+        default='ALL',
+        update=update_heatmap_callback
+    )
 
     mat_db: bpy.props.CollectionProperty(type=RAMaterialsDB)
     mat_db_index: bpy.props.IntProperty(
@@ -152,6 +295,117 @@ class RASceneProps(bpy.types.PropertyGroup):
         default=False
     )
 
+    parallel: bpy.props.BoolProperty(
+        name="parallel",
+        description="Trace the rays over a pool of worker processes",
+        default=False
+    )
+
+    workers: bpy.props.IntProperty(
+        name="workers",
+        description="Number of worker processes used when tracing in parallel",
+        default=os.cpu_count() or 1,
+        min=1
+    )
+
+    rays_per_task: bpy.props.IntProperty(
+        name="rays_per_task",
+        description="Number of rays of a source traced by each parallel task",
+        default=1000,
+        min=1
+    )
+
+    mmap_histories: bpy.props.BoolProperty(
+        name="mmap_histories",
+        description=(
+            "Keep the ray histories in memory mapped temporary files instead "
+            "of in RAM"
+        ),
+        default=False
+    )
+
+    memory_budget: bpy.props.IntProperty(
+        name="memory_budget",
+        description=(
+            "Memory a run may use, in MiB, 0 for no limit. Runs estimated "
+            "over it are traced in chunks of rays, the ray histories of each "
+            "chunk spilled to temporary files"
+        ),
+        default=4096,
+        min=0
+    )
+
+    ir_dir: bpy.props.StringProperty(
+        name="ir_dir",
+        description=(
+            "Folder the impulse responses and auralizations are written to"
+        ),
+        default="//impulse_responses/", maxlen=1024, subtype='DIR_PATH'
+    )
+
+    ir_format: bpy.props.EnumProperty(
+        name="ir_format",
+        description="Files the impulse responses are exported to",
+        items=(
+            ('WAV', "WAV", "A 24 bit WAV file per source and receiver"),
+            ('NPY', "NumPy", (
+                "All the impulse responses in irs.npy, (sources, receivers, "
+                "samples)"
+            )),
+            ('BOTH', "Both", "WAV and NumPy files"),
+        ),
+        default='WAV'
+    )
+
+    ir_rate: bpy.props.IntProperty(
+        name="ir_rate",
+        description="Sample rate of the exported impulse responses, in Hz",
+        default=48000,
+        min=8000
+    )
+
+    use_cache: bpy.props.BoolProperty(
+        name="use_cache",
+        description=(
+            "Reuse the results of previous runs with identical geometry, "
+            "sources, receivers and settings"
+        ),
+        default=False
+    )
+
+    cache_dir: bpy.props.StringProperty(
+        name="cache_dir",
+        description="Folder where simulation results are cached",
+        default="//ra_cache/", maxlen=1024, subtype='DIR_PATH'
+    )
+
+    cache_size: bpy.props.IntProperty(
+        name="cache_size",
+        description=(
+            "Maximum size of the results cache, in MiB, 0 for no limit"
+        ),
+        default=1024,
+        min=0
+    )
+
+    profile_memory: bpy.props.BoolProperty(
+        name="profile_memory",
+        description=(
+            "Trace the peak memory of each stage of a run (slows the run "
+            "down)"
+        ),
+        default=False
+    )
+
+    profile_log: bpy.props.StringProperty(
+        name="profile_log",
+        description=(
+            "JSON lines file the timings of each run are appended to, none "
+            "if empty"
+        ),
+        default="", maxlen=1024, subtype='FILE_PATH'
+    )
+
     sim_cfgs: bpy.props.StringProperty(
         name="Simulation configuration parameters",
         description="Path to the .toml file with config parameters",
@@ -172,6 +426,82 @@ class RASceneProps(bpy.types.PropertyGroup):
         min=0
     )
 
+    merge_coplanar: bpy.props.BoolProperty(
+        name="merge_coplanar",
+        description=(
+            "Merge adjacent coplanar triangles with the same material into "
+            "convex polygons, so the engine has fewer planes to intersect "
+            "(the engine must support polygon planes)"
+        ),
+        default=False
+    )
+
+    merge_tolerance: bpy.props.FloatProperty(
+        name="merge_tolerance",
+        description=(
+            "Distance under which vertices and planes are considered the "
+            "same when merging triangles (also used for the normals)"
+        ),
+        default=1e-4,
+        min=1e-9,
+        precision=6
+    )
+
+    progressive: bpy.props.BoolProperty(
+        name="progressive",
+        description=(
+            "Trace the rays in increments, up to nrays, and stop once the "
+            "decay curves at the receivers converge"
+        ),
+        default=False
+    )
+
+    rays_increment: bpy.props.IntProperty(
+        name="rays_increment",
+        description="Number of rays per source traced by each increment",
+        default=1000,
+        min=1
+    )
+
+    convergence_tol: bpy.props.FloatProperty(
+        name="convergence_tol",
+        description=(
+            "Largest change of the decay curves between increments, in dB, "
+            "for the run to be converged"
+        ),
+        default=0.5,
+        min=0.0
+    )
+
+    live_receivers: bpy.props.BoolProperty(
+        name="live_receivers",
+        description=(
+            "Update the receiver histograms of the last run when receivers "
+            "move, from its ray paths and without tracing again"
+        ),
+        default=True
+    )
+
+    reverb_preview: bpy.props.BoolProperty(
+        name="reverb_preview",
+        description=(
+            "Show the Sabine and Eyring reverberation times of the room, "
+            "updated as the geometry, materials and air change"
+        ),
+        default=True,
+        update=update_preview_callback
+    )
+
+    record_hits: bpy.props.BoolProperty(
+        name="record_hits",
+        description=(
+            "Record the material hit at each reflection, so the levels can be "
+            "computed again for other absorption coefficients without "
+            "tracing (the scattering stays that of the run)"
+        ),
+        default=False
+    )
+
     ht_length: bpy.props.FloatProperty(
         name="ht_length",
         description="Impulse response duration",
@@ -224,19 +554,22 @@ class RASceneProps(bpy.types.PropertyGroup):
         name="temperature",
         description="Room air temperature",
         default=20.0,
-        min=0.0
+        min=0.0,
+        update=update_preview_callback
     )
 
     hr: bpy.props.FloatProperty(
         name="hr",
         description="Relative humidity",
         default=50.0,
-        min=0.0
+        min=0.0,
+        update=update_preview_callback
     )
 
     p_atm: bpy.props.FloatProperty(
         name="p_atm",
         description="Atmospheric pressure",
         default=101325.0,
-        min=0.0
+        min=0.0,
+        update=update_preview_callback
     )
@@ -0,0 +1,147 @@
+import math
+
+import bmesh
+import bpy
+import numpy as np
+
+from . import geometry
+
+
+def areas_by_material(obj):
+    """Total area of each material id of a mesh object, in global space"""
+    _, _, areas, slot_index = geometry.mesh_geometry(obj)
+    slot_ids = np.array([
+        s.material.ra.mat_id if s.material is not None else -1
+        for s in obj.material_slots
+    ] or [-1], dtype=np.int64)
+    mat_ids = slot_ids[np.clip(slot_index, 0, len(slot_ids) - 1)]
+    ids, rows = np.unique(mat_ids, return_inverse=True)
+    return dict(zip(ids.tolist(), np.bincount(rows, weights=areas).tolist()))
+
+
+def small_islands(bm, feature_size):
+    """Faces of the connected parts of `bm` smaller than `feature_size`"""
+    faces = []
+    seen = set()
+    for face in bm.faces:
+        if face.index in seen:
+            continue
+        island = [face]
+        seen.add(face.index)
+        i = 0
+        while i < len(island):
+            for edge in island[i].edges:
+                for f in edge.link_faces:
+                    if f.index not in seen:
+                        seen.add(f.index)
+                        island.append(f)
+            i += 1
+        co = np.array([v.co for f in island for v in f.verts])
+        if np.linalg.norm(co.max(axis=0) - co.min(axis=0)) < feature_size:
+            faces += island
+    return faces
+
+
+def simplify(mesh, matrix, feature_size, min_edge, angle_limit):
+    """Simplified copy of `mesh`, of an object of world matrix `matrix`
+
+    Connected parts smaller than `feature_size` are removed, edges shorter
+    than `min_edge` collapsed, and faces within `angle_limit` (radians) of
+    being coplanar dissolved into one, never across materials. The lengths
+    and angles are those of the mesh in global space.
+    """
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    bmesh.ops.transform(bm, matrix=matrix, verts=bm.verts)
+    bm.faces.index_update()
+    bmesh.ops.delete(
+        bm, geom=small_islands(bm, feature_size), context='FACES'
+    )
+    short = [e for e in bm.edges if e.calc_length() < min_edge]
+    if short:
+        bmesh.ops.collapse(bm, edges=short)
+    bmesh.ops.dissolve_limit(
+        bm, angle_limit=angle_limit, use_dissolve_boundaries=False,
+        verts=bm.verts[:], edges=bm.edges[:], delimit={'MATERIAL'}
+    )
+    bmesh.ops.dissolve_degenerate(bm, dist=1e-6, edges=bm.edges[:])
+    bmesh.ops.transform(bm, matrix=matrix.inverted_safe(), verts=bm.verts)
+
+    proxy_mesh = bpy.data.meshes.new(f"{mesh.name}.proxy")
+    bm.to_mesh(proxy_mesh)
+    bm.free()
+    for mat in mesh.materials:
+        proxy_mesh.materials.append(mat)
+    return proxy_mesh
+
+
+def make_proxy(obj, feature_size, min_edge, angle_limit):
+    """Create, or update, the acoustic proxy of the GEOM object `obj`
+
+    The proxy is a simplified copy of the object, excluded from the
+    simulation itself (runs use it in place of `obj`). The area each material
+    had in `obj` is recorded on it, see `compensate`. Returns the proxy.
+    """
+    mesh = simplify(
+        obj.data, obj.matrix_world, feature_size, min_edge,
+        math.radians(angle_limit)
+    )
+    proxy_obj = obj.ra.proxy
+    if proxy_obj is not None and proxy_obj.type != 'MESH':
+        # an empty (made by earlier versions) can not be given a mesh
+        bpy.data.objects.remove(proxy_obj)
+        proxy_obj = None
+    if proxy_obj is None:
+        proxy_obj = bpy.data.objects.new(f"{obj.name}.proxy", mesh)
+        for collection in obj.users_collection:
+            collection.objects.link(proxy_obj)
+    else:
+        old_mesh = proxy_obj.data
+        # a new mesh, so the geometry cache entries of the proxy are stale
+        proxy_obj.data = mesh
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
+    proxy_obj.matrix_world = obj.matrix_world
+    proxy_obj.display_type = 'WIRE'
+    proxy_obj.hide_render = True
+    proxy_obj.ra.enable = False
+    proxy_obj.ra.nature = 'GEOM'
+    obj.ra.proxy = proxy_obj
+
+    before = areas_by_material(obj)
+    after = areas_by_material(proxy_obj)
+    ids = sorted(before)
+    proxy_obj['ra_compensation'] = {
+        'mat_ids': ids,
+        'areas': [before[i] for i in ids],
+        'proxy_areas': [after.get(i, 0.0) for i in ids],
+    }
+    return proxy_obj
+
+
+def compensate(table, proxy_obj, scattering=False):
+    """Give the planes of a proxy the area per material of the original
+
+    The area of each plane is scaled so each material keeps its total area,
+    and so its absorption area (materials the proxy lost entirely can not be
+    compensated). With `scattering`, the area fraction a
+    material lost is also added to its scattering, as the removed detail
+    scattered the sound it did not absorb.
+    """
+    comp = proxy_obj.get('ra_compensation')
+    if comp is None or len(comp['mat_ids']) == 0 or len(table) == 0:
+        return table
+    ids = np.array(comp['mat_ids'], dtype=np.int64)
+    areas = np.array(comp['areas'], dtype=np.float64)
+    proxy_areas = np.array(comp['proxy_areas'], dtype=np.float64)
+
+    rows = np.clip(np.searchsorted(ids, table.mat_ids), 0, len(ids) - 1)
+    known = (ids[rows] == table.mat_ids) & (proxy_areas[rows] > 0)
+    scale = np.where(
+        known, areas[rows] / np.maximum(proxy_areas[rows], 1e-12), 1.0
+    )
+    table.areas = table.areas * scale
+    if scattering:
+        lost = np.clip(1.0 - 1.0 / scale, 0.0, 1.0)
+        table.scattering = table.scattering + (1 - table.scattering) * lost
+    return table
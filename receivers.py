@@ -0,0 +1,128 @@
+import bpy
+import numpy as np
+
+from . import histograms, results
+
+
+def results_evaluator(res):
+    """`histograms.ReceiverEvaluator` of the `results.SimulationResults` res
+
+    With the surface hits of the run (see `jobs.SimulationJob`), each
+    reflection absorbs the `alpha` of its material in `meta['materials']`,
+    otherwise the mean absorption.
+    """
+    meta = res.meta
+    alpha = np.asarray(meta['mean_alpha'], dtype=np.float64)
+    hits = None
+    if 'hits' in res.arrays and 'materials' in meta:
+        ids = np.asarray(meta['materials']['ids'], dtype=np.int64)
+        # the points on no surface absorb the mean
+        alpha = np.vstack((meta['materials']['alpha'], alpha))
+        hits = [
+            histograms.material_rows(ids, h)
+            for h in results.per_source(res.sources, res.arrays['hits'])
+        ]
+    return histograms.ReceiverEvaluator(
+        res.sources, meta['sources'], alpha, meta['alg_configs'],
+        meta['air_properties'], meta['c0'], meta['n_rays'], hits=hits
+    )
+
+
+def receiver_coords(res):
+    """Position of every receiver of the `results.SimulationResults` res
+
+    That of its object, or its position in the run if it has no object of
+    that name anymore.
+    """
+    return [
+        tuple(bpy.data.objects[name].location) if name in bpy.data.objects
+        else tuple(coord)
+        for name, coord in zip(res.meta['receivers'], res.meta['recs'])
+    ]
+
+
+def reevaluate(res, evaluator, rows=None):
+    """Evaluate the receivers of `res` again with `evaluator`
+
+    Its histograms are those of the engine, which the path model of the
+    evaluator only approximates, so all the receivers are evaluated the first
+    time and `meta['reevaluated']` is set. Afterwards only the receivers of
+    `rows` are, if given. Returns the rows evaluated.
+    """
+    coords = receiver_coords(res)
+    if rows is None or not res.meta.get('reevaluated'):
+        rows = range(len(coords))
+    rows = list(rows)
+    hist = res.arrays['histograms']
+    if not hist.flags.writeable:
+        # mapped from the sidecar file
+        hist = res.arrays['histograms'] = np.array(hist)
+    hist[:, rows] = evaluator.evaluate([
+        {'coord': coords[row]} for row in rows
+    ])
+    res.meta['reevaluated'] = True
+    # the sidecar file is out of date
+    res.path = None
+    return rows
+
+
+class LiveReceivers:
+    """Re-evaluates the receivers moved after a run against its ray paths
+
+    The `depsgraph_update_post` handler calls `moved` for the receivers whose
+    transform changed; they are re-evaluated together on the next timer tick,
+    so dragging a receiver costs one evaluation per redraw. The histograms of
+    `results.current_results` are updated in place, see `reevaluate`.
+    """
+
+    def __init__(self):
+        self.results = None
+        self.evaluator = None
+        self.pending = set()
+
+    def clear(self):
+        self.results = None
+        self.evaluator = None
+        self.pending.clear()
+
+    def moved(self, name):
+        self.pending.add(name)
+        if not bpy.app.timers.is_registered(self.update):
+            bpy.app.timers.register(self.update, first_interval=0.0)
+
+    def get_evaluator(self, res):
+        if res is not self.results:
+            self.evaluator = results_evaluator(res)
+            self.results = res
+        return self.evaluator
+
+    def update(self):
+        """Timer: evaluate the pending receivers"""
+        names, self.pending = self.pending, set()
+        res = results.current_results
+        if res is None or not res.sources or 'histograms' not in res.arrays:
+            return None
+        if not all(
+            k in res.meta
+            for k in ('sources', 'receivers', 'recs', 'mean_alpha')
+        ):
+            # results of an older version
+            return None
+
+        rows = {name: i for i, name in enumerate(res.meta['receivers'])}
+        moved = [
+            rows[name] for name in names
+            if name in rows and name in bpy.data.objects
+        ]
+        if not moved:
+            return None
+        reevaluate(res, self.get_evaluator(res), moved)
+
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type in ('PROPERTIES', 'VIEW_3D'):
+                    area.tag_redraw()
+        return None
+
+
+live_receivers = LiveReceivers()
@@ -1,44 +1,434 @@
 
+import time
+
 import bpy
 import colorcet as cc
 import numpy as np
 import gpu
-from gpu_extras.batch import batch_for_shader
+
+from .profiling import Profile
+
+
+RAYS_VERTEX_SHADER = '''
+    uniform mat4 viewProjectionMatrix;
+
+    in vec3 pos;
+    in vec4 color;
+    in float order;
+    in float arrival;
+
+    out vec4 v_color;
+    out float v_order;
+    out float v_arrival;
+
+    void main()
+    {
+        v_color = color;
+        v_order = order;
+        v_arrival = arrival;
+        gl_Position = viewProjectionMatrix * vec4(pos, 1.0f);
+    }
+'''
+
+# `order` and `arrival` are interpolated along the segments: the fragments of a
+# segment of order `n` have `order` in ]n - 1, n], so comparing them to the
+# uniforms filters whole segments by order and cuts them at the wavefront.
+RAYS_FRAGMENT_SHADER = '''
+    uniform float max_order;
+    uniform float max_arrival;
+
+    in vec4 v_color;
+    in float v_order;
+    in float v_arrival;
+
+    out vec4 fragColor;
+
+    void main()
+    {
+        if (v_order > max_order || v_arrival > max_arrival) {
+            discard;
+        }
+        fragColor = v_color;
+    }
+'''
+
+# colormap of the ray energies, and the range of levels it spans in dB
+ENERGY_COLORMAP = cc.bmy
+ENERGY_RANGE = 60.0
+
+
+def tag_redraw_view3d():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+
+def ray_buffers(coord, histories):
+    """Line buffers with the paths of the rays of a source
+
+    Each ray path starts at the source `coord` and goes through the reflection
+    points of its history in `histories` (a `results.RayHistories`). Returns
+    the (n, 3) vertex positions, the (m, 2) segment indices, the (n,)
+    reflection order of each vertex (0 at the source) and the (n,) length of
+    the path travelled up to each vertex.
+    """
+    lengths = histories.lengths
+    nverts = lengths + 1
+    total = int(nverts.sum())
+    starts = np.cumsum(nverts) - nverts
+
+    first = np.zeros(total, dtype=bool)
+    first[starts] = True
+    positions = np.empty((total, 3), dtype=np.float32)
+    positions[first] = coord
+    positions[~first] = histories.points
+
+    # position of each vertex along its own ray, 0 at the source
+    order = np.arange(total) - np.repeat(starts, nverts)
+    # every vertex but the last of each ray starts a segment
+    seg_start = np.flatnonzero(order < np.repeat(lengths, nverts))
+    indices = (seg_start[:, None] + np.arange(2)[None, :]).astype(np.int32)
+
+    step = np.zeros(total, dtype=np.float64)
+    step[1:] = np.linalg.norm(np.diff(positions, axis=0), axis=1)
+    step[first] = 0.0
+    travelled = np.cumsum(step)
+    travelled -= np.repeat(travelled[starts], nverts)
+    return (
+        positions, indices, order.astype(np.float32),
+        travelled.astype(np.float32)
+    )
+
+
+def hex_colors(palette):
+    """(n, 3) RGB colors in [0, 1] of a list of '#rrggbb' strings"""
+    return np.array([
+        [int(h.lstrip('#')[i:i+2], 16) / 255.0 for i in (0, 2, 4)]
+        for h in palette
+    ], dtype=np.float32)
+
+
+def colormap(values, lo, hi, palette):
+    """(n, 4) RGBA colors of `values` mapped linearly from [lo, hi] over the
+    colors of `palette`, a colorcet palette"""
+    colors = hex_colors(palette)
+    span = max(hi - lo, 1e-12)
+    index = np.clip((np.asarray(values) - lo) / span, 0.0, 1.0)
+    rgb = colors[np.round(index * (len(colors) - 1)).astype(np.int64)]
+    return np.concatenate(
+        (rgb, np.ones((len(rgb), 1), dtype=np.float32)), axis=1
+    )
+
+
+def ray_levels(orders, travelled, alpha, attenuation):
+    """Energy level in dB of the rays at their vertices, 0 at emission
+
+    The band average of the energy left after `orders` reflections absorbing
+    `alpha` (per band) and the air `attenuation` (per band, in 1/m) along the
+    `travelled` path.
+    """
+    reflection, attenuation = np.broadcast_arrays(
+        np.log1p(-np.minimum(alpha, 1.0 - 1e-12)), attenuation
+    )
+    energy = np.zeros(len(orders), dtype=np.float64)
+    for r, m in zip(reflection, attenuation):
+        energy += np.exp(orders * r - travelled * m)
+    energy /= max(1, len(reflection))
+    return 10.0 * np.log10(np.maximum(energy, 1e-30))
+
+
+def ray_ranges(orders):
+    """Vertex and segment offsets of each ray in the `ray_buffers` buffers"""
+    starts = np.flatnonzero(orders == 0)
+    nverts = np.diff(np.append(starts, len(orders)))
+    vert_offsets = np.append(starts, len(orders))
+    seg_offsets = np.concatenate(([0], np.cumsum(nverts - 1)))
+    return vert_offsets, seg_offsets
+
+
+def ray_bounds(positions, vert_offsets):
+    """Axis aligned bounding box of each ray path"""
+    if len(positions) == 0:
+        return np.zeros((0, 3), np.float32), np.zeros((0, 3), np.float32)
+    starts = vert_offsets[:-1]
+    return (
+        np.minimum.reduceat(positions, starts, axis=0),
+        np.maximum.reduceat(positions, starts, axis=0),
+    )
+
+
+def frustum_visible(matrix, lo, hi):
+    """Which of the boxes (`lo`, `hi`) intersect the view frustum of `matrix`
+
+    `matrix` is the view projection matrix, the frustum planes are extracted
+    from its rows (Gribb & Hartmann).
+    """
+    m = np.asarray(matrix, dtype=np.float64)
+    planes = np.array([
+        m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1],
+        m[3] + m[2], m[3] - m[2]
+    ])
+    normals = planes[None, :, :3]
+    # the box corner farthest along each plane normal
+    corner = np.where(normals > 0, hi[:, None, :], lo[:, None, :])
+    return ((corner * normals).sum(axis=2) + planes[:, 3] >= 0).all(axis=1)
+
+
+def lod_segments(seg_offsets, priority, budget, visible=None):
+    """Segments of the rays drawn within a `budget` of segments
+
+    Whole rays are picked in `priority` order, skipping those not `visible`,
+    until the budget is spent (a budget of 0 draws every ray).
+    """
+    rays = priority if visible is None else priority[visible[priority]]
+    counts = np.diff(seg_offsets)[rays]
+    if budget > 0:
+        n = np.searchsorted(np.cumsum(counts), budget, side='right')
+        rays, counts = rays[:n], counts[:n]
+    firsts = np.repeat(seg_offsets[rays], counts)
+    ends = np.cumsum(counts)
+    steps = np.arange(counts.sum()) - np.repeat(ends - counts, counts)
+    return firsts + steps
 
 
 class RenderingManager:
+    """Draws the ray paths of the last simulation in the 3D viewports
+
+    The ray buffers of all the sources are packed in a single vertex buffer,
+    uploaded once per simulation, when first drawn (so memory mapped results
+    are only read if they are shown), and drawn in a single call. Each vertex
+    has a color: that of its source, or, with the `ENERGY` colors, the level
+    of the energy left in its ray mapped through `ENERGY_COLORMAP`. The
+    reflection order and the arrival time of each vertex are vertex
+    attributes filtered in the fragment shader, so changing the rendering
+    order or time only updates uniforms.
+
+    At most `budget` segments are drawn, picking whole rays in a fixed random
+    order. With `coarse`, a fraction of them is drawn while a view is moving,
+    and the full budget once it stops; with `cull`, only the rays in the view
+    frustum are considered when refining a view.
+
+    The upload is timed in `profile`, a `profiling.Profile`, if set.
+    """
+
+    # fraction of the budget drawn while navigating
+    COARSE_FRACTION = 1 / 16
+    # seconds a view has to stay still before it is refined
+    REFINE_DELAY = 0.25
+
     def __init__(self):
         self.gldraw_handler = None
         self.sources = None
         self.max_order = 2
+        self.order = 2
+        self.budget = 0
+        self.cull = False
+        self.coarse = False
+        self.colors = 'SOURCE'
+        self.shader = None
+        self.c0 = 343.0
+        self.alpha = None
+        self.attenuation = None
+        self.draw_data = None  # None until uploaded
+        self.views = {}  # region pointer -> view state
+        self.profile = None
 
-    def set_sources(self, sources):
+    def set_sources(self, sources, c0=343.0, alpha=None, attenuation=None):
+        """Set the ray paths to draw, those of `sources`
+
+        `c0` is the speed of sound, used to convert path lengths to arrival
+        times. `alpha` and `attenuation`, the mean absorption of the surfaces
+        and the air attenuation per band, give the energy of the rays.
+        """
         self.sources = sources
+        self.c0 = c0
+        self.alpha = np.zeros(1) if alpha is None else np.asarray(alpha)
+        self.attenuation = (
+            np.zeros(1) if attenuation is None else np.asarray(attenuation)
+        )
+        self.draw_data = None
+        self.views.clear()
         self.dereg_draw_callback()
-        # FIXME: using the first source refpts hist to set the maximum order
-        # allowed, this is not ideal, a per source solution should be
-        # considered...
-        self.max_order = len(sources[0].rays[0].refpts_hist) + 1
-
-        rays = []
-        for si, s in enumerate(sources):
-            nhist = len(s.rays[0].refpts_hist) + 1
-            rays.append({
-                'positions': np.zeros((len(s.rays)*nhist, 3), dtype=np.float32),
-                'indices': np.zeros((len(s.rays)*(nhist-1), 2), dtype=np.int32)
-            })
-            for ri, r in enumerate(s.rays):
-                rays[si]['positions'][ri*nhist] = s.coord
-                fro, to = ri*nhist+1, ri*nhist+1 + nhist-1
-                rays[si]['positions'][fro:to] = r.refpts_hist
-                fro, to = ri*(nhist-1), ri*(nhist-1) + nhist-1
-                rays[si]['indices'][fro:to, 0] = np.arange(
-                    ri*nhist, ri*nhist + nhist-1
-                )
-                rays[si]['indices'][fro:to, 1] = np.arange(
-                    ri*nhist + 1, ri*nhist + nhist
+        self.max_order = max(
+            (int(s.histories.lengths.max(initial=0)) for s in sources),
+            default=0
+        ) + 1
+
+    def set_colors(self, colors):
+        """Color the rays by 'SOURCE' or by 'ENERGY'"""
+        if colors == self.colors:
+            return
+        self.colors = colors
+        if self.draw_data is not None:
+            # uploaded again on the next draw
+            self.draw_data = None
+            self.views.clear()
+            tag_redraw_view3d()
+
+    def clear(self):
+        self.dereg_draw_callback()
+        self.sources = None
+        self.draw_data = None
+        self.views.clear()
+        self.profile = None
+
+    def upload(self):
+        profile = self.profile if self.profile is not None else Profile()
+        with profile.stage(
+            "gpu upload", sources=len(self.sources), colors=self.colors
+        ) as record:
+            self.draw_data = self.build_buffers()
+            record['vertices'] = self.draw_data['vertices']
+            record['segments'] = int(self.draw_data['seg_offsets'][-1])
+        self.update_lod()
+
+    def vertex_colors(self, si, orders, travelled):
+        if self.colors == 'ENERGY':
+            levels = ray_levels(
+                orders, travelled, self.alpha, self.attenuation
+            )
+            return colormap(levels, -ENERGY_RANGE, 0.0, ENERGY_COLORMAP)
+        color = colormap([0.0], 0.0, 1.0, [cc.glasbey[si % len(cc.glasbey)]])
+        return np.repeat(color, len(orders), axis=0)
+
+    def build_buffers(self):
+        if self.shader is None:
+            self.shader = gpu.types.GPUShader(
+                RAYS_VERTEX_SHADER, RAYS_FRAGMENT_SHADER
+            )
+
+        # the buffers of every source are filled in place, one source at a
+        # time, so only one source's temporaries are alive at once
+        total = sum(
+            len(s.histories) + int(s.histories.offsets[-1])
+            for s in self.sources
+        )
+        positions = np.empty((total, 3), dtype=np.float32)
+        colors = np.empty((total, 4), dtype=np.float32)
+        orders = np.empty(total, dtype=np.float32)
+        arrival = np.empty(total, dtype=np.float32)
+        start = 0
+        for si, s in enumerate(self.sources):
+            p, _, o, t = ray_buffers(s.coord, s.histories)
+            end = start + len(p)
+            positions[start:end] = p
+            colors[start:end] = self.vertex_colors(si, o, t)
+            orders[start:end] = o
+            arrival[start:end] = t / self.c0
+            start = end
+            del p, o, t
+
+        vbo = gpu.types.GPUVertBuf(len=total, format=self.shader.format_calc())
+        vbo.attr_fill(id='pos', data=positions)
+        vbo.attr_fill(id='color', data=colors)
+        vbo.attr_fill(id='order', data=orders)
+        vbo.attr_fill(id='arrival', data=arrival)
+
+        # only what the LOD needs is kept once the buffer is uploaded, the
+        # ray histories are read straight from the results
+        vert_offsets, seg_offsets = ray_ranges(orders)
+        lo, hi = ray_bounds(positions, vert_offsets)
+        return {
+            'vbo': vbo,
+            'vertices': total,
+            'seg_offsets': seg_offsets,
+            # the rays of all the sources are mixed, so any budget is shared
+            # by the sources proportionally to their number of rays
+            'priority': np.random.RandomState(0).permutation(
+                len(seg_offsets) - 1
+            ),
+            'lo': lo,
+            'hi': hi,
+        }
+
+    def set_lod(self, budget, cull=False, coarse=False):
+        """Draw at most `budget` segments (0 for all of them)"""
+        self.budget = budget
+        self.cull = cull
+        self.coarse = coarse
+        self.update_lod()
+        tag_redraw_view3d()
+
+    def update_lod(self):
+        d = self.draw_data
+        if d is None:
+            return
+        d['budgeted'] = self.batch(d, lod_segments(
+            d['seg_offsets'], d['priority'], self.budget
+        ))
+        budget = self.budget or int(d['seg_offsets'][-1])
+        d['coarse'] = self.batch(d, lod_segments(
+            d['seg_offsets'], d['priority'],
+            max(1, int(budget * self.COARSE_FRACTION))
+        )) if self.coarse else None
+        self.views.clear()
+
+    @staticmethod
+    def batch(d, segments):
+        if len(segments) == 0:
+            return None
+        # each ray has one more vertex than segments: the segments of ray `i`
+        # start at their own index plus `i`
+        rays = np.searchsorted(d['seg_offsets'], segments, side='right') - 1
+        first = (segments + rays).astype(np.int32)
+        ibo = gpu.types.GPUIndexBuf(
+            type='LINES', seq=np.stack((first, first + 1), axis=1)
+        )
+        return gpu.types.GPUBatch(type='LINES', buf=d['vbo'], elem=ibo)
+
+    def view_batch(self, region, matrix):
+        """Batch to draw in `region`, depending on whether its view moves"""
+        d = self.draw_data
+        if not (self.cull or self.coarse):
+            return d['budgeted']
+
+        view = tuple(map(tuple, matrix))
+        state = self.views.get(region.as_pointer())
+        if state is None or state['view'] != view:
+            state = {
+                'view': view,
+                'since': time.monotonic(),
+                'refined': False,
+                'batch': None,
+            }
+            self.views[region.as_pointer()] = state
+            if not bpy.app.timers.is_registered(self.refine):
+                bpy.app.timers.register(
+                    self.refine, first_interval=self.REFINE_DELAY
                 )
-        self.rays = rays
+
+        if state['refined']:
+            return state['batch']
+        if self.coarse:
+            return d['coarse']
+        return d['budgeted']
+
+    def refine(self):
+        """Timer: rebuild the batches of the views that stopped moving"""
+        d = self.draw_data
+        if d is None:
+            return None
+        now = time.monotonic()
+        pending = refined = False
+        for state in self.views.values():
+            if state['refined']:
+                continue
+            if now - state['since'] < self.REFINE_DELAY:
+                pending = True
+                continue
+            if self.cull:
+                state['batch'] = self.batch(d, lod_segments(
+                    d['seg_offsets'], d['priority'], self.budget,
+                    frustum_visible(state['view'], d['lo'], d['hi'])
+                ))
+            else:
+                state['batch'] = d['budgeted']
+            state['refined'] = refined = True
+
+        if refined:
+            tag_redraw_view3d()
+        return self.REFINE_DELAY if pending else None
 
     def dereg_draw_callback(self):
         if self.gldraw_handler is not None:
@@ -48,42 +438,40 @@ class RenderingManager:
             self.gldraw_handler = None
 
     def reg_draw_callback(self, order, render=True):
+        """Show (or hide) the rays, drawing reflections up to `order` only"""
+        self.order = order
         if self.sources is None:
             return
 
-        self.dereg_draw_callback()
-        if render:
-            indices_eff = []
-            for si, s in enumerate(self.sources):
-                nhist = len(s.rays[0].refpts_hist) + 1
-                idx_eff = self.rays[si]['indices']
-                idx_eff = idx_eff.reshape((idx_eff.shape[0]//(nhist-1), -1))
-                idx_eff = idx_eff[:, :order*2].reshape((-1, 2))
-                indices_eff.append(idx_eff)
-
-            shader = gpu.shader.from_builtin('3D_UNIFORM_COLOR')
-            draw_data = []
-            for ri, r in enumerate(self.rays):
-                h = cc.glasbey[ri % len(cc.rainbow)].lstrip('#')
-                draw_data.append({
-                        'batch': batch_for_shader(
-                            shader, 'LINES',
-                            {'pos': r['positions']}, indices=indices_eff[ri]
-                        ),
-                        'color': tuple(
-                            int(h[i:i+2], 16) / 256.0 for i in (0, 2, 4)
-                        ) + (1,)
-                })
-
-            def draw():
-                shader.bind()
-                for d in draw_data:
-                    shader.uniform_float("color", d['color'])
-                    d['batch'].draw(shader)
-
+        if not render:
+            self.dereg_draw_callback()
+        elif self.gldraw_handler is None:
             self.gldraw_handler = bpy.types.SpaceView3D.draw_handler_add(
-                draw, (), 'WINDOW', 'POST_VIEW'
+                self.draw, (), 'WINDOW', 'POST_VIEW'
             )
+        tag_redraw_view3d()
+
+    def draw(self):
+        # read at draw time, so the wavefront follows an animated property
+        scene_ra = bpy.context.scene.ra
+        max_arrival = 1e30
+        if scene_ra.render_wavefront:
+            max_arrival = scene_ra.render_time
+
+        if self.draw_data is None:
+            self.upload()
+
+        matrix = bpy.context.region_data.perspective_matrix
+        batch = self.view_batch(bpy.context.region, matrix)
+        if batch is None:
+            return
+
+        shader = self.shader
+        shader.bind()
+        shader.uniform_float("viewProjectionMatrix", matrix)
+        shader.uniform_float("max_order", float(self.order))
+        shader.uniform_float("max_arrival", max_arrival)
+        batch.draw(shader)
 
 
 rendering_man = RenderingManager()
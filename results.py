@@ -0,0 +1,262 @@
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+
+# header of the memory mapped results files, see `save_mapped`
+MAGIC = b'RARESULT'
+VERSION = 1
+ALIGNMENT = 64
+
+
+def allocate(shape, path=None):
+    """Empty float32 array, memory mapped to the .npy file `path` if given"""
+    if path is None:
+        return np.empty(shape, dtype=np.float32)
+    return np.lib.format.open_memmap(
+        str(path), mode='w+', dtype=np.float32, shape=shape
+    )
+
+
+class RayHistories:
+    """Reflection points of the rays of a source, in one contiguous array
+
+    The points of ray `i` are `points[offsets[i]:offsets[i + 1]]`, so ragged
+    histories take a single float32 allocation (or memory mapped file) and are
+    read by rendering and post-processing without copies.
+    """
+
+    def __init__(self, points, offsets):
+        self.points = points  # (n, 3) float32
+        self.offsets = offsets  # (n_rays + 1,) int64
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.points.nbytes + self.offsets.nbytes
+
+    @classmethod
+    def from_rays(cls, rays, path=None):
+        """Store the `refpts_hist` of engine rays"""
+        lengths = [len(r.refpts_hist) for r in rays]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        points = allocate((int(offsets[-1]), 3), path)
+        for r, a, b in zip(rays, offsets[:-1], offsets[1:]):
+            points[a:b] = np.reshape(r.refpts_hist, (-1, 3))
+        return cls(points, offsets)
+
+    @classmethod
+    def concatenate(cls, parts, path=None):
+        offsets = [np.zeros(1, dtype=np.int64)]
+        total = 0
+        for p in parts:
+            offsets.append(p.offsets[1:] + total)
+            total += int(p.offsets[-1])
+        points = allocate((total, 3), path)
+        if parts:
+            np.concatenate([p.points for p in parts], out=points)
+        return cls(points, np.concatenate(offsets))
+
+
+class SourceResult:
+    """The ray histories traced from a source"""
+
+    def __init__(self, coord, histories):
+        self.coord = coord
+        self.histories = histories
+
+    @classmethod
+    def from_engine(cls, source, path=None):
+        """Copy out the results of an engine source, which can then be freed"""
+        return cls(
+            tuple(source.coord), RayHistories.from_rays(source.rays, path)
+        )
+
+
+class SimulationResults:
+    """The results of a run: sources, run `meta` and other result `arrays`
+
+    `path` is the file they were last written to or read from, if any.
+    """
+
+    def __init__(self, sources, meta, arrays=None, path=None):
+        self.sources = sources
+        self.meta = meta
+        self.arrays = arrays if arrays is not None else {}
+        self.path = path
+
+    def save(self, path):
+        save_mapped(path, self.sources, self.meta, **self.arrays)
+        self.path = pathlib.Path(path)
+
+    @classmethod
+    def load(cls, path):
+        return cls(*load_mapped(path), path=pathlib.Path(path))
+
+
+# the results shown in the viewports
+current_results = None
+
+
+# folders of memory mapped ray histories left to remove, see `discard_dir`
+discarded_dirs = []
+
+
+def discard_dir(path=None):
+    """Remove the folder `path` of memory mapped histories, now or later
+
+    Where mapped files can not be removed (windows), the folders are kept in
+    `discarded_dirs` and removed by the next calls, once the results mapping
+    them are released (a new run, a file loaded). Without `path`, only
+    those are.
+    """
+    if path is not None:
+        discarded_dirs.append(str(path))
+    for folder in list(discarded_dirs):
+        shutil.rmtree(folder, ignore_errors=True)
+        if not os.path.exists(folder):
+            discarded_dirs.remove(folder)
+
+
+def sidecar_path(blend_path):
+    """The results file kept next to the .blend file at `blend_path`"""
+    return pathlib.Path(blend_path).with_suffix('.ra')
+
+
+def per_source(sources, array):
+    """Split `array`, a row per reflection point of all `sources`, by source"""
+    ends = np.cumsum([int(s.histories.offsets[-1]) for s in sources])
+    return np.split(array, ends[:-1])
+
+
+def pack(sources, arrays):
+    """All the arrays of a results file, see `save_npz`"""
+    arrays = dict(arrays)
+    arrays['coords'] = np.array([s.coord for s in sources], dtype=np.float64)
+    for si, s in enumerate(sources):
+        arrays[f"points_{si}"] = s.histories.points
+        arrays[f"offsets_{si}"] = s.histories.offsets
+    return arrays
+
+
+def unpack(arrays):
+    """Inverse of `pack`, returns the sources and the other result arrays"""
+    sources = [
+        SourceResult(tuple(coord), RayHistories(
+            arrays[f"points_{si}"], arrays[f"offsets_{si}"]
+        ))
+        for si, coord in enumerate(arrays['coords'])
+    ]
+    others = {
+        k: v for k, v in arrays.items()
+        if k not in ('meta', 'coords')
+        and not k.startswith(('points_', 'offsets_'))
+    }
+    return sources, others
+
+
+def save_npz(path, sources, meta, **arrays):
+    """Write the ray histories of `sources` and the run `meta` to a .npz file
+
+    The histories of source `i` are stored in `points_i` and `offsets_i`, see
+    `RayHistories`. Any other result `arrays` are stored as given.
+    """
+    np.savez(path, meta=np.array(json.dumps(meta)), **pack(sources, arrays))
+
+
+def load_npz(path):
+    """Read back a file written by `save_npz`
+
+    Returns the list of `SourceResult`, the run metadata and a dict with the
+    other result arrays.
+    """
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        sources, arrays = unpack({k: data[k] for k in data.files})
+    return sources, meta, arrays
+
+
+def save_mapped(path, sources, meta, **arrays):
+    """Write the same contents as `save_npz` to a file that can be mapped
+
+    The file starts with `MAGIC`, the length of a JSON header (uint64) and the
+    header, with the run `meta` and the dtype, shape and offset of every
+    array. The raw arrays follow, aligned. It is written aside and renamed, so
+    maps of a previous version of the file stay valid.
+    """
+    path = pathlib.Path(path)
+    arrays = {
+        k: np.require(v, requirements='C')
+        for k, v in pack(sources, arrays).items()
+    }
+    entries = {}
+    offset = 0
+    for k, v in arrays.items():
+        entries[k] = {
+            'dtype': v.dtype.str, 'shape': list(v.shape), 'offset': offset
+        }
+        offset += -(-v.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({
+        'version': VERSION, 'meta': meta, 'arrays': entries
+    }).encode()
+    start = len(MAGIC) + 8 + len(header)
+    padding = -start % ALIGNMENT
+
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(header) + padding).tobytes())
+            f.write(header + b' ' * padding)
+            for k, v in arrays.items():
+                # straight from the (maybe mapped) array, with no copy
+                v.tofile(f)
+                f.write(b'\0' * (-v.nbytes % ALIGNMENT))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_mapped(path):
+    """Map a file written by `save_mapped`, read only
+
+    Only the header is read, the arrays are paged in as they are accessed.
+    Returns the same as `load_npz`.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a results file: {path}")
+        size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(size))
+    if header['version'] > VERSION:
+        raise ValueError(f"Unsupported results file version: {path}")
+
+    start = len(MAGIC) + 8 + size
+    arrays = {}
+    for k, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        if 0 in shape:
+            # an empty map is not allowed
+            arrays[k] = np.zeros(shape, dtype=dtype)
+            continue
+        # (mapped as 1d, which also works for 0d arrays)
+        arrays[k] = np.memmap(
+            path, dtype=dtype, mode='r', offset=start + entry['offset'],
+            shape=int(np.prod(shape))
+        ).reshape(shape)
+    sources, arrays = unpack(arrays)
+    return sources, header['meta'], arrays
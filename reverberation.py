@@ -0,0 +1,126 @@
+import time
+
+import bpy
+import numpy as np
+
+from . import histograms, simulation
+from .materials import RAMaterialError
+from .rendering import tag_redraw_view3d
+
+# seconds without changes before the preview is computed again
+PREVIEW_DELAY = 0.3
+
+
+def room_volume(planes):
+    """Volume enclosed by `planes`, by the divergence theorem
+
+    The sum over the planes of their vector area dotted with one of their
+    vertices, over 3. The areas are those of the polygons themselves, not the
+    `areas` of the table, which proxies compensate. Only meaningful for a
+    closed room, its normals all pointing in or all out.
+    """
+    if len(planes) == 0:
+        return 0.0
+    stacked, offsets = planes.polygons()
+    following = np.arange(1, len(stacked) + 1)
+    following[offsets[1:] - 1] = offsets[:-1]
+    vector_areas = 0.5 * np.add.reduceat(
+        np.cross(stacked, stacked[following]), offsets[:-1], axis=0
+    )
+    dots = np.einsum('ij,ij->i', vector_areas, stacked[offsets[:-1]])
+    return abs(float(dots.sum())) / 3.0
+
+
+def sabine(volume, areas, alpha, attenuation, c0):
+    """Sabine reverberation time per band [s]
+
+    `areas` are the (k,) total areas of the materials, `alpha` their (k,
+    n_bands) absorption and `attenuation` that of the air per band [1/m].
+    """
+    absorption = areas @ alpha + 4.0 * attenuation * volume
+    with np.errstate(divide='ignore'):
+        return 24.0 * np.log(10.0) * volume / (c0 * absorption)
+
+
+def eyring(volume, areas, alpha, attenuation, c0):
+    """Eyring reverberation time per band [s], see `sabine`"""
+    total = areas.sum()
+    mean = areas @ alpha / max(total, 1e-12)
+    absorption = (
+        -total * np.log1p(-np.minimum(mean, 1.0 - 1e-12))
+        + 4.0 * attenuation * volume
+    )
+    with np.errstate(divide='ignore'):
+        return 24.0 * np.log(10.0) * volume / (c0 * absorption)
+
+
+def statistical(planes, air_properties, freq=simulation.FREQ):
+    """Statistical reverberation of the room of `planes`
+
+    Returns its volume, its surface area and its Sabine and Eyring
+    reverberation times per band of `freq`.
+    """
+    _, alpha, areas = histograms.material_alpha(planes)
+    attenuation = histograms.air_attenuation(
+        freq, air_properties['Temperature'], air_properties['hr'],
+        air_properties['p_atm']
+    )
+    c0 = simulation.sound_speed(air_properties['Temperature'])
+    volume = room_volume(planes)
+    return (
+        volume, float(areas.sum()),
+        sabine(volume, areas, alpha, attenuation, c0),
+        eyring(volume, areas, alpha, attenuation, c0)
+    )
+
+
+class ReverberationPreview:
+    """Statistical reverberation times of the scene, kept up to date
+
+    Changes to the geometry, the materials or the air `request` an update,
+    computed once they stop for `PREVIEW_DELAY` seconds, from the planes of
+    `simulation.collect` (so from the geometry cache, for the meshes that did
+    not change). Coplanar triangles are not merged, which would not change
+    the result, and the cache is left for the runs to prune.
+    """
+
+    def __init__(self):
+        self.volume = None
+        self.area = None
+        self.sabine = None  # per band
+        self.eyring = None
+        self.error = None
+        self.requested = 0.0
+
+    def request(self):
+        self.requested = time.monotonic()
+        if not bpy.app.timers.is_registered(self.update):
+            bpy.app.timers.register(self.update, first_interval=PREVIEW_DELAY)
+
+    def update(self):
+        """Timer: compute the preview, once the changes stopped"""
+        wait = self.requested + PREVIEW_DELAY - time.monotonic()
+        if wait > 0:
+            return wait
+        scene = bpy.context.scene
+        if scene is not None and scene.ra.reverb_preview:
+            self.compute(scene)
+            tag_redraw_view3d()
+        return None
+
+    def compute(self, scene):
+        self.error = None
+        try:
+            planes, _, _ = simulation.collect(
+                scene, merge=False, prune=False
+            )
+        except RAMaterialError as e:
+            self.error = str(e)
+            self.sabine = self.eyring = None
+            return
+        self.volume, self.area, self.sabine, self.eyring = statistical(
+            planes, simulation.air_properties(scene)
+        )
+
+
+reverb_preview = ReverberationPreview()
@@ -0,0 +1,40 @@
+"""Running the modules of the add-on as `blender --python` scripts
+
+`cli.py` and `benchmark.py` are executed by blender as plain scripts, and
+import this module from the add-on folder before the add-on package is
+loaded, so it imports neither `bpy` nor the package.
+"""
+import importlib
+import importlib.util
+import pathlib
+import sys
+
+
+def run(path, name):
+    """Run `main()` of the module `name` of the add-on, from its script `path`
+
+    Loads the add-on package from the folder of `path` and imports the module
+    from within it, so its relative imports work. Returns the exit status.
+    """
+    addon_dir = pathlib.Path(path).resolve().parent
+    spec = importlib.util.spec_from_file_location(
+        addon_dir.name.replace('-', '_'), addon_dir / '__init__.py',
+        submodule_search_locations=[str(addon_dir)]
+    )
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = addon
+    spec.loader.exec_module(addon)
+    # the worker processes of `parallel.pool` would run the main module again
+    # by its path, and the scripts can only run in blender
+    del sys.modules['__main__'].__file__
+    return importlib.import_module(f"{spec.name}.{name}").main()
+
+
+def script_args(argv=None):
+    """The arguments of the script in `argv` (default `sys.argv`)
+
+    Blender's own arguments come before `--`.
+    """
+    if argv is None:
+        argv = sys.argv
+    return argv[argv.index('--') + 1:] if '--' in argv else []
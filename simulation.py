@@ -0,0 +1,106 @@
+from . import geometry, materials, proxy
+
+FREQ = [63.0, 125.0, 250.0, 500.0, 1000.0, 2000.0, 4000.0, 8000.0]
+
+
+def sound_speed(temperature):
+    """Speed of sound in air [m/s], at `temperature` [C]"""
+    return 331.3 * (1.0 + temperature / 273.15) ** 0.5
+
+
+def alg_configs(scene):
+    return {
+        'freq': list(FREQ),
+        'n_rays': scene.ra.nrays,
+        'ht_length': scene.ra.ht_length,
+        'dt': scene.ra.dt,
+        'allow_scattering': int(scene.ra.allow_scattering),
+        'transition_order': scene.ra.transition_order,
+        'rec_radius_init': scene.ra.rec_radius_init,
+        'allow_growth': int(scene.ra.allow_growth),
+        'rec_radius_final': scene.ra.rec_radius_final
+    }
+
+
+def air_properties(scene):
+    return {
+        'Temperature': scene.ra.temperature,
+        'hr': scene.ra.hr,
+        'p_atm': scene.ra.p_atm
+    }
+
+
+def sources(scene):
+    """The enabled SOURCE objects of `scene`, in the order of `collect`"""
+    return [
+        obj for obj in scene.objects
+        if obj.ra.enable and obj.ra.nature == 'SOURCE'
+    ]
+
+
+def receivers(scene):
+    """The enabled RECEIVER objects of `scene`, in the order of `collect`"""
+    return [
+        obj for obj in scene.objects
+        if obj.ra.enable and obj.ra.nature == 'RECEIVER'
+    ]
+
+
+def receiver_grids(scene):
+    """The enabled RECEIVER_GRID mesh objects of `scene`"""
+    return [
+        obj for obj in scene.objects
+        if obj.ra.enable and obj.ra.nature == 'RECEIVER_GRID'
+        and obj.type == 'MESH'
+    ]
+
+
+def collect(scene, merge=True, prune=True):
+    """Planes, sources and receivers of the enabled objects of `scene`
+
+    Coplanar triangles are merged if the scene asks for it and `merge`. With
+    `prune`, the geometry cache drops the objects no longer in the scene.
+
+    Raises `materials.RAMaterialError` if a GEOM object has no valid material.
+    """
+    resolver = materials.material_resolver
+    resolver.update(scene.ra.mat_db)
+
+    cache = geometry.geometry_cache
+    tolerance = None
+    if merge and scene.ra.merge_coplanar:
+        tolerance = scene.ra.merge_tolerance
+
+    tables = []
+    recs = []
+    srcs = []
+    for obj in scene.objects:
+        if obj.ra.enable:
+            if obj.ra.nature == 'GEOM' and obj.type == 'MESH':
+                proxy_obj = obj.ra.proxy if obj.ra.use_proxy else None
+                if proxy_obj is not None and proxy_obj.type == 'MESH':
+                    tables.append(proxy.compensate(geometry.extract_mesh(
+                        proxy_obj, resolver, cache, tolerance
+                    ), proxy_obj, obj.ra.proxy_scattering))
+                else:
+                    tables.append(geometry.extract_mesh(
+                        obj, resolver, cache, tolerance
+                    ))
+            elif obj.ra.nature == 'SOURCE':
+                srcs.append({
+                    'coord': tuple(obj.location),
+                    'orientation': [0.0, 1.0, 0.0],
+                    'power_dB': list(obj.ra.power_db),
+                    'eq_dB': list(obj.ra.eq_db),
+                    'delay': obj.ra.delay,
+                })
+            elif obj.ra.nature == 'RECEIVER':
+                recs.append({
+                    'coord': tuple(obj.location),
+                    'orientation': [0.0, 1.0, 0.0]
+                })
+
+    planes = geometry.PlaneTable.concatenate(tables)
+    if prune:
+        cache.prune(name for name, _ in planes.names)
+    return planes, srcs, recs
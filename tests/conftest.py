@@ -0,0 +1,6 @@
+import pathlib
+import sys
+
+# the modules tested import neither blender nor the add-on package, so they
+# are imported on their own, from the add-on folder
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
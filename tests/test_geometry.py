@@ -0,0 +1,146 @@
+import numpy as np
+
+import geometry
+
+UP = (0.0, 0.0, 1.0)
+
+
+def squares(cells, z=0.0):
+    """Two triangles per unit square of the (x, y) `cells`, facing up"""
+    tris = []
+    for x, y in cells:
+        a, b, c, d = (x, y, z), (x + 1, y, z), (x + 1, y + 1, z), (x, y + 1, z)
+        tris += [(a, b, c), (a, c, d)]
+    vertices = np.array(tris, dtype=np.float64)
+    normals = np.tile(np.array(UP, dtype=np.float32), (len(vertices), 1))
+    return (
+        vertices, normals, geometry.triangle_areas(vertices),
+        np.zeros(len(vertices), dtype=np.int32)
+    )
+
+
+def merge(vertices, normals, areas, slot_index):
+    return geometry.merge_coplanar(vertices, normals, areas, slot_index, 1e-4)
+
+
+def polygons(merged):
+    stacked, offsets = merged[0], merged[1]
+    return [stacked[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def polygon_area(poly, normal):
+    cross = np.cross(poly, np.roll(poly, -1, axis=0)).sum(axis=0)
+    return 0.5 * float(np.dot(cross, normal))
+
+
+def is_convex(poly, normal):
+    turns = np.einsum(
+        'ij,j->i', np.cross(
+            np.roll(poly, -1, axis=0) - poly,
+            np.roll(poly, -2, axis=0) - np.roll(poly, -1, axis=0)
+        ), normal
+    )
+    return bool((turns > 1e-9).all())
+
+
+def table(merged):
+    stacked, offsets, normals, areas, slot_index = merged
+    n = len(areas)
+    return geometry.PlaneTable(
+        vertices=stacked, offsets=offsets, normals=normals, areas=areas,
+        mat_ids=np.asarray(slot_index, dtype=np.int64),
+        alpha=np.zeros((n, 8), dtype=np.float32),
+        scattering=np.zeros(n)
+    )
+
+
+def test_merge_coplanar_square():
+    merged = merge(*squares([(0, 0)]))
+    polys = polygons(merged)
+    assert len(polys) == 1
+    assert len(polys[0]) == 4
+    assert is_convex(polys[0], UP)
+    assert np.isclose(merged[3][0], 1.0)
+    assert np.isclose(polygon_area(polys[0], UP), 1.0)
+
+
+def test_merge_coplanar_keeps_polygons_convex_and_areas():
+    # an L shape can not be a single convex polygon
+    cells = [(0, 0), (1, 0), (2, 0), (0, 1), (0, 2)]
+    merged = merge(*squares(cells))
+    polys = polygons(merged)
+    assert 1 < len(polys) < 2 * len(cells)
+    assert all(is_convex(p, UP) for p in polys)
+    assert np.isclose(merged[3].sum(), len(cells))
+    assert np.allclose([polygon_area(p, UP) for p in polys], merged[3])
+
+
+def test_merge_coplanar_separates_slots_and_planes():
+    vertices, normals, areas, slot_index = squares([(0, 0), (1, 0)])
+    slot_index[2:] = 1
+    merged = merge(vertices, normals, areas, slot_index)
+    assert sorted(merged[4].tolist()) == [0, 1]
+
+    vertices, normals, areas, slot_index = squares([(0, 0), (1, 0)])
+    vertices[2:, :, 2] += 0.5
+    merged = merge(vertices, normals, areas, slot_index)
+    assert len(polygons(merged)) == 2
+
+
+def test_merge_coplanar_welds_close_vertices():
+    vertices, normals, areas, slot_index = squares([(0, 0)])
+    vertices[1] += 1e-6
+    merged = merge(vertices, normals, areas, slot_index)
+    assert len(polygons(merged)) == 1
+    assert np.isclose(merged[3].sum(), areas.sum())
+
+
+def test_merge_coplanar_degenerate_triangles():
+    sliver = np.array([[(0, 0, 0), (0.5, 0, 0), (1, 0, 0)]], dtype=np.float64)
+    up = np.array([UP], dtype=np.float32)
+    merged = merge(
+        sliver, up, geometry.triangle_areas(sliver),
+        np.zeros(1, dtype=np.int32)
+    )
+    assert len(polygons(merged)) == 1
+    assert len(polygons(merged)[0]) == 3
+
+    # along the edge of a square, it is merged into it
+    vertices, normals, areas, slot_index = squares([(0, 0)])
+    vertices = np.concatenate((vertices, sliver))
+    normals = np.concatenate((normals, up))
+    areas = geometry.triangle_areas(vertices)
+    slot_index = np.zeros(3, dtype=np.int32)
+    merged = merge(vertices, normals, areas, slot_index)
+    assert [len(p) for p in polygons(merged)] == [4]
+    assert np.isclose(merged[3].sum(), 1.0)
+
+
+def test_locate_hits():
+    cells = [(0, 0), (1, 0), (2, 0), (0, 1), (0, 2)]
+    merged = merge(*squares(cells))
+    planes = table(merged)
+    centers = [np.mean(p, axis=0) for p in polygons(merged)]
+    hits = geometry.locate_hits(np.array(centers), planes)
+    assert hits.tolist() == list(range(len(centers)))
+
+    points = np.array([
+        (0.5, 2.5, 2e-4),  # within the tolerance of the plane
+        (0.5, 0.5, 0.1),  # off every plane
+    ])
+    hits = geometry.locate_hits(points, planes)
+    assert hits[1] == -1
+    inside = polygons(merged)[hits[0]]
+    assert (inside.min(axis=0)[:2] <= (0.5, 2.5)).all()
+    assert (inside.max(axis=0)[:2] >= (0.5, 2.5)).all()
+
+
+def test_locate_hits_of_triangles():
+    vertices, normals, areas, slot_index = squares([(0, 0)])
+    planes = geometry.PlaneTable(
+        vertices=vertices, normals=normals, areas=areas,
+        mat_ids=np.zeros(2, dtype=np.int64),
+        alpha=np.zeros((2, 8), dtype=np.float32), scattering=np.zeros(2)
+    )
+    points = np.array([(0.9, 0.1, 0.0), (0.1, 0.9, 0.0), (0.5, 0.5, 1.0)])
+    assert geometry.locate_hits(points, planes).tolist() == [0, 1, -1]
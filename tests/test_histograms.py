@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+import histograms
+from results import RayHistories
+
+ALG_CONFIGS = {
+    'freq': [500.0, 1000.0],
+    'ht_length': 0.1,
+    'dt': 0.001,
+    'rec_radius_init': 0.5,
+    'rec_radius_final': 1.0,
+    'allow_growth': False,
+}
+C0 = 343.0
+
+
+def histories(*rays):
+    """`RayHistories` of rays given as lists of points"""
+    lengths = [len(r) for r in rays]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    points = np.array(
+        [p for r in rays for p in r], dtype=np.float32
+    ).reshape((-1, 3))
+    return RayHistories(points, offsets)
+
+
+def test_ray_segments():
+    h = histories(
+        [(1, 0, 0), (1, 2, 0)],
+        [],
+        [(0, 0, 3), (0, 4, 3)],
+    )
+    a, u, length, order, travelled = histograms.ray_segments((0, 0, 0), h)
+    np.testing.assert_allclose(
+        a, [(0, 0, 0), (1, 0, 0), (0, 0, 0), (0, 0, 3)]
+    )
+    np.testing.assert_allclose(
+        u, [(1, 0, 0), (0, 1, 0), (0, 0, 1), (0, 1, 0)]
+    )
+    np.testing.assert_allclose(length, [1, 2, 3, 4])
+    np.testing.assert_array_equal(order, [0, 1, 0, 1])
+    # restarting at every ray
+    np.testing.assert_allclose(travelled, [0, 1, 0, 3])
+
+
+def test_hit_gains():
+    h = histories(
+        [(1, 0, 0), (1, 1, 0), (2, 1, 0)],
+        [(0, 1, 0), (0, 1, 1)],
+    )
+    alpha = np.array([[0.1, 0.2], [0.5, 0.6]])
+    rows = np.array([0, 1, 1, 1, 0])
+    gains = histograms.hit_gains(h, rows, alpha)
+    log = np.log1p(-alpha)
+    expected = np.array([
+        [0.0, 0.0], log[0], log[0] + log[1],
+        [0.0, 0.0], log[1],
+    ])
+    np.testing.assert_allclose(gains, expected, rtol=1e-6)
+
+
+def test_hit_gains_of_one_material_are_reflection_gains():
+    h = histories(
+        [(1, 0, 0), (1, 1, 0), (2, 1, 0)],
+        [(0, 1, 0)],
+        [(0, 2, 0), (0, 2, 2)],
+    )
+    alpha = np.array([0.3, 0.4])
+    segments = histograms.ray_segments((0, 0, 0), h)
+    np.testing.assert_allclose(
+        histograms.hit_gains(h, np.zeros(6, dtype=np.int64), alpha[None]),
+        histograms.reflection_gains(segments[3], alpha), rtol=1e-6
+    )
+
+
+def test_receiver_histograms():
+    src = {'power_dB': [90.0, 90.0], 'eq_dB': [0.0, -10.0]}
+    # a ray through the first receiver, and none through the second
+    h = histories([(10, 0, 0)])
+    segments = histograms.ray_segments((0, 0, 0), h)
+    gains = histograms.reflection_gains(segments[3], np.zeros(2))
+    recs = [{'coord': (5.0, 0.0, 0.0)}, {'coord': (5.0, 3.0, 0.0)}]
+    out = histograms.receiver_histograms(
+        segments, src, recs, gains, np.zeros(2), ALG_CONFIGS, C0
+    )
+    assert out.shape == (2, 2, 100)
+    expected = histograms.source_power(src) / (np.pi * 0.5 ** 2)
+    bin_ = int(5.0 / C0 / ALG_CONFIGS['dt'])
+    np.testing.assert_allclose(out[0, :, bin_], expected)
+    assert out[0].sum(axis=1) == pytest.approx(expected)
+    assert not out[1].any()
+
+
+def test_receiver_histograms_attenuation_and_absorption():
+    src = {'power_dB': [90.0, 90.0], 'eq_dB': [0.0, 0.0]}
+    # reflected once before passing the receiver
+    h = histories([(4, 0, 0), (4, 8, 0)])
+    segments = histograms.ray_segments((0, 0, 0), h)
+    alpha = np.array([0.2, 0.5])
+    gains = histograms.reflection_gains(segments[3], alpha)
+    attenuation = np.array([0.01, 0.02])
+    out = histograms.receiver_histograms(
+        segments, src, [{'coord': (4.0, 4.0, 0.0)}], gains, attenuation,
+        ALG_CONFIGS, C0
+    )
+    # 4 m to the wall and 4 m along it, to the point closest to the receiver
+    expected = histograms.source_power(src) * (1 - alpha) * np.exp(
+        -attenuation * 8.0
+    ) / (np.pi * 0.5 ** 2)
+    np.testing.assert_allclose(out[0].sum(axis=1), expected, rtol=1e-6)
+
+
+def test_decay_change():
+    rng = np.random.RandomState(0)
+    hist = np.exp(-np.arange(100) / 10.0) * rng.uniform(0.5, 1.0, (2, 100))
+    assert histograms.decay_change(hist, hist) == 0.0
+    # the curves are relative to the total energy
+    assert histograms.decay_change(hist, 3 * hist) == pytest.approx(0.0)
+    later = hist.copy()
+    later[:, 10:] *= 2
+    assert histograms.decay_change(hist, later) > 1.0
+
+
+def test_decay_change_of_empty_histograms():
+    hist = np.exp(-np.arange(100) / 10.0)[None]
+    empty = np.zeros_like(hist)
+    assert histograms.decay_change(empty, hist) == np.inf
+    assert histograms.decay_change(empty, empty) == np.inf